@@ -1,8 +1,7 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 import json
 import logging
-from datetime import datetime
-from soap_client import soap_client
+from soap_client import soap_client_v2
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -20,6 +19,9 @@ COFFEE_MENU = {
     'mocha': {'name': 'Mocha', 'price': 5.00, 'description': 'Espresso with chocolate and milk'}
 }
 
+# Orders shown per page on the admin order list
+ADMIN_PAGE_SIZE = 50
+
 @app.route('/')
 def main():
     """Main landing page"""
@@ -49,16 +51,16 @@ def register_guest():
             return redirect(url_for('guest_login'))
         
         # Call SOAP service to register guest
-        result = soap_client.register_guest(name, email, phone, notes)
+        result = soap_client_v2.register_guest(name, email, phone, notes)
         
-        if isinstance(result, dict) and 'id' in result:
+        if not result['error_code']:
             # Success - store user info in session
             session['user'] = result
             flash(f'Welcome {name}! You are now logged in as a guest.', 'success')
             return redirect(url_for('index'))
         else:
             # Error
-            flash(f'Registration failed: {result}', 'error')
+            flash(f'Registration failed: {result["message"]}', 'error')
             return redirect(url_for('guest_login'))
             
     except Exception as e:
@@ -86,16 +88,16 @@ def register_member():
             return redirect(url_for('member_login'))
         
         # Call SOAP service to register member
-        result = soap_client.register_member(first_name, last_name, email, phone, password)
+        result = soap_client_v2.register_member(first_name, last_name, email, phone, password)
         
-        if isinstance(result, dict) and 'id' in result:
+        if not result['error_code']:
             # Success - store user info in session
             session['user'] = result
             flash(f'Welcome {first_name}! Your account has been created successfully.', 'success')
             return redirect(url_for('index'))
         else:
             # Error
-            flash(f'Registration failed: {result}', 'error')
+            flash(f'Registration failed: {result["message"]}', 'error')
             return redirect(url_for('member_login'))
             
     except Exception as e:
@@ -115,16 +117,16 @@ def login_member():
             return redirect(url_for('member_login'))
         
         # Call SOAP service to login member
-        result = soap_client.login_member(email, password)
+        result = soap_client_v2.login_member(email, password)
         
-        if isinstance(result, dict) and 'id' in result:
+        if not result['error_code']:
             # Success - store user info in session
             session['user'] = result
             flash(f'Welcome back, {result["name"]}!', 'success')
             return redirect(url_for('index'))
         else:
             # Error
-            flash(f'Login failed: {result}', 'error')
+            flash(f'Login failed: {result["message"]}', 'error')
             return redirect(url_for('member_login'))
             
     except Exception as e:
@@ -230,34 +232,28 @@ def checkout():
     if request.method == 'POST':
         try:
             # Call SOAP service to create order
-            result = soap_client.create_order(
+            result = soap_client_v2.create_order(
                 session['user']['name'],
                 session['user']['email'],
                 cart_items
             )
             
-            if 'Order created successfully' in result:
-                # Extract order ID from result
-                import re
-                order_id_match = re.search(r'Order ID: (\d+)', result)
-                if order_id_match:
-                    order_id = int(order_id_match.group(1))
-                    
-                    # Store order info in session for payment
-                    session['current_order'] = {
-                        'id': order_id,
-                        'total': total,
-                        'items': cart_items
-                    }
-                    
-                    # Clear cart
-                    session.pop('cart', None)
-                    
-                    return redirect(url_for('payment', order_id=order_id))
-                else:
-                    flash('Error: Could not extract order ID', 'error')
+            if not result['error_code']:
+                order_id = result['order_id']
+                
+                # Store order info in session for payment
+                session['current_order'] = {
+                    'id': order_id,
+                    'total': total,
+                    'items': cart_items
+                }
+                
+                # Clear cart
+                session.pop('cart', None)
+                
+                return redirect(url_for('payment', order_id=order_id))
             else:
-                flash(f'Error creating order: {result}', 'error')
+                flash(f'Error creating order: {result["message"]}', 'error')
                 
         except Exception as e:
             logger.error(f"Error during checkout: {str(e)}")
@@ -296,21 +292,21 @@ def process_payment():
         order = session['current_order']
         
         # Call SOAP service to process payment
-        result = soap_client.process_payment(order_id, order['total'], payment_method)
+        result = soap_client_v2.process_payment(order_id, order['total'], payment_method)
         
-        if 'processed successfully' in result.lower() or 'cash payment' in result.lower():
+        if not result['error_code']:
             # Payment successful
             session.pop('current_order', None)
             return jsonify({
                 'success': True,
-                'message': result,
+                'message': result['message'],
                 'redirect_url': url_for('payment_success', order_id=order_id)
             })
         else:
             # Payment failed
             return jsonify({
                 'success': False,
-                'message': result
+                'message': result['message']
             })
             
     except Exception as e:
@@ -334,22 +330,13 @@ def order_status(order_id):
         return redirect(url_for('main'))
     
     # Call SOAP service to get order status
-    result = soap_client.get_order_status(order_id)
+    result = soap_client_v2.get_order_status(order_id)
     
-    if isinstance(result, dict):
-        # Ensure the order has the correct structure for the template
-        order = result
-        # Add 'id' field if it doesn't exist (template expects order.id)
-        if 'id' not in order and 'order_id' in order:
-            order['id'] = order['order_id']
-        # Add 'created_at' field if it doesn't exist
-        if 'created_at' not in order:
-            order['created_at'] = datetime.now().isoformat()
-        # Add 'payment_date' field if it doesn't exist but payment is processed
-        if 'payment_date' not in order and order.get('payment_status') == 'paid':
-            order['payment_date'] = datetime.now().isoformat()
+    if not result['error_code']:
+        # The template expects order.id
+        order = dict(result, id=result['order_id'])
     else:
-        flash(f'Error: {result}', 'error')
+        flash(result['message'], 'error')
         return redirect(url_for('index'))
     
     return render_template('status.html', order=order, user=session['user'])
@@ -374,18 +361,18 @@ def cancel_order():
             order_id = int(order_id)
         
         # Call SOAP service to cancel order
-        result = soap_client.cancel_order(order_id)
+        result = soap_client_v2.cancel_order(order_id)
         
-        if 'cancelled successfully' in result.lower():
+        if not result['error_code']:
             return jsonify({
                 'success': True,
-                'message': result,
+                'message': result['message'],
                 'redirect_url': url_for('index')
             })
         else:
             return jsonify({
                 'success': False,
-                'message': result
+                'message': result['message']
             })
             
     except Exception as e:
@@ -420,18 +407,12 @@ def process_refund():
             refund_amount = float(refund_amount)
         
         # Call SOAP service to process refund
-        result = soap_client.process_refund(order_id, reason, refund_amount)
+        result = soap_client_v2.process_refund(order_id, reason, refund_amount)
         
-        if 'refund processed successfully' in result.lower():
-            return jsonify({
-                'success': True,
-                'message': result
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': result
-            })
+        return jsonify({
+            'success': not result['error_code'],
+            'message': result['message']
+        })
             
     except Exception as e:
         logger.error(f"Error processing refund: {str(e)}")
@@ -444,16 +425,29 @@ def admin_orders():
         flash('Please login first', 'warning')
         return redirect(url_for('main'))
     
-    # Call SOAP service to get all orders
-    result = soap_client.get_all_orders()
+    # Filters and the page cursor come from the query string, e.g. ?status=pending&after=1050
+    filters = {
+        'status': request.args.get('status') or None,
+        'payment_status': request.args.get('payment_status') or None,
+        'customer_email': request.args.get('email') or None
+    }
+    limit = request.args.get('limit', ADMIN_PAGE_SIZE, type=int)
+    after_id = request.args.get('after', type=int)
+    
+    # Call SOAP service to get one page of orders
+    result = soap_client_v2.get_all_orders(limit=limit, after_id=after_id, **filters)
     
-    if isinstance(result, dict) and 'orders' in result:
-        orders = result['orders']
+    if not result['error_code']:
+        # The template expects orders by ID, each with an id
+        orders = {order['order_id']: dict(order, id=order['order_id']) for order in result['orders']}
+        next_cursor = result['next_cursor']
     else:
         orders = {}
-        flash(f'Error loading orders: {result}', 'error')
+        next_cursor = None
+        flash(f'Error loading orders: {result["message"]}', 'error')
     
-    return render_template('admin_orders.html', orders=orders, user=session['user'])
+    return render_template('admin_orders.html', orders=orders, next_cursor=next_cursor, filters=filters,
+                           limit=limit, user=session['user'])
 
 @app.route('/status')
 def status():
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Async SOAP client for Eclipse Coffee Shop
+AsyncCoffeeShopSOAPClient has the same methods as CoffeeShopSOAPClient, as
+coroutines, so one event loop can keep many calls in flight. gather() and the
+batch methods fan calls out with a bounded number running at once:
+
+    async with AsyncCoffeeShopSOAPClient() as client:
+        statuses = await client.get_order_statuses(range(1001, 1101), limit=20)
+"""
+
+import asyncio
+import json
+import logging
+import random
+import uuid
+from urllib.parse import urlparse
+
+import httpx
+from zeep import AsyncClient
+from zeep.cache import SqliteCache
+from zeep.exceptions import TransportError
+from zeep.proxy import AsyncServiceProxy
+from zeep.transports import AsyncTransport
+
+from soap_client import (BATCH_SIZE, CONNECT_TIMEOUT, OPERATION_TIMEOUTS, POOL_SIZE, READ_TIMEOUT, RETRIES,
+                         RETRY_BACKOFF, SOAP_BINDING, SOAP_ENDPOINT, WSDL_CACHE_PATH, WSDL_CACHE_TTL, WSDL_PATH,
+                         _batches)
+
+logger = logging.getLogger(__name__)
+
+# Calls gather() runs at once unless told otherwise
+FAN_OUT_LIMIT = 10
+
+
+class PooledAsyncTransport(AsyncTransport):
+    """httpx transport with a bounded keep-alive connection pool and per-operation timeouts"""
+
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 operation_timeouts=None, cache=None):
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        super().__init__(client=httpx.AsyncClient(timeout=timeout, limits=limits),
+                         wsdl_client=httpx.Client(timeout=timeout), cache=cache)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.operation_timeouts = dict(OPERATION_TIMEOUTS, **(operation_timeouts or {}))
+
+    async def post(self, address, message, headers):
+        operation = headers.get('SOAPAction', '').strip('"')
+        timeout = httpx.Timeout(self.operation_timeouts.get(operation, self.read_timeout),
+                                connect=self.connect_timeout)
+        logger.debug(f"HTTP Post to {address}:\n{message}")
+        return await self.client.post(address, content=message, headers=headers, timeout=timeout)
+
+
+class AsyncCoffeeShopSOAPClient:
+    """Asyncio SOAP client for Eclipse Coffee Shop service
+
+    Takes the same options as CoffeeShopSOAPClient. Loading the WSDL is
+    synchronous; with lazy=True it happens on the first call, which briefly
+    blocks the event loop. Close the client with aclose() or use it with
+    `async with`.
+    """
+
+    def __init__(self, wsdl_url=None, retries=RETRIES, retry_backoff=RETRY_BACKOFF, hedge_after=None,
+                 endpoint=None, lazy=False, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, operation_timeouts=None, batch_size=BATCH_SIZE):
+        self.wsdl_url = wsdl_url or WSDL_PATH
+        self.endpoint = endpoint or (None if wsdl_url else SOAP_ENDPOINT)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_after = hedge_after
+        self._transport_options = dict(pool_size=pool_size, connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout, operation_timeouts=operation_timeouts)
+        self.transport = None
+        self._service = None
+        if not lazy:
+            self._connect()
+
+    def _connect(self):
+        # Runs on the event loop thread, so no lock is needed
+        if self._service is not None:
+            return
+        try:
+            remote = urlparse(self.wsdl_url).scheme in ('http', 'https')
+            cache = SqliteCache(path=WSDL_CACHE_PATH, timeout=WSDL_CACHE_TTL) if remote else None
+            transport = PooledAsyncTransport(cache=cache, **self._transport_options)
+            client = AsyncClient(self.wsdl_url, transport=transport)
+            if self.endpoint:
+                service = AsyncServiceProxy(client, client.wsdl.bindings[SOAP_BINDING], address=self.endpoint)
+            else:
+                service = client.service
+            logger.info(f"Async SOAP client initialized with WSDL: {self.wsdl_url}")
+        except Exception as e:
+            logger.error(f"Failed to initialize async SOAP client: {str(e)}")
+            raise
+        self.transport = transport
+        self._service = service
+
+    @property
+    def service(self):
+        """The bound service; its operations return coroutines"""
+        if self._service is None:
+            self._connect()
+        return self._service
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+            self.transport.wsdl_client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        await self.aclose()
+
+    async def gather(self, calls, limit=FAN_OUT_LIMIT):
+        """Await the coroutines in calls with at most limit running at once; results come back in order"""
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded(call):
+            async with semaphore:
+                return await call
+
+        return await asyncio.gather(*(bounded(call) for call in calls))
+
+    async def get_order_statuses(self, order_ids, limit=FAN_OUT_LIMIT):
+        """Fetch the status of many orders, batch_size per getOrderStatuses call with up to limit calls at once
+
+        Returns {order_id: get_order_status() result}, or an error string if a call failed.
+        """
+        order_ids = list(order_ids)
+        batches = await self.gather((self._call('getOrderStatuses', 'Error getting order statuses', {'integer': batch})
+                                     for batch in _batches(order_ids, self.batch_size)), limit)
+        results = []
+        for batch in batches:
+            if isinstance(batch, str):
+                return batch
+            results += batch or []
+        statuses = {}
+        for order_id, result in zip(order_ids, results):
+            try:
+                statuses[order_id] = json.loads(result)
+            except json.JSONDecodeError:
+                # Errors are plain strings
+                statuses[order_id] = result
+        return statuses
+
+    async def create_orders(self, orders, limit=FAN_OUT_LIMIT):
+        """Create several orders, batch_size per createOrders call; returns create_order's answer for each"""
+        requests = [{
+            'customer_name': order['customer_name'],
+            'customer_email': order['customer_email'],
+            'cart_items': json.dumps(order['cart_items']),
+            'idempotency_key': order.get('idempotency_key') or uuid.uuid4().hex
+        } for order in orders]
+        batches = await self.gather((self._call_idempotent('createOrders', 'Error creating orders',
+                                                           {'OrderRequest': batch})
+                                     for batch in _batches(requests, self.batch_size)), limit)
+        results = []
+        for batch in batches:
+            if isinstance(batch, str):
+                return batch
+            results += batch or []
+        return results
+
+    async def cancel_orders(self, order_ids, limit=FAN_OUT_LIMIT):
+        """Cancel several orders, batch_size per cancelOrders call; returns {order_id: cancel_order's answer}"""
+        order_ids = list(order_ids)
+        batches = await self.gather((self._call('cancelOrders', 'Error cancelling orders', {'integer': batch})
+                                     for batch in _batches(order_ids, self.batch_size)), limit)
+        results = []
+        for batch in batches:
+            if isinstance(batch, str):
+                return batch
+            results += batch or []
+        return dict(zip(order_ids, results))
+
+    async def _call(self, operation, error, *args, parse=False):
+        """Call an operation, returning "Error ..." on failure and, with parse, JSON results as objects"""
+        try:
+            result = await getattr(self.service, operation)(*args)
+            logger.debug(f"SOAP {operation} result: {result}")
+            if parse:
+                try:
+                    return json.loads(result)
+                except (TypeError, json.JSONDecodeError):
+                    return result
+            return result
+        except Exception as e:
+            logger.error(f"SOAP {operation} error: {str(e)}")
+            return f"{error}: {str(e)}"
+
+    async def _call_idempotent(self, operation, error, *args):
+        """_call() for operations whose last argument is an idempotency key, retrying and hedging as configured"""
+        async def attempt_call():
+            return await getattr(self.service, operation)(*args)
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    if self.hedge_after is None:
+                        result = await attempt_call()
+                    else:
+                        result = await self._hedged(attempt_call)
+                    logger.debug(f"SOAP {operation} result: {result}")
+                    return result
+                except (httpx.TransportError, TransportError) as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    logger.warning(f"SOAP {operation} attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            logger.error(f"SOAP {operation} error: {str(e)}")
+            return f"{error}: {str(e)}"
+
+    async def _hedged(self, call):
+        """Return the first successful answer of call(), starting a second copy if the first is slow"""
+        pending = {asyncio.ensure_future(call())}
+        done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+        if not done:
+            logger.debug(f"No answer after {self.hedge_after}s; sending a hedged request")
+            pending.add(asyncio.ensure_future(call()))
+        try:
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    # Every attempt failed; raise the last error
+                    return task.result()
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def create_order(self, customer_name, customer_email, cart_items, idempotency_key=None):
+        """Create a new order; retries reuse idempotency_key (a fresh one by default)"""
+        return await self._call_idempotent('createOrder', 'Error creating order', customer_name, customer_email,
+                                           json.dumps(cart_items), idempotency_key or uuid.uuid4().hex)
+
+    async def process_payment(self, order_id, amount, payment_method, idempotency_key=None, expected_version=None):
+        """Process payment; retries reuse idempotency_key (a fresh one by default)"""
+        return await self._call_idempotent('processPayment', 'Error processing payment', order_id, amount,
+                                           payment_method, idempotency_key or uuid.uuid4().hex, expected_version)
+
+    async def process_refund(self, order_id, reason, refund_amount=None, expected_version=None):
+        return await self._call('processRefund', 'Error processing refund', order_id, reason, refund_amount,
+                                expected_version)
+
+    async def get_order_status(self, order_id):
+        return await self._call('getOrderStatus', 'Error getting order status', order_id, parse=True)
+
+    async def cancel_order(self, order_id, expected_version=None):
+        return await self._call('cancelOrder', 'Error cancelling order', order_id, expected_version)
+
+    async def register_guest(self, name, email, phone, notes):
+        return await self._call('registerGuest', 'Error registering guest', name, email, phone, notes, parse=True)
+
+    async def register_member(self, first_name, last_name, email, phone, password):
+        return await self._call('registerMember', 'Error registering member', first_name, last_name, email, phone,
+                                password, parse=True)
+
+    async def login_member(self, email, password):
+        return await self._call('loginMember', 'Error logging in member', email, password, parse=True)
+
+    async def get_all_orders(self, limit=None, after_id=None, status=None, payment_status=None, customer_email=None):
+        """Get orders, one page at a time when a limit, cursor or filter is given (see CoffeeShopSOAPClient)"""
+        return await self._call('getAllOrders', 'Error getting all orders', limit, after_id, status, payment_status,
+                                customer_email, parse=True)
+
+    async def get_orders_by_customer(self, customer_email):
+        return await self._call('getOrdersByCustomer', 'Error getting orders by customer', customer_email,
+                                parse=True)
+
+    async def list_orders_by_status(self, status=None, payment_status=None):
+        return await self._call('listOrdersByStatus', 'Error listing orders by status', status, payment_status,
+                                parse=True)
+
+    async def iter_orders(self, page_size=100, **filters):
+        """Yield every order matching the filters, fetching one page at a time"""
+        after_id = None
+        while True:
+            result = await self.get_all_orders(limit=page_size, after_id=after_id, **filters)
+            if not isinstance(result, dict):
+                raise RuntimeError(result)
+            for order in result['orders'].values():
+                yield order
+            after_id = result.get('next_cursor')
+            if after_id is None:
+                return
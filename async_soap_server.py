@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Asyncio SOAP server for Eclipse Coffee Shop
+Serves the same WSDLs and operations as soap_server_complete.py, including the
+typed v2 service under /v2 and, with --validation off, the JSON mounts, from
+one event loop.
+Operations that wait on the payment gateway have async variants, so a slow
+gateway suspends coroutines instead of tying up threads; every other operation
+runs its regular handler on a small thread pool, because the stores are
+blocking. Thousands of in-flight calls can therefore share a few threads.
+
+    python async_soap_server.py --port 8000 --threads 8
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import unquote
+
+from spyne import Fault
+from spyne.const.http import HTTP_200
+from spyne.server.wsgi import WsgiApplication, WsgiMethodContext
+
+from json_rpc import JsonRpcApplication
+from payment_gateway import payment_gateway
+from soap_server_complete import (JSON_PATH, JSON_VALIDATION, STORE_BACKEND, V2_PATH, VALIDATION, VALIDATION_MODES,
+                                  CoffeeShopServiceV2, PaymentResult, _message, _reserve_payment, _settle_payment,
+                                  _typed, idempotency_cache, json_app, json_app_v2, order_store, soap_app,
+                                  soap_app_v2, user_store, with_validation)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 8
+KEEPALIVE_TIMEOUT = 5.0
+# Bursts of thousands of clients must not overflow the accept queue
+LISTEN_BACKLOG = 2048
+MAX_HEADER_SIZE = 65536
+MAX_CONTENT_LENGTH = 2 * 1024 * 1024
+
+
+class AsyncSoapApplication(WsgiApplication):
+    """spyne SOAP application driven from asyncio instead of a WSGI server
+
+    POSTed SOAP calls are decoded and encoded on the event loop. Operations in
+    ASYNC_OPERATIONS are awaited there; the others run on the thread pool.
+    Everything else, such as ?wsdl, is answered by the inherited WSGI code.
+    mounts serves further spyne or JSON applications under a path, e.g.
+    {'v2': soap_app_v2, 'v2/json': json_app_v2}; the longest matching path
+    wins. JSON calls to ASYNC_OPERATIONS are awaited as well.
+    """
+
+    ASYNC_OPERATIONS = {
+        'processPayment': 'process_payment',
+    }
+
+    def __init__(self, app, threads=DEFAULT_THREADS, keepalive_timeout=KEEPALIVE_TIMEOUT, mounts=None):
+        super().__init__(app, chunked=False)
+        self.mounts = {}
+        for path, mounted in (mounts or {}).items():
+            if not isinstance(mounted, JsonRpcApplication):
+                mounted = WsgiApplication(mounted, chunked=False)
+            self.mounts[path] = mounted
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+        self.draining = False
+        self._executor = None
+        self._connections = set()
+        self._idle = set()
+
+    async def run(self, fn, *args):
+        """Run a blocking call on the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def process_payment(self, ctx, order_id, amount, payment_method, idempotency_key=None,
+                              expected_version=None):
+        """processPayment, awaiting the gateway without holding a thread
+
+        The order is claimed and settled by the same steps as in
+        soap_server_complete, on the thread pool; only the charge in between
+        is awaited here.
+        """
+        return await idempotency_cache.call_async(
+            'processPayment', idempotency_key, (order_id, amount, payment_method, expected_version),
+            lambda: self._process_payment(order_id, amount, payment_method, expected_version))
+
+    async def _process_payment(self, order_id, amount, payment_method, expected_version):
+        """Returns a PaymentResult, like soap_server_complete._process_payment"""
+        answer, status = await self.run(_reserve_payment, order_id, amount, payment_method, expected_version)
+        if answer is not None:
+            return answer
+        try:
+            await payment_gateway.charge_async(order_id, amount, payment_method)
+        except Exception as e:
+            return await self.run(_settle_payment, order_id, amount, payment_method, status, e)
+        return await self.run(_settle_payment, order_id, amount, payment_method, status)
+
+    def _mounted(self, environ):
+        """Return the application serving the request's path, moving its mount point to SCRIPT_NAME"""
+        fragments = environ['PATH_INFO'].strip('/').split('/')
+        for depth in range(len(fragments), 0, -1):
+            mount = '/'.join(fragments[:depth])
+            app = self.mounts.get(mount)
+            if app is not None:
+                rest = '/'.join(fragments[depth:])
+                environ['SCRIPT_NAME'] = '/' + mount
+                environ['PATH_INFO'] = '/' + rest if rest else ''
+                return app
+        return self
+
+    async def handle_soap(self, environ, body):
+        """Answer one SOAP call; returns (status, headers, body)"""
+        app = self._mounted(environ)
+        if isinstance(app, JsonRpcApplication):
+            return await self.handle_json(app, body)
+        p_ctx = WsgiMethodContext(app, environ, app.app.out_protocol.mime_type)
+        p_ctx.in_string = [body]
+        p_ctx = app.generate_contexts(p_ctx, _charset(environ.get('CONTENT_TYPE', '')))[0]
+        if p_ctx.in_error is None:
+            app.get_in_object(p_ctx)
+
+        if p_ctx.in_error is None:
+            handler = self.ASYNC_OPERATIONS.get(p_ctx.descriptor.name)
+            try:
+                if handler is None:
+                    await self.run(app.get_out_object, p_ctx)
+                else:
+                    result = await getattr(self, handler)(p_ctx, *p_ctx.in_object)
+                    p_ctx.out_object = [_answer(p_ctx.descriptor, result)]
+            except Exception as e:
+                logger.exception(e)
+                p_ctx.out_error = Fault('Server', str(e))
+
+        error = p_ctx.in_error or p_ctx.out_error
+        if error is not None:
+            p_ctx.transport.resp_code = p_ctx.out_protocol.fault_to_http_response_code(error)
+        elif p_ctx.transport.resp_code is None:
+            p_ctx.transport.resp_code = HTTP_200
+        try:
+            app.get_out_string(p_ctx)
+            return p_ctx.transport.resp_code, p_ctx.transport.resp_headers, b''.join(p_ctx.out_string)
+        finally:
+            p_ctx.close()
+
+    async def handle_json(self, app, body):
+        """Answer one call to a JSON mount; returns (status, headers, body)"""
+        try:
+            descriptor, args = app.parse(body)
+            handler = self.ASYNC_OPERATIONS.get(descriptor.name)
+            if handler is None:
+                result = await self.run(app.call, descriptor, args)
+            else:
+                result = _answer(descriptor, await getattr(self, handler)(None, *args))
+            return app.reply(result)
+        except Fault as e:
+            return app.reply_fault(e)
+        except Exception as e:
+            logger.exception(e)
+            return app.reply_fault(Fault('Server', str(e)))
+
+    def handle_wsgi(self, environ):
+        """Answer a non-SOAP request (e.g. ?wsdl) with the inherited WSGI code"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, dict(headers)
+
+        body = b''.join(self._mounted(environ)(environ, start_response))
+        return response['status'], response['headers'], body
+
+    async def handle_connection(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one client connection, keeping it alive between requests"""
+        self._connections.add(asyncio.current_task())
+        try:
+            while not self.draining:
+                self._idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError):
+                    break
+                finally:
+                    self._idle.discard(writer)
+
+                environ, keep_alive = self._environ(head, writer)
+                if environ is None:
+                    await self._write(writer, '400 Bad Request', {}, b'', keep_alive=False)
+                    break
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                if environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+                    await self._write(writer, '411 Length Required', {}, b'', keep_alive=False)
+                    break
+                if length > MAX_CONTENT_LENGTH:
+                    await self._write(writer, '413 Request Entity Too Large', {}, b'', keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                environ['wsgi.input'] = BytesIO(body)
+
+                try:
+                    if environ['REQUEST_METHOD'] == 'POST':
+                        status, headers, content = await self.handle_soap(environ, body)
+                    else:
+                        status, headers, content = self.handle_wsgi(environ)
+                except Exception:
+                    logger.exception("Error handling SOAP request")
+                    status, headers, content = '500 Internal Server Error', {}, b''
+                    keep_alive = False
+                keep_alive = keep_alive and not self.draining
+                await self._write(writer, status, headers, content, keep_alive)
+                logger.info(f"{environ['REMOTE_ADDR']} - \"{environ['REQUEST_METHOD']} "
+                            f"{environ.get('SCRIPT_NAME', '')}{environ['PATH_INFO']} {environ['SERVER_PROTOCOL']}\" "
+                            f"{status.split()[0]} {len(content)}")
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    def _environ(self, head, writer):
+        """Build a WSGI environ from a request head; returns (environ, keep_alive)"""
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ')
+            headers = {}
+            for line in lines[1:]:
+                if line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            return None, False
+
+        path, _, query = target.partition('?')
+        host, port = writer.get_extra_info('sockname')[:2]
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'CONTENT_TYPE': headers.pop('content-type', ''),
+            'CONTENT_LENGTH': headers.pop('content-length', ''),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': None,
+        }
+        for name, value in headers.items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return environ, keep_alive
+
+    async def _write(self, writer, status, headers, content, keep_alive):
+        head = [f'HTTP/1.1 {status}']
+        head += [f'{name}: {value}' for name, value in headers.items() if name.lower() != 'content-length']
+        head.append(f'Content-Length: {len(content)}')
+        head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + content)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        """Serve until SIGTERM/SIGINT, then let in-flight requests finish"""
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='soap')
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=LISTEN_BACKLOG,
+                                            limit=MAX_HEADER_SIZE)
+        logger.info(f"Async SOAP server on http://{host}:{port} with {self.threads} store threads")
+        await stop.wait()
+
+        logger.info(f"Stopping, finishing {len(self._connections) - len(self._idle)} in-flight requests")
+        self.draining = True
+        server.close()
+        for writer in list(self._idle):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections))
+        await server.wait_closed()
+        self._executor.shutdown(wait=True)
+        logger.info("Async SOAP server stopped")
+
+
+def _answer(descriptor, result):
+    # The v2 service answers with the typed result, the original one with its message
+    if descriptor.service_class is CoffeeShopServiceV2:
+        return _typed(result, PaymentResult)
+    return _message(result)
+
+
+def _charset(content_type):
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset':
+            return value.strip('"')
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Eclipse Coffee Shop asyncio SOAP server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='threads for blocking store calls')
+    parser.add_argument('--keepalive-timeout', type=float, default=KEEPALIVE_TIMEOUT,
+                        help='seconds an idle keep-alive connection is kept open')
+    parser.add_argument('--validation', choices=list(VALIDATION_MODES), default=VALIDATION,
+                        help='how SOAP requests are checked (default: COFFEESHOP_SOAP_VALIDATION or full)')
+    args = parser.parse_args()
+
+    logger.info(f"Using the {STORE_BACKEND} store and {args.validation} validation; "
+                f"WSDL available at http://localhost:{args.port}/?wsdl")
+    mounts = {V2_PATH: with_validation(soap_app_v2, args.validation)}
+    if args.validation == JSON_VALIDATION:
+        mounts.update({JSON_PATH: json_app, f'{V2_PATH}/{JSON_PATH}': json_app_v2})
+    app = AsyncSoapApplication(with_validation(soap_app, args.validation), threads=args.threads,
+                               keepalive_timeout=args.keepalive_timeout, mounts=mounts)
+    try:
+        asyncio.run(app.serve(args.host, args.port))
+    finally:
+        order_store.close()
+        user_store.close()
+
+
+if __name__ == '__main__':
+    main()
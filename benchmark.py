@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Eclipse Coffee Shop services
+Run `python benchmark.py <name>` to measure one aspect of the system
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+from order_model import Order
+from order_store import MemoryOrderStore, MemoryUserStore, SqliteUserStore
+
+# A typical two-line order, as created by the web checkout
+SAMPLE_ORDER = {
+    'id': 1001,
+    'customer_name': 'Yun Shi',
+    'customer_email': 'customer@example.com',
+    'items': [
+        {
+            'id': 2,
+            'name': 'Cappuccino',
+            'price': 3,
+            'image': 'https://images.unsplash.com/photo-1504674900247-0877df9cc836?auto=format&fit=crop&w=400&q=80',
+            'qty': 1
+        },
+        {
+            'id': 5,
+            'name': 'Mocha',
+            'price': 5,
+            'image': 'https://images.unsplash.com/photo-1511920170033-f8396924c348?auto=format&fit=crop&w=400&q=80',
+            'qty': 2
+        }
+    ],
+    'total_amount': 13,
+    'status': 'confirmed',
+    'created_at': '2025-06-22T02:10:00.103133',
+    'payment_status': 'paid',
+    'payment_method': 'tng',
+    'payment_date': '2025-06-22T02:10:24.914706'
+}
+
+
+def _sample_orders(count):
+    """Yield distinct order dicts as they come out of json.loads (no shared strings)"""
+    for n in range(count):
+        order = dict(SAMPLE_ORDER, id=1001 + n, created_at=f'2025-06-22T02:10:{n % 60:02d}.{n:06d}')
+        yield json.loads(json.dumps(order))
+
+
+def _measure(build, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    orders = build(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(orders) == count
+    return (after - before) / count
+
+
+def bench_memory(args):
+    """Memory per order held in the order store: plain dicts vs compact Order objects"""
+    dict_bytes = _measure(lambda n: {o['id']: o for o in _sample_orders(n)}, args.orders)
+    order_bytes = _measure(lambda n: {o['id']: Order.from_dict(o) for o in _sample_orders(n)}, args.orders)
+    assert Order.from_dict(SAMPLE_ORDER).to_dict() == SAMPLE_ORDER
+    print(f"Orders measured:        {args.orders}")
+    print(f"dict per order:         {dict_bytes:8.0f} bytes")
+    print(f"Order per order:        {order_bytes:8.0f} bytes")
+    print(f"Reduction:              {1 - order_bytes / dict_bytes:8.1%}")
+
+
+def _sample_users(count):
+    """Yield users as registerGuest/registerMember create them, roughly four guests per member"""
+    for n in range(count):
+        user_type = 'member' if n % 5 == 0 else 'guest'
+        yield {
+            'id': 101 + n,
+            'name': f'Customer {n}',
+            'email': f'customer{n}@example.com',
+            'phone': '012-3456789',
+            'type': user_type,
+            'created_at': '2025-06-22T02:10:00.103133'
+        }
+
+
+def _time_lookups(find, emails):
+    start = time.perf_counter()
+    for email in emails:
+        assert find(email) is not None
+    return (time.perf_counter() - start) / len(emails) * 1e6
+
+
+def _linear_find(users, email):
+    # The lookup loginMember used before users were indexed by email
+    for user in users.values():
+        if user.get('email') == email and user.get('type') == 'member':
+            return user
+    return None
+
+
+def bench_login(args):
+    """loginMember email lookup latency as the number of registered users grows"""
+    print(f"{'users':>9}  {'memory us':>10}  {'sqlite us':>10}  {'linear scan us':>14}")
+    for count in args.users:
+        memory = MemoryUserStore()
+        for user in _sample_users(count):
+            memory.add(user)
+        members = [f'customer{n}@example.com' for n in range(0, count, 5)]
+        emails = [random.choice(members) for _ in range(args.lookups)]
+        # Logins come in with whatever casing the customer typed
+        emails = [email.upper() if n % 2 else email for n, email in enumerate(emails)]
+        find_member = lambda email: memory.find_by_email(email, user_type='member')
+        memory_us = _time_lookups(find_member, emails)
+
+        sqlite_us = float('nan')
+        if not args.skip_sqlite:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = SqliteUserStore(os.path.join(tmp, 'users.db'))
+                for user in _sample_users(count):
+                    store.add(user)
+                sqlite_us = _time_lookups(lambda email: store.find_by_email(email, user_type='member'), emails)
+                store.close()
+
+        scan_emails = [email.lower() for email in emails[:args.scan_lookups]]
+        scan_us = _time_lookups(lambda email: _linear_find(memory.users, email), scan_emails)
+        print(f"{count:>9}  {memory_us:>10.2f}  {sqlite_us:>10.2f}  {scan_us:>14.2f}")
+
+
+def bench_daemon(args):
+    """Per-call overhead of the shared state daemon, one call at a time and batched"""
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, 'state.sock')
+        daemon = subprocess.Popen([sys.executable, 'state_daemon.py', '--store', 'memory', '--socket', address],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            from state_daemon import RemoteOrderStore
+            for _ in range(100):
+                if os.path.exists(address):
+                    break
+                time.sleep(0.05)
+            remote = RemoteOrderStore(address)
+            local = MemoryOrderStore()
+            for order in _sample_orders(args.orders):
+                remote.add(order)
+                local.add(order)
+            order_ids = [random.randrange(1001, 1001 + args.orders) for _ in range(args.calls)]
+
+            def per_call(fn):
+                start = time.perf_counter()
+                fn()
+                return (time.perf_counter() - start) / len(order_ids) * 1e6
+
+            local_us = per_call(lambda: [local.get(order_id) for order_id in order_ids])
+            remote_us = per_call(lambda: [remote.get(order_id) for order_id in order_ids])
+            batches = [order_ids[n:n + args.batch] for n in range(0, len(order_ids), args.batch)]
+            batched_us = per_call(lambda: [remote.get_many(batch) for batch in batches])
+            remote.close()
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    print(f"Orders in store:        {args.orders}")
+    print(f"in-process get:         {local_us:8.2f} us/call")
+    print(f"daemon get:             {remote_us:8.2f} us/call")
+    print(f"daemon get_many({args.batch}):   {batched_us:8.2f} us/order")
+
+
+SOAP_CALL = (
+    '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:c="urn:coffeeshop.soap">'
+    '<soapenv:Body><c:{operation}>{args}</c:{operation}></soapenv:Body></soapenv:Envelope>'
+)
+
+
+def _soap_request(port, operation, **args):
+    body = SOAP_CALL.format(operation=operation,
+                            args=''.join(f'<c:{name}>{value}</c:{name}>' for name, value in args.items())).encode()
+    head = (f'POST / HTTP/1.1\r\nHost: localhost:{port}\r\nContent-Type: text/xml; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n')
+    return head.encode() + body
+
+
+async def _soap_client(port, requests, latencies):
+    """Send requests one after another over one keep-alive connection, recording each latency"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for request in requests:
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+            body = await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if b'Error' in body or not head.startswith(b'HTTP/1.1 200'):
+                raise RuntimeError(f"Call failed: {body[:200]!r}")
+    finally:
+        writer.close()
+
+
+async def _soap_load(port, requests, concurrency):
+    latencies = []
+    clients = [requests[n::concurrency] for n in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(_soap_client(port, batch, latencies) for batch in clients if batch))
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def _thread_count(pid):
+    with open(f'/proc/{pid}/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+
+
+def _cpu_seconds(pid):
+    # utime and stime, in clock ticks, follow the state and 10 further fields of /proc/<pid>/stat
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def _wait_for_server(port):
+    for _ in range(200):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/?wsdl').read()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def bench_gateway(args):
+    """processPayment against a slow payment gateway: threaded WSGI server vs asyncio server"""
+    servers = [
+        ('threaded', ['soap_server_complete.py', '--threads', str(args.threads)]),
+        ('asyncio', ['async_soap_server.py', '--threads', '8']),
+    ]
+    env = dict(os.environ, COFFEESHOP_STORE='memory', PAYMENT_GATEWAY_LATENCY_MS=str(args.latency))
+    print(f"{args.calls} payments, {args.concurrency} concurrent connections, gateway latency {args.latency} ms")
+    print(f"{'server':>10}  {'wall s':>8}  {'calls/s':>8}  {'p50 ms':>8}  {'p99 ms':>8}  {'threads':>8}")
+    for name, command in servers:
+        port = args.port
+        server = subprocess.Popen([sys.executable] + command + ['--host', '127.0.0.1', '--port', str(port)],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_server(port)
+            orders = [_soap_request(port, 'createOrder', customer_name='Load Test', customer_email='load@example.com',
+                                    cart_items='[{"id": 1, "name": "Latte", "price": 4.5, "qty": 1}]')
+                      for _ in range(args.calls)]
+            asyncio.run(_soap_load(port, orders, 50))
+            payments = [_soap_request(port, 'processPayment', order_id=1001 + n, amount=4.5, payment_method='tng')
+                        for n in range(args.calls)]
+            wall, latencies = asyncio.run(_soap_load(port, payments, args.concurrency))
+            threads = _thread_count(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{name:>10}  {wall:8.2f}  {args.calls / wall:8.0f}  {latencies[len(latencies) // 2] * 1e3:8.1f}  "
+              f"{latencies[int(len(latencies) * 0.99)] * 1e3:8.1f}  {threads:>8}")
+
+
+def bench_batch(args):
+    """Cost per order of createOrder(s), getOrderStatus(es) and cancelOrder(s): single calls vs batches"""
+    import logging
+    from soap_client import CoffeeShopSOAPClient
+
+    # soap_client logs every envelope at DEBUG, which would cost more than the calls
+    logging.getLogger().setLevel(logging.WARNING)
+    env = dict(os.environ, COFFEESHOP_STORE='memory')
+    server = subprocess.Popen([sys.executable, 'soap_server_complete.py', '--host', '127.0.0.1', '--port', str(args.port),
+                               '--log-level', 'WARNING'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_server(port=args.port)
+        cart = [{'id': 1, 'name': 'Latte', 'price': 4.5, 'qty': 1}]
+        orders = [{'customer_name': 'Batch Test', 'customer_email': 'batch@example.com', 'cart_items': cart}
+                  for _ in range(args.orders)]
+        print(f"{args.orders} orders per row, microseconds per order (client and server on this machine)")
+        print(f"{'batch size':>10}  {'create':>9}  {'status':>9}  {'cancel':>9}")
+
+        client = CoffeeShopSOAPClient(endpoint=f'http://127.0.0.1:{args.port}/')
+        start = time.perf_counter()
+        ids = [int(client.create_order(**order).split('Order ID: ')[1].split(',')[0]) for order in orders]
+        create = time.perf_counter() - start
+        start = time.perf_counter()
+        for order_id in ids:
+            client.get_order_status(order_id)
+        status = time.perf_counter() - start
+        start = time.perf_counter()
+        for order_id in ids:
+            client.cancel_order(order_id)
+        cancel = time.perf_counter() - start
+        print(f"{'single':>10}  {create / len(ids) * 1e6:9.0f}  {status / len(ids) * 1e6:9.0f}  "
+              f"{cancel / len(ids) * 1e6:9.0f}")
+
+        for size in args.sizes:
+            client = CoffeeShopSOAPClient(endpoint=f'http://127.0.0.1:{args.port}/', batch_size=size)
+            start = time.perf_counter()
+            results = client.create_orders(orders)
+            create = time.perf_counter() - start
+            ids = [int(result.split('Order ID: ')[1].split(',')[0]) for result in results]
+            start = time.perf_counter()
+            statuses = client.get_order_statuses(ids)
+            status = time.perf_counter() - start
+            start = time.perf_counter()
+            cancelled = client.cancel_orders(ids)
+            cancel = time.perf_counter() - start
+            assert len(statuses) == len(cancelled) == args.orders
+            print(f"{size:>10}  {create / len(ids) * 1e6:9.0f}  {status / len(ids) * 1e6:9.0f}  "
+                  f"{cancel / len(ids) * 1e6:9.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_typed(args):
+    """Per-call cost of the original string answers (parsed by the caller) vs the typed v2 service"""
+    import logging
+    from soap_client import CoffeeShopSOAPClient, CoffeeShopSOAPClientV2
+
+    # soap_client logs every envelope at DEBUG, which would cost more than the calls
+    logging.getLogger().setLevel(logging.WARNING)
+    env = dict(os.environ, COFFEESHOP_STORE='memory')
+    server = subprocess.Popen([sys.executable, 'soap_server_complete.py', '--host', '127.0.0.1', '--port', str(args.port),
+                               '--log-level', 'WARNING'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_server(args.port)
+        cart = [{'id': 'latte', 'name': 'Cafe Latte', 'price': 4.0, 'qty': 2},
+                {'id': 'mocha', 'name': 'Mocha', 'price': 5.0, 'qty': 1}]
+        v1 = CoffeeShopSOAPClient(endpoint=f'http://127.0.0.1:{args.port}/')
+        v2 = CoffeeShopSOAPClientV2(endpoint=f'http://127.0.0.1:{args.port}/v2')
+        print(f"{args.calls} calls each, microseconds per call (client and server on this machine)")
+        print(f"{'':>8}  {'createOrder':>12}  {'getOrderStatus':>15}")
+        for name, client, order_id in (('v1', v1, lambda r: int(re.search(r'Order ID: (\d+)', r).group(1))),
+                                       ('v2', v2, lambda r: r['order_id'])):
+            start = time.perf_counter()
+            ids = [order_id(client.create_order('Bench', 'bench@example.com', cart)) for _ in range(args.calls)]
+            create = time.perf_counter() - start
+            start = time.perf_counter()
+            for oid in ids:
+                assert client.get_order_status(oid)['status'] == 'pending'
+            status = time.perf_counter() - start
+            print(f"{name:>8}  {create / args.calls * 1e6:12.0f}  {status / args.calls * 1e6:15.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_protocols(args):
+    """Per-call latency and server CPU of the v2 service over SOAP vs its JSON mount on an internal listener"""
+    import logging
+    from soap_client import CoffeeShopSOAPClientV2
+
+    # Logging every call would cost more than either protocol
+    logging.getLogger().setLevel(logging.WARNING)
+    env = dict(os.environ, COFFEESHOP_STORE='memory')
+    # JSON calls are only served where validation is off
+    ports = {'soap': args.port, 'json': args.port + 1}
+    server = subprocess.Popen([sys.executable, 'soap_server_complete.py', '--host', '127.0.0.1', '--port', str(args.port),
+                               f'--listen={ports["json"]}:off', '--log-level', 'WARNING'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for port in ports.values():
+            _wait_for_server(port)
+        cart = [{'id': 'latte', 'name': 'Cafe Latte', 'price': 4.0, 'qty': 2},
+                {'id': 'mocha', 'name': 'Mocha', 'price': 5.0, 'qty': 1}]
+        print(f"{args.calls} calls each, microseconds per call (client and server on this machine)")
+        print(f"{'':>8}  {'createOrder':>12}  {'getOrderStatus':>15}  {'server CPU':>11}")
+        for protocol, port in ports.items():
+            client = CoffeeShopSOAPClientV2(endpoint=f'http://127.0.0.1:{port}/v2', protocol=protocol)
+            client.get_order_status(0)
+            cpu = _cpu_seconds(server.pid)
+            start = time.perf_counter()
+            ids = [client.create_order('Bench', 'bench@example.com', cart)['order_id'] for _ in range(args.calls)]
+            create = time.perf_counter() - start
+            start = time.perf_counter()
+            for order_id in ids:
+                assert client.get_order_status(order_id)['status'] == 'pending'
+            status = time.perf_counter() - start
+            cpu = _cpu_seconds(server.pid) - cpu
+            print(f"{protocol:>8}  {create / args.calls * 1e6:12.0f}  {status / args.calls * 1e6:15.0f}  "
+                  f"{cpu / (2 * args.calls) * 1e6:11.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_validation(args):
+    """Calls per second of one server's listeners with full, soft and no request validation"""
+    modes = ['full', 'soft', 'off']
+    ports = {mode: args.port + n for n, mode in enumerate(modes)}
+    env = dict(os.environ, COFFEESHOP_STORE='memory')
+    server = subprocess.Popen([sys.executable, 'soap_server_complete.py', '--host', '127.0.0.1',
+                               '--port', str(ports['full']), '--validation', 'full', '--log-level', 'WARNING',
+                               '--threads', str(args.threads)] +
+                              [f'--listen={ports[mode]}:{mode}' for mode in modes[1:]],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for port in ports.values():
+            _wait_for_server(port)
+        print(f"{args.calls} calls per operation and mode, {args.concurrency} keep-alive connections")
+        print(f"{'mode':>6}  {'createOrder/s':>14}  {'getOrderStatus/s':>17}  {'p50 ms':>7}")
+        first_order = 1001
+        for mode in modes:
+            port = ports[mode]
+            orders = [_soap_request(port, 'createOrder', customer_name='Load Test', customer_email='load@example.com',
+                                    cart_items='[{"id": 1, "name": "Latte", "price": 4.5, "qty": 1}]')
+                      for _ in range(args.calls)]
+            create, _ = asyncio.run(_soap_load(port, orders, args.concurrency))
+            statuses = [_soap_request(port, 'getOrderStatus', order_id=first_order + n) for n in range(args.calls)]
+            status, latencies = asyncio.run(_soap_load(port, statuses, args.concurrency))
+            first_order += args.calls
+            print(f"{mode:>6}  {args.calls / create:14.0f}  {args.calls / status:17.0f}  "
+                  f"{latencies[len(latencies) // 2] * 1e3:7.2f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Eclipse Coffee Shop benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    memory = subparsers.add_parser('memory', help=bench_memory.__doc__)
+    memory.add_argument('--orders', type=int, default=10000)
+    memory.set_defaults(func=bench_memory)
+
+    login = subparsers.add_parser('login', help=bench_login.__doc__)
+    login.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    login.add_argument('--lookups', type=int, default=1000)
+    login.add_argument('--scan-lookups', type=int, default=20, help='lookups timed for the linear-scan baseline')
+    login.add_argument('--skip-sqlite', action='store_true', help='only time the in-memory store')
+    login.set_defaults(func=bench_login)
+
+    daemon = subparsers.add_parser('daemon', help=bench_daemon.__doc__)
+    daemon.add_argument('--orders', type=int, default=10000)
+    daemon.add_argument('--calls', type=int, default=20000)
+    daemon.add_argument('--batch', type=int, default=100)
+    daemon.set_defaults(func=bench_daemon)
+
+    gateway = subparsers.add_parser('gateway', help=bench_gateway.__doc__)
+    gateway.add_argument('--calls', type=int, default=2000)
+    gateway.add_argument('--concurrency', type=int, default=1000, help='concurrent client connections')
+    gateway.add_argument('--latency', type=float, default=200, help='simulated gateway latency in ms')
+    gateway.add_argument('--threads', type=int, default=16, help='request threads of the threaded server')
+    gateway.add_argument('--port', type=int, default=8099)
+    gateway.set_defaults(func=bench_gateway)
+
+    batch = subparsers.add_parser('batch', help=bench_batch.__doc__)
+    batch.add_argument('--orders', type=int, default=2000)
+    batch.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    batch.add_argument('--port', type=int, default=8099)
+    batch.set_defaults(func=bench_batch)
+
+    typed = subparsers.add_parser('typed', help=bench_typed.__doc__)
+    typed.add_argument('--calls', type=int, default=1000)
+    typed.add_argument('--port', type=int, default=8099)
+    typed.set_defaults(func=bench_typed)
+
+    protocols = subparsers.add_parser('protocols', help=bench_protocols.__doc__)
+    protocols.add_argument('--calls', type=int, default=1000)
+    protocols.add_argument('--port', type=int, default=8099, help='first of two consecutive ports')
+    protocols.set_defaults(func=bench_protocols)
+
+    validation = subparsers.add_parser('validation', help=bench_validation.__doc__)
+    validation.add_argument('--calls', type=int, default=2000)
+    validation.add_argument('--concurrency', type=int, default=8, help='concurrent client connections')
+    validation.add_argument('--threads', type=int, default=8, help='request threads of each listener')
+    validation.add_argument('--port', type=int, default=8099, help='first of three consecutive ports')
+    validation.set_defaults(func=bench_validation)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Idempotency keys for Eclipse Coffee Shop
+A client that is not sure whether a createOrder or processPayment call went
+through can send it again with the same idempotency key. The server then
+returns the first call's result instead of creating or charging twice. Results
+are kept in a bounded, time-limited cache in each server process and, when the
+server runs several processes, in a key store they share (see order_store.py).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = float(os.environ.get('COFFEESHOP_IDEMPOTENCY_TTL', str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('COFFEESHOP_IDEMPOTENCY_MAX_KEYS', '100000'))
+# How long a process may hold a shared key while it runs the call; another process
+# retrying the call waits for its result until then, and may run it itself afterwards
+IDEMPOTENCY_HOLD = float(os.environ.get('COFFEESHOP_IDEMPOTENCY_HOLD', '60'))
+SHARED_POLL_INTERVAL = 0.05
+
+
+def _succeeded(result):
+    # Failed calls are forgotten so that a retry can succeed
+    if isinstance(result, str):
+        return not result.startswith('Error')
+    return not getattr(result, 'error_code', None)
+
+
+class _Entry:
+    __slots__ = ('request', 'future', 'expires')
+
+    def __init__(self, request, expires):
+        self.request = request
+        self.future = Future()
+        self.expires = expires
+
+
+def _encode_request(request):
+    return json.dumps(request, sort_keys=True, default=str)
+
+
+class IdempotencyCache:
+    """Results of keyed calls, by (operation, key), evicted after ttl seconds or beyond max_keys
+
+    A repeat of a call that is still running waits for the first one, so
+    hedged requests arriving together also run only once. With a shared key
+    store, keys are also claimed there, so a repeat reaching another process
+    gets the same result. Stored results are rebuilt from their as_dict()
+    fields with result_types[operation].
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS, shared=None, result_types=None,
+                 hold=IDEMPOTENCY_HOLD):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.shared = shared
+        self.result_types = result_types or {}
+        self.hold = hold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim(self, operation, key, request):
+        """Return (entry, owner); the owner runs the call, everyone else waits for its future"""
+        now = time.monotonic()
+        with self._lock:
+            # Entries are in insertion order, so expired ones are at the front
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if oldest.expires > now and len(self._entries) < self.max_keys:
+                    break
+                self._entries.popitem(last=False)
+            entry = self._entries.get((operation, key))
+            if entry is not None:
+                return entry, False
+            entry = self._entries[(operation, key)] = _Entry(request, now + self.ttl)
+            return entry, True
+
+    def _settle(self, operation, key, entry, result=None, error=None):
+        if error is not None or not _succeeded(result):
+            with self._lock:
+                if self._entries.get((operation, key)) is entry:
+                    del self._entries[(operation, key)]
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
+
+    @staticmethod
+    def _reused(operation, key):
+        logger.warning(f"Idempotency key {key} reused for a different {operation} call")
+        return f"Error: Idempotency key {key} was already used with different parameters"
+
+    def _mismatch(self, operation, key, entry, request):
+        if entry.request != request:
+            return self._reused(operation, key)
+        logger.debug(f"Replaying {operation} result for idempotency key {key}")
+        return None
+
+    def _claim_shared(self, operation, key, request):
+        """Claim the key in the shared store: (True, None) to run the call, (True, answer) to
+        return answer instead, or (False, None) while another process is running it"""
+        stored = self.shared.claim(operation, key, request, self.hold)
+        if stored is None:
+            return True, None
+        stored_request, stored_result = stored
+        if stored_request != request:
+            return True, self._reused(operation, key)
+        if stored_result is None:
+            return False, None
+        logger.debug(f"Replaying {operation} result for idempotency key {key} from the shared store")
+        return True, self.result_types[operation](**json.loads(stored_result))
+
+    def _settle_shared(self, operation, key, result=None, error=None):
+        if error is None and _succeeded(result):
+            self.shared.finish(operation, key, json.dumps(result.as_dict()), self.ttl)
+        else:
+            self.shared.release(operation, key)
+
+    def _run_shared(self, operation, key, request, fn):
+        request = _encode_request(request)
+        while True:
+            claimed, answer = self._claim_shared(operation, key, request)
+            if claimed:
+                break
+            time.sleep(SHARED_POLL_INTERVAL)
+        if answer is not None:
+            return answer
+        try:
+            result = fn()
+        except BaseException as e:
+            self._settle_shared(operation, key, error=e)
+            raise
+        self._settle_shared(operation, key, result)
+        return result
+
+    async def _run_shared_async(self, operation, key, request, fn):
+        loop = asyncio.get_running_loop()
+        request = _encode_request(request)
+        while True:
+            claimed, answer = await loop.run_in_executor(None, self._claim_shared, operation, key, request)
+            if claimed:
+                break
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+        if answer is not None:
+            return answer
+        try:
+            result = await fn()
+        except BaseException as e:
+            await loop.run_in_executor(None, lambda: self._settle_shared(operation, key, error=e))
+            raise
+        await loop.run_in_executor(None, self._settle_shared, operation, key, result)
+        return result
+
+    def call(self, operation, key, request, fn):
+        """Run fn() once per (operation, key) and return its result; without a key just run it
+
+        request holds the call's parameters; a key reused with other parameters is an error.
+        """
+        if not key:
+            return fn()
+        entry, owner = self._claim(operation, key, request)
+        if not owner:
+            return self._mismatch(operation, key, entry, request) or entry.future.result()
+        try:
+            result = self._run_shared(operation, key, request, fn) if self.shared is not None else fn()
+        except BaseException as e:
+            self._settle(operation, key, entry, error=e)
+            raise
+        self._settle(operation, key, entry, result)
+        return result
+
+    async def call_async(self, operation, key, request, fn):
+        """call() for coroutine functions; waiting for a running duplicate does not block a thread"""
+        if not key:
+            return await fn()
+        entry, owner = self._claim(operation, key, request)
+        if not owner:
+            return self._mismatch(operation, key, entry, request) or await asyncio.wrap_future(entry.future)
+        try:
+            if self.shared is not None:
+                result = await self._run_shared_async(operation, key, request, fn)
+            else:
+                result = await fn()
+        except BaseException as e:
+            self._settle(operation, key, entry, error=e)
+            raise
+        self._settle(operation, key, entry, result)
+        return result
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+JSON calls for Eclipse Coffee Shop
+JsonRpcApplication serves the operations of a spyne application as JSON for
+internal callers. A call is {"operation": [arguments]} (or {"operation":
+{name: value}}); the answer is the operation's result, with unset fields left
+out, and a fault is {"faultcode": ..., "faultstring": ...}. The @rpc methods
+are called directly. There is no envelope, no schema validation and no trip
+through spyne's per-field serializer. External partners stay on SOAP.
+
+    POST /v2/json  {"getOrderStatus": [1001]}  ->  {"order_id": 1001, ...}
+"""
+
+import json
+import logging
+
+from spyne import ComplexModelBase, Fault
+from spyne.model.complex import Array
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+class JsonRpcApplication:
+    """WSGI app answering JSON calls to the operations of app, a spyne Application
+
+    Arguments are not validated against the schema, so the mount is only for
+    trusted callers. The blocking parts are separate so the asyncio server
+    can await its own variants of some operations.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.methods = {descriptor.name: descriptor
+                        for descriptors in app.interface.service_method_map.values()
+                        for descriptor in descriptors}
+
+    def parse(self, body):
+        """Return the descriptor and arguments of a call, raising a Client fault if it is malformed"""
+        try:
+            document = json.loads(body)
+        except ValueError as e:
+            raise Fault('Client.JsonDecodeError', f"Invalid JSON: {e}")
+        if not isinstance(document, dict) or len(document) != 1:
+            raise Fault('Client', "Need an object with exactly one key as method name")
+        (name, args), = document.items()
+        descriptor = self.methods.get(name)
+        if descriptor is None:
+            raise Fault('Client.ResourceNotFound', f"Requested resource '{name}' not found")
+        params = descriptor.in_message._type_info
+        if isinstance(args, dict):
+            args = [args.get(param) for param in params]
+        if not isinstance(args, list) or len(args) > len(params):
+            raise Fault('Client', f"{name} takes up to {len(params)} arguments")
+        args += [None] * (len(params) - len(args))
+        return descriptor, [_from_json(cls, value) for cls, value in zip(params.values(), args)]
+
+    def call(self, descriptor, args):
+        # The service methods do not use their context
+        return descriptor.function(None, *args)
+
+    def reply(self, result):
+        """(status, headers, body) of a successful call"""
+        return '200 OK', {'Content-Type': JSON_CONTENT_TYPE}, json.dumps(_to_json(result)).encode()
+
+    def reply_fault(self, fault):
+        """(status, headers, body) of a failed call"""
+        if fault.faultcode == 'Client.ResourceNotFound':
+            status = '404 Not Found'
+        elif fault.faultcode.startswith('Client'):
+            status = '400 Bad Request'
+        else:
+            status = '500 Internal Server Error'
+        content = json.dumps({'faultcode': fault.faultcode, 'faultstring': fault.faultstring}).encode()
+        return status, {'Content-Type': JSON_CONTENT_TYPE}, content
+
+    def handle(self, body):
+        """Answer one call; returns (status, headers, body)"""
+        try:
+            descriptor, args = self.parse(body)
+            return self.reply(self.call(descriptor, args))
+        except Fault as e:
+            return self.reply_fault(e)
+        except Exception as e:
+            logger.exception(e)
+            return self.reply_fault(Fault('Server', 'Internal Error'))
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response('405 Method Not Allowed', [('Allow', 'POST'), ('Content-Length', '0')])
+            return [b'']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        status, headers, content = self.handle(environ['wsgi.input'].read(length) if length else b'')
+        start_response(status, list(headers.items()) + [('Content-Length', str(len(content)))])
+        return [content]
+
+
+def _from_json(cls, value):
+    """The argument of type cls that value stands for"""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        if issubclass(cls, Array):
+            cls, = cls._type_info.values()
+        return [_from_json(cls, item) for item in value]
+    if issubclass(cls, ComplexModelBase) and isinstance(value, dict):
+        fields = cls.get_flat_type_info(cls)
+        return cls(**{name: _from_json(fields[name], item) for name, item in value.items() if name in fields})
+    return value
+
+
+def _to_json(value):
+    if isinstance(value, ComplexModelBase):
+        items = ((name, getattr(value, name, None)) for name in value.get_flat_type_info(value.__class__))
+        return {name: _to_json(item) for name, item in items if item is not None}
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    return value
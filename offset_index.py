@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Offset indexes for Eclipse Coffee Shop order files
+Maps order IDs to the byte range of each order body inside a JSON file, so
+single orders can be read without parsing the whole file
+"""
+
+import mmap
+import os
+import re
+import struct
+from bisect import bisect_left, bisect_right
+
+# Header: magic, format version, entry count, size and mtime of the indexed file
+_HEADER = struct.Struct('<4sIqqq')
+_MAGIC = b'COIX'
+_VERSION = 1
+_ITEM_SIZE = struct.calcsize('q')
+
+# Top-level members of a snapshot written with json.dump(..., indent=2)
+_SNAPSHOT_MEMBER = re.compile(rb'^  "(\d+)": ', re.M)
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def write_offset_index(index_path, entries, source_path):
+    """Write a sorted (order_id, offset, length) index for source_path"""
+    entries = sorted(entries)
+    size, mtime_ns = _file_signature(source_path)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(entries), size, mtime_ns))
+        for column in range(3):
+            f.write(struct.pack(f'<{len(entries)}q', *(entry[column] for entry in entries)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+
+def _strip_back(data, end):
+    """Step back from end over whitespace"""
+    while end > 0 and data[end - 1:end] in (b' ', b'\t', b'\r', b'\n'):
+        end -= 1
+    return end
+
+
+def scan_json_snapshot(data):
+    """Find the byte range of every top-level value in an indent=2 JSON snapshot
+
+    Returns None when the data does not look like such a snapshot, including
+    one cut short: a complete snapshot ends with the closing brace on its own line.
+    """
+    matches = list(_SNAPSHOT_MEMBER.finditer(data))
+    tail = _strip_back(data, len(data))
+    if not matches or data[tail - 2:tail] != b'\n}':
+        return None
+    entries = []
+    for current, following in zip(matches, matches[1:] + [None]):
+        start = current.end()
+        if following is not None:
+            # Values are separated by a comma before the next member's line
+            end = _strip_back(data, following.start())
+            if data[end - 1:end] != b',':
+                return None
+            end = _strip_back(data, end - 1)
+        else:
+            end = _strip_back(data, tail - 1)
+        if end <= start:
+            return None
+        entries.append((int(current.group(1)), start, end - start))
+    return entries
+
+
+class OffsetIndex:
+    """Memory-mapped, binary-searchable order ID -> (offset, length) index"""
+
+    def __init__(self, index_path):
+        self.path = index_path
+        with open(index_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.source_size, self.source_mtime_ns = _HEADER.unpack_from(self._mm)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{index_path} is not an order offset index")
+        if len(self._mm) != _HEADER.size + 3 * count * _ITEM_SIZE:
+            raise ValueError(f"{index_path} is truncated")
+        columns = memoryview(self._mm)[_HEADER.size:].cast('q')
+        self._ids = columns[:count]
+        self._offsets = columns[count:2 * count]
+        self._lengths = columns[2 * count:]
+
+    @classmethod
+    def open_for(cls, index_path, source_path):
+        """Open index_path if it exists and still describes source_path, else return None"""
+        if not os.path.exists(index_path):
+            return None
+        try:
+            index = cls(index_path)
+        except (OSError, ValueError):
+            return None
+        if (index.source_size, index.source_mtime_ns) != _file_signature(source_path):
+            return None
+        return index
+
+    def lookup(self, order_id):
+        """Return (offset, length) for order_id, or None"""
+        pos = bisect_left(self._ids, order_id)
+        if pos < len(self._ids) and self._ids[pos] == order_id:
+            return self._offsets[pos], self._lengths[pos]
+        return None
+
+    def ids(self):
+        return self._ids.tolist()
+
+    def ids_after(self, after_id, limit):
+        """Return up to limit IDs greater than after_id, in ascending order"""
+        start = bisect_right(self._ids, after_id)
+        return self._ids[start:start + limit].tolist()
+
+    def max_id(self):
+        return self._ids[-1] if len(self._ids) else 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, order_id):
+        return self.lookup(order_id) is not None
+
+
+class MappedJsonFile:
+    """A read-only, memory-mapped JSON file paired with its offset index"""
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def raw(self, order_id):
+        """Return the raw JSON bytes of one order, or None"""
+        entry = self.index.lookup(order_id)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mm[offset:offset + length]
+
+
+def open_json_snapshot(path, index_path):
+    """Map an indent=2 JSON snapshot, reusing index_path or rebuilding it by scanning the file
+
+    Returns None when the snapshot is empty or not in the expected layout.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    index = OffsetIndex.open_for(index_path, path)
+    if index is None:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            entries = scan_json_snapshot(mm)
+        if entries is None:
+            return None
+        write_offset_index(index_path, entries, path)
+        index = OffsetIndex(index_path)
+    return MappedJsonFile(path, index)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cold-tier archive for Eclipse Coffee Shop orders
+Orders that are finished (confirmed, cancelled or refunded) and old enough are
+moved out of the hot store into immutable, memory-mapped segment files
+"""
+
+import glob
+import json
+import logging
+import mmap
+import os
+import re
+from datetime import datetime
+
+from offset_index import MappedJsonFile, OffsetIndex, write_offset_index
+from order_model import Order, json_default
+
+logger = logging.getLogger(__name__)
+
+# Order statuses that are (almost) never changed again
+ARCHIVABLE_STATUSES = ('confirmed', 'cancelled', 'refunded')
+
+_SEGMENT_NAME = re.compile(r'segment-(\d+)\.jsonl$')
+
+
+def last_activity(order):
+    """Return the latest of the order's creation, payment and refund times"""
+    latest = None
+    for field in ('created_at', 'payment_date', 'refund_date'):
+        try:
+            moment = datetime.fromisoformat(order.get(field))
+        except (TypeError, ValueError):
+            continue
+        if latest is None or moment > latest:
+            latest = moment
+    return latest
+
+
+def is_archivable(order, cutoff):
+    """True if the order is finished and has not changed since the cutoff time"""
+    if order.get('status') not in ARCHIVABLE_STATUSES:
+        return False
+    moment = last_activity(order)
+    return moment is not None and moment < cutoff
+
+
+def _scan_segment(path):
+    """Rebuild (order_id, offset, length) entries for a segment with one order per line"""
+    entries = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = 0
+        while offset < len(mm):
+            end = mm.find(b'\n', offset)
+            if end == -1:
+                end = len(mm)
+            if end > offset:
+                entries.append((int(json.loads(mm[offset:end])['id']), offset, end - offset))
+            offset = end + 1
+    return entries
+
+
+class OrderArchive:
+    """Read-through archive made of immutable JSON-lines segments, newest segment wins"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._segments = []
+        for path in sorted(glob.glob(os.path.join(directory, 'segment-*.jsonl'))):
+            if _SEGMENT_NAME.search(path):
+                self._segments.append(self._open_segment(path))
+        if self._segments:
+            logger.info(f"Order archive opened with {len(self._segments)} segments, {len(self)} orders")
+
+    def _open_segment(self, path):
+        index_path = path + '.idx'
+        index = OffsetIndex.open_for(index_path, path)
+        if index is None:
+            write_offset_index(index_path, _scan_segment(path), path)
+            index = OffsetIndex(index_path)
+        return MappedJsonFile(path, index)
+
+    def get(self, order_id):
+        """Return the archived order, or None"""
+        for segment in reversed(self._segments):
+            raw = segment.raw(order_id)
+            if raw is not None:
+                return Order.from_dict(json.loads(raw))
+        return None
+
+    def write_segment(self, orders):
+        """Durably write the given orders into a new immutable segment"""
+        if not orders:
+            return
+        number = 1
+        if self._segments:
+            number = int(_SEGMENT_NAME.search(self._segments[-1].path).group(1)) + 1
+        path = os.path.join(self.directory, f'segment-{number:06d}.jsonl')
+        tmp_path = path + '.tmp'
+        entries = []
+        with open(tmp_path, 'wb') as f:
+            offset = 0
+            for order in sorted(orders, key=lambda o: o['id']):
+                line = json.dumps(order, default=json_default).encode('ascii')
+                f.write(line + b'\n')
+                entries.append((order['id'], offset, len(line)))
+                offset += len(line) + 1
+            f.flush()
+            os.fsync(f.fileno())
+        # The index is written against the temp file, whose size and mtime survive the rename
+        write_offset_index(path + '.idx', entries, tmp_path)
+        os.replace(tmp_path, path)
+        self._segments = self._segments + [self._open_segment(path)]
+        logger.info(f"Archived {len(entries)} orders to {path}")
+
+    def ids(self):
+        order_ids = set()
+        for segment in self._segments:
+            order_ids.update(segment.index.ids())
+        return order_ids
+
+    def ids_after(self, after_id, limit):
+        """Return up to limit archived IDs greater than after_id, in ascending order"""
+        order_ids = set()
+        for segment in self._segments:
+            order_ids.update(segment.index.ids_after(after_id, limit))
+        return sorted(order_ids)[:limit]
+
+    def max_id(self):
+        return max((segment.index.max_id() for segment in self._segments), default=0)
+
+    def __len__(self):
+        if len(self._segments) == 1:
+            return len(self._segments[0].index)
+        return len(self.ids())
+
+    def __contains__(self, order_id):
+        return any(order_id in segment.index for segment in self._segments)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory order model for Eclipse Coffee Shop
+Orders keep their fields in __slots__ and share one interned tuple per distinct
+cart item, but still read and write like the plain order dicts used everywhere
+else and serialize to exactly the same JSON shape
+"""
+
+# Fields in the order they appear in serialized orders
+ORDER_FIELDS = (
+    'id', 'customer_name', 'customer_email', 'items', 'total_amount', 'status', 'created_at', 'payment_status',
+    'payment_method', 'payment_date', 'refund_status', 'refund_amount', 'refund_reason', 'refund_date', 'version'
+)
+_SLOT_NAMES = {field: ('_items' if field == 'items' else field) for field in ORDER_FIELDS}
+_MISSING = object()
+
+# One shared tuple per distinct cart item (name, price, image URL, ...) across all orders
+_item_fields_cache = {}
+
+
+def _intern_item_fields(fields):
+    # Value types are part of the key so 3 and 3.0 (or 1 and True) stay distinct
+    key = tuple((field, type(value), value) for field, value in fields)
+    try:
+        return _item_fields_cache.setdefault(key, fields)
+    except TypeError:
+        # Unhashable values (e.g. nested lists) are kept per item
+        return fields
+
+
+class OrderItem:
+    """One cart line: the interned item fields plus the quantity ordered"""
+
+    __slots__ = ('_fields', 'qty')
+
+    def __init__(self, fields, qty):
+        self._fields = fields
+        self.qty = qty
+
+    @classmethod
+    def from_dict(cls, item):
+        # 'qty' keeps its position as a placeholder so the key order round-trips
+        fields = tuple((key, None if key == 'qty' else value) for key, value in item.items())
+        return cls(_intern_item_fields(fields), item.get('qty'))
+
+    def to_dict(self):
+        return {key: (self.qty if key == 'qty' else value) for key, value in self._fields}
+
+    def __getitem__(self, key):
+        if key == 'qty':
+            return self.qty
+        for field, value in self._fields:
+            if field == key:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def _items_to_list(items):
+    # Malformed orders may carry items as a raw string; hand those back untouched
+    return [item.to_dict() for item in items] if isinstance(items, list) else items
+
+
+class Order:
+    """A single order with dict-style access to its fields
+
+    Unset optional fields (payment, refund) raise KeyError like a missing dict
+    key; fields outside ORDER_FIELDS are kept in a small overflow dict.
+    """
+
+    __slots__ = tuple(_SLOT_NAMES.values()) + ('_extra',)
+
+    def __init__(self, **fields):
+        self._extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an Order from a plain order dict (returns Order instances unchanged)"""
+        if isinstance(data, Order):
+            return data
+        return cls(**data)
+
+    def to_dict(self):
+        """Return the order as a plain dict in the serialized field order"""
+        data = {}
+        for field, slot in _SLOT_NAMES.items():
+            value = getattr(self, slot, _MISSING)
+            if value is not _MISSING:
+                data[field] = _items_to_list(value) if field == 'items' else value
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def copy(self):
+        """Return a shallow copy; item lines are immutable and shared"""
+        clone = Order.__new__(Order)
+        for slot in Order.__slots__:
+            value = getattr(self, slot, _MISSING)
+            if value is not _MISSING:
+                setattr(clone, slot, value)
+        if self._extra:
+            clone._extra = dict(self._extra)
+        return clone
+
+    def __getitem__(self, key):
+        slot = _SLOT_NAMES.get(key)
+        if slot is None:
+            if self._extra and key in self._extra:
+                return self._extra[key]
+            raise KeyError(key)
+        try:
+            value = getattr(self, slot)
+        except AttributeError:
+            raise KeyError(key) from None
+        return _items_to_list(value) if key == 'items' else value
+
+    def __setitem__(self, key, value):
+        slot = _SLOT_NAMES.get(key)
+        if slot is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        elif key == 'items' and isinstance(value, list):
+            self._items = [OrderItem.from_dict(item) for item in value]
+        else:
+            setattr(self, slot, value)
+
+    def __contains__(self, key):
+        slot = _SLOT_NAMES.get(key)
+        if slot is None:
+            return bool(self._extra) and key in self._extra
+        return hasattr(self, slot)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return f"Order({self.to_dict()!r})"
+
+
+def json_default(value):
+    """json.dumps default= hook that serializes Order objects as plain order dicts"""
+    if isinstance(value, Order):
+        return value.to_dict()
+    return str(value)
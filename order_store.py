@@ -0,0 +1,1529 @@
+#!/usr/bin/env python3
+"""
+Order and user storage for Eclipse Coffee Shop
+Both the SOAP service and the web service keep their data behind these stores,
+so the backend (in-memory, JSON snapshot + log, or SQLite) can be swapped freely
+"""
+
+import fcntl
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from offset_index import open_json_snapshot, write_offset_index
+from order_archive import OrderArchive, is_archivable
+from order_model import Order, json_default
+
+logger = logging.getLogger(__name__)
+
+# Snapshot compaction for the JSON backend: a full snapshot is written in the background
+# every SNAPSHOT_INTERVAL seconds, or sooner once the log grows past SNAPSHOT_LOG_THRESHOLD bytes
+SNAPSHOT_INTERVAL = float(os.environ.get('ORDERS_SNAPSHOT_INTERVAL', '300'))
+SNAPSHOT_LOG_THRESHOLD = int(os.environ.get('ORDERS_SNAPSHOT_LOG_THRESHOLD', str(4 * 1024 * 1024)))
+SNAPSHOT_CHECK_INTERVAL = 1.0
+
+# 'lazy' startup only indexes the snapshot (via orders.json.idx) and parses each order on first access
+LOAD_MODE = os.environ.get('ORDERS_LOAD_MODE', 'eager')
+
+# Group commit for the mutation log: while one commit is being written, appends arriving within
+# GROUP_COMMIT_WINDOW seconds are written together with a single fsync. A lone writer does not
+# wait. A longer window trades per-request latency under load for write throughput.
+GROUP_COMMIT_WINDOW = float(os.environ.get('ORDERS_GROUP_COMMIT_WINDOW_MS', '2')) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('ORDERS_GROUP_COMMIT_MAX_BATCH', '256'))
+
+# Confirmed, cancelled and refunded orders untouched for this many days move to the cold archive
+# on the next compaction. Off by default ('' or 'off'), which keeps every order in the snapshot.
+_archive_after_days = os.environ.get('ORDERS_ARCHIVE_AFTER_DAYS', 'off')
+ARCHIVE_AFTER = float(_archive_after_days) * 86400 if _archive_after_days not in ('', 'off') else None
+
+# Page sizes for paged order listings when the caller gives no limit, and the largest page served
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Shared state daemon (state_daemon.py) used by the 'daemon' backend. Its socket must be in a
+# directory only this user can enter. Clients prove they know COFFEESHOP_STATE_AUTHKEY or, if that
+# is unset, the random key the daemon writes next to its socket (mode 0600) when it starts.
+STATE_DIR = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), f'eclipse-coffee-{os.getuid()}')
+STATE_SOCKET = os.environ.get('COFFEESHOP_STATE_SOCKET', os.path.join(STATE_DIR, 'state.sock'))
+STATE_AUTHKEY = os.environ.get('COFFEESHOP_STATE_AUTHKEY', '').encode() or None
+
+
+def normalize_email(email):
+    """Return the form emails are indexed and looked up by (trimmed, lower-case)"""
+    return (email or '').strip().lower()
+
+
+def _add_normalized_email_column(conn, table, source_column, column):
+    """Add and backfill a normalized email column on databases created before it existed"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column in columns:
+        return
+    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+    rows = conn.execute(f'SELECT id, {source_column} FROM {table}').fetchall()
+    conn.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?',
+                     [(normalize_email(email), row_id) for row_id, email in rows])
+    logger.info(f"Indexed normalized emails for {len(rows)} existing rows in {table}")
+
+
+# Locks guarding read-modify-write of orders and users are shared out over this many stripes
+LOCK_STRIPES = 64
+# A versioned transition that keeps losing races to other writers gives up after this many attempts
+TRANSITION_ATTEMPTS = 5
+
+
+class VersionConflict(Exception):
+    """An order was changed by someone else while a versioned transition was being applied"""
+
+
+class DuplicateEmail(Exception):
+    """A member with the same normalized email is already stored"""
+
+
+class StripedLocks:
+    """A fixed pool of re-entrant locks shared out by key, so unrelated keys rarely contend"""
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+# Processes lease order and user IDs from their sequence this many at a time
+ID_BLOCK_SIZE = int(os.environ.get('COFFEESHOP_ID_BLOCK_SIZE', '1000'))
+
+
+class IdSequence:
+    """In-process sequence of IDs after last_id, for stores that keep nothing on disk"""
+
+    def __init__(self, last_id):
+        self._last_id = last_id
+        self._lock = threading.Lock()
+
+    def lease(self, count):
+        """Reserve the next count IDs and return the highest of them"""
+        with self._lock:
+            self._last_id += count
+            return self._last_id
+
+
+class FileIdSequence:
+    """ID sequence kept in a small JSON file next to a store, shared by processes through flock
+
+    The file maps sequence names to the highest ID leased so far. If it is
+    lost, leasing continues from floor, the highest ID stored.
+    """
+
+    def __init__(self, path, name, floor):
+        self.path = path
+        self.name = name
+        self.floor = floor
+
+    def lease(self, count):
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                sequences = json.loads(f.read() or '{}')
+            except ValueError:
+                logger.warning(f"Unreadable ID lease file {self.path}; continuing from ID {self.floor}")
+                sequences = {}
+            last_id = max(sequences.get(self.name, 0), self.floor) + count
+            sequences[self.name] = last_id
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(sequences))
+            f.flush()
+            os.fsync(f.fileno())
+        return last_id
+
+
+class BlockIdAllocator:
+    """Thread-safe source of increasing IDs, leased from a shared sequence a block at a time
+
+    Only starting a new block touches the sequence, so an ID is usually a
+    local increment, and processes leasing from the same sequence never hand
+    out the same ID. IDs left in a block when a process exits are skipped.
+    """
+
+    def __init__(self, sequence, block_size=ID_BLOCK_SIZE):
+        self.sequence = sequence
+        self.block_size = block_size
+        self._last_id = self._block_end = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def next(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's block is the parent's
+                self._last_id = self._block_end = 0
+                self._pid = os.getpid()
+            if self._last_id >= self._block_end:
+                self._block_end = self.sequence.lease(self.block_size)
+                self._last_id = self._block_end - self.block_size
+            self._last_id += 1
+            return self._last_id
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+
+def _unpost(postings, value, order_id):
+    """Take order_id out of the sorted posting list for value, dropping the list once empty"""
+    order_ids = postings[value]
+    del order_ids[bisect_left(order_ids, order_id)]
+    if not order_ids:
+        del postings[value]
+
+
+class OrderIndexes:
+    """Secondary indexes from customer email, status and payment status to order IDs
+
+    Each value's order IDs are kept sorted, so a page is read from the cursor
+    onwards instead of collecting and sorting every match.
+    """
+
+    FIELDS = ('customer_email', 'status', 'payment_status')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {field: {} for field in self.FIELDS}
+        # Order ID -> the values it is currently indexed under
+        self._keys = {}
+
+    @staticmethod
+    def _keys_for(order):
+        return (normalize_email(order.get('customer_email')), order.get('status'), order.get('payment_status'))
+
+    def update(self, order):
+        """Index an order, moving it out of the entries for its previous values"""
+        order_id = order['id']
+        keys = self._keys_for(order)
+        with self._lock:
+            old_keys = self._keys.get(order_id)
+            if old_keys == keys:
+                return
+            for field, old_value, value in zip(self.FIELDS, old_keys or (None,) * len(keys), keys):
+                postings = self._postings[field]
+                if old_keys is not None:
+                    if old_value == value:
+                        continue
+                    _unpost(postings, old_value, order_id)
+                insort(postings.setdefault(value, []), order_id)
+            self._keys[order_id] = keys
+
+    def remove(self, order_id):
+        with self._lock:
+            old_keys = self._keys.pop(order_id, None)
+            if old_keys is None:
+                return
+            for field, old_value in zip(self.FIELDS, old_keys):
+                _unpost(self._postings[field], old_value, order_id)
+
+    def lookup(self, customer_email=None, status=None, payment_status=None, after_id=None, limit=None):
+        """Return the IDs of orders matching every given value, in ascending order
+
+        after_id and limit select one page of the result. It is read from the
+        shortest matching posting list starting at the cursor, and its IDs are
+        checked against the other values, so a page costs about its own size.
+        """
+        values = (normalize_email(customer_email) if customer_email is not None else None, status, payment_status)
+        wanted = [(n, value) for n, value in enumerate(values) if value is not None]
+        if not wanted:
+            raise ValueError("At least one of customer_email, status or payment_status is required")
+        with self._lock:
+            postings = min((self._postings[self.FIELDS[n]].get(value, []) for n, value in wanted), key=len)
+            start = bisect_right(postings, after_id) if after_id is not None else 0
+            if len(wanted) == 1:
+                return postings[start:] if limit is None else postings[start:start + limit]
+            order_ids = []
+            for position in range(start, len(postings)):
+                order_id = postings[position]
+                keys = self._keys[order_id]
+                if all(keys[n] == value for n, value in wanted):
+                    order_ids.append(order_id)
+                    if len(order_ids) == limit:
+                        break
+            return order_ids
+
+
+class SortedIdMap(dict):
+    """Dict of orders by ID that also keeps its IDs in ascending order
+
+    Pages of IDs are sliced from the cursor onwards with bisect instead of
+    scanning every key. Only item assignment, setdefault, pop, del and clear
+    may change it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def __setitem__(self, order_id, order):
+        with self._lock:
+            if order_id not in self:
+                insort(self._ids, order_id)
+            super().__setitem__(order_id, order)
+
+    def setdefault(self, order_id, order=None):
+        with self._lock:
+            if order_id not in self:
+                insort(self._ids, order_id)
+                super().__setitem__(order_id, order)
+            return self[order_id]
+
+    def __delitem__(self, order_id):
+        with self._lock:
+            super().__delitem__(order_id)
+            del self._ids[bisect_left(self._ids, order_id)]
+
+    def pop(self, order_id, *default):
+        with self._lock:
+            if order_id in self:
+                del self._ids[bisect_left(self._ids, order_id)]
+            return super().pop(order_id, *default)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._ids.clear()
+
+    def ids(self):
+        """Return all IDs in ascending order"""
+        return list(self._ids)
+
+    def ids_after(self, after_id, limit):
+        """Return up to limit IDs greater than after_id, in ascending order"""
+        start = bisect_right(self._ids, after_id)
+        return self._ids[start:start + limit]
+
+    def max_id(self):
+        return self._ids[-1] if self._ids else 0
+
+
+class OrderStore:
+    """Interface shared by all order storage backends
+
+    Orders are handed out as compact Order objects (see order_model.py) that
+    read and write like plain order dicts; add() and save() accept either.
+    get() hands out a private copy, so callers must call save() after
+    changing an order for the change to be persisted, and concurrent readers
+    never see a half-applied change.
+    all() returns plain dicts ready for serialization.
+
+    Stores are safe to share between threads. Every order carries a version
+    (0 if it has never been changed this way). transition() reads an order,
+    lets a callback change it and saves it with compare_and_save(), which only
+    succeeds if nobody saved a newer version in the meantime. State changes
+    therefore never wait on each other; of two racing changes to one order,
+    the first to save wins and the other is re-checked against the result.
+    Reads need no lock.
+    """
+
+    def __init__(self):
+        self._stripes = StripedLocks()
+
+    def locked(self, order_id):
+        """Return the lock serializing updates of the given order (a context manager)"""
+        return self._stripes.lock_for(order_id)
+
+    def id_sequence(self, floor):
+        """Return the sequence order IDs are leased from, continuing above floor and every stored ID"""
+        return IdSequence(max(floor, self.max_id()))
+
+    def id_allocator(self, floor):
+        """Return an allocator handing out order IDs above both floor and every stored ID"""
+        return BlockIdAllocator(self.id_sequence(floor))
+
+    def get(self, order_id):
+        """Return a copy of the order with the given ID, or None"""
+        raise NotImplementedError
+
+    def get_many(self, order_ids):
+        """Return copies of the orders with the given IDs, in order (None for missing ones)"""
+        return [self.get(order_id) for order_id in order_ids]
+
+    def add(self, order):
+        """Store a newly created order"""
+        raise NotImplementedError
+
+    def save(self, order):
+        """Persist changes made to an existing order"""
+        raise NotImplementedError
+
+    def compare_and_save(self, order):
+        """Save the order only if the stored copy still has the order's version
+
+        On success the order's version is incremented and True is returned;
+        if another writer saved the order since it was read, nothing is
+        written and False is returned.
+        """
+        raise NotImplementedError
+
+    def transition(self, order_id, apply, expected_version=None):
+        """Apply a state change to one order with optimistic concurrency and return apply's reply
+
+        apply(order) receives a fresh copy of the order (None if missing) and
+        returns (reply, changed); a changed order is saved by compare-and-set.
+        If that loses a race, apply runs again on the newer version, so it
+        must not have side effects outside the order. With expected_version,
+        the change is refused if the order is at any other version. Raises
+        VersionConflict when the version does not match or the order keeps changing.
+        """
+        order = self.get(order_id)
+        for attempt in range(TRANSITION_ATTEMPTS):
+            if order is not None and expected_version is not None and order.get('version', 0) != expected_version:
+                raise VersionConflict(f"Order {order_id} is at version {order.get('version', 0)}, "
+                                      f"not {expected_version}; reload it and retry")
+            reply, changed = apply(order)
+            if not changed:
+                return reply
+            saved, order = self._compare_and_save_or_reload(order)
+            if saved:
+                return reply
+            if expected_version is not None:
+                raise VersionConflict(f"Order {order_id} was changed by another request; reload it and retry")
+            logger.debug(f"Order {order_id} changed during a transition (attempt {attempt + 1}); retrying")
+        raise VersionConflict(f"Order {order_id} kept changing after {TRANSITION_ATTEMPTS} attempts; retry")
+
+    def _compare_and_save_or_reload(self, order):
+        """compare_and_save() the order; return (True, None) if saved, else (False, a fresh copy)"""
+        if self.compare_and_save(order):
+            return True, None
+        return False, self.get(order['id'])
+
+    def all(self):
+        """Return every order as a dict keyed by order ID"""
+        raise NotImplementedError
+
+    def find(self, customer_email=None, status=None, payment_status=None):
+        """Return orders matching every given field as plain dicts in ascending ID order
+
+        Served from secondary indexes; customer emails match case-insensitively.
+        At least one field must be given.
+        """
+        raise NotImplementedError
+
+    def page(self, after_id, limit, customer_email=None, status=None, payment_status=None):
+        """Return one page of orders, in ascending ID order, and the cursor for the next page
+
+        The page holds up to `limit` plain-dict orders with IDs above `after_id`
+        (None for the first page) that match every given filter. The cursor is
+        None on the last page. Only the orders on the page are loaded.
+        """
+        raise NotImplementedError
+
+    def ids(self):
+        """Return all order IDs in ascending order"""
+        raise NotImplementedError
+
+    def max_id(self):
+        """Return the highest order ID in the store, or 0 when empty"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, order_id):
+        return self.get(order_id) is not None
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class MemoryOrderStore(OrderStore):
+    """Non-persistent order store backed by a dict"""
+
+    def __init__(self):
+        super().__init__()
+        self.orders = SortedIdMap()
+        self.indexes = OrderIndexes()
+
+    def get(self, order_id):
+        order = self.orders.get(order_id)
+        return order.copy() if order is not None else None
+
+    def add(self, order):
+        order = Order.from_dict(order)
+        self.orders[order['id']] = order
+        self.indexes.update(order)
+
+    def save(self, order):
+        order = Order.from_dict(order)
+        self.orders[order['id']] = order
+        self.indexes.update(order)
+
+    def compare_and_save(self, order):
+        version = order.get('version', 0)
+        # Only held for the version check and the save, never across a caller's work
+        with self._stripes.lock_for(order['id']):
+            current = self._peek(order['id'])
+            if current is None or current.get('version', 0) != version:
+                return False
+            order['version'] = version + 1
+            self.save(order)
+        return True
+
+    def all(self):
+        return {order_id: order.to_dict() for order_id, order in list(self.orders.items())}
+
+    def _peek(self, order_id):
+        """Read an order for listing"""
+        return self.orders.get(order_id)
+
+    def _query_indexes(self, customer_email, status, payment_status, after_id=None, limit=None):
+        return self.indexes.lookup(customer_email, status, payment_status, after_id, limit)
+
+    def _ids_after(self, after_id, limit):
+        """Return up to limit order IDs greater than after_id, in ascending order"""
+        return self.orders.ids_after(after_id, limit)
+
+    def find(self, customer_email=None, status=None, payment_status=None):
+        order_ids = self._query_indexes(customer_email, status, payment_status)
+        orders = (self._peek(order_id) for order_id in order_ids)
+        return [order.to_dict() for order in orders if order is not None]
+
+    def page(self, after_id, limit, customer_email=None, status=None, payment_status=None):
+        after_id = after_id or 0
+        # One extra ID tells whether another page follows
+        if customer_email is None and status is None and payment_status is None:
+            order_ids = self._ids_after(after_id, limit + 1)
+        else:
+            order_ids = self._query_indexes(customer_email, status, payment_status, after_id, limit + 1)
+        orders = (self._peek(order_id) for order_id in order_ids[:limit])
+        next_cursor = order_ids[limit - 1] if len(order_ids) > limit else None
+        return [order.to_dict() for order in orders if order is not None], next_cursor
+
+    def ids(self):
+        return self.orders.ids()
+
+    def max_id(self):
+        return self.orders.max_id()
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+
+class _CommitBatch:
+    """Lines waiting to be written together by one group commit"""
+
+    def __init__(self):
+        self.lines = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitLog:
+    """Append-only log file that makes concurrent appends durable with one write and one fsync
+
+    The first appender of a batch becomes its leader. If no other commit is in
+    flight it writes right away, so a lone writer never waits. Otherwise it
+    lets other appenders join for up to `window` seconds (or until `max_batch`
+    lines have joined) and for the running commit to finish, then writes the
+    whole batch, fsyncs once and wakes the other appenders. append() only
+    returns once the caller's line is on disk.
+    """
+
+    def __init__(self, path, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self._file = None
+        self._batch = None
+        self._flushing = False
+        self._cond = threading.Condition()
+
+    def append(self, line):
+        """Append one line and block until the batch containing it is durable"""
+        with self._cond:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _CommitBatch()
+                busy = self._flushing
+            batch.lines.append(line)
+            if len(batch.lines) >= self.max_batch:
+                self._cond.notify_all()
+        if leader:
+            self._commit(batch, busy)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def _commit(self, batch, busy):
+        with self._cond:
+            # Under load, give concurrent writers a chance to join this batch; stop early once it is full
+            deadline = time.monotonic() + (self.window if busy else 0)
+            while len(batch.lines) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # Lines keep joining while the previous batch is still being flushed
+            while self._flushing:
+                self._cond.wait()
+            self._batch = None
+            self._flushing = True
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(''.join(batch.lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            logger.error(f"Error writing {len(batch.lines)} log records to {self.path}: {e}")
+            batch.error = e
+        finally:
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+            batch.done.set()
+
+    @contextmanager
+    def paused(self):
+        """Hold off all writes and close the file, e.g. while the log is being rotated"""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._flushing = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+
+    def close(self):
+        with self.paused():
+            pass
+
+
+class JsonOrderStore(MemoryOrderStore):
+    """Order store persisted as an orders.json snapshot plus an append-only mutation log
+
+    Every add/save appends only the changed order to the log, with concurrent
+    appends sharing one group commit; a background compactor periodically
+    folds the log into a new snapshot that atomically replaces the old one.
+
+    Each snapshot is written together with an order-id -> offset index. In
+    lazy load mode startup only maps that index; `orders` then holds just the
+    orders read or changed since boot, and the rest are parsed from the
+    memory-mapped snapshot on first access.
+
+    If `archive_after` is set, compaction also moves finished orders idle for
+    longer than that many seconds into the cold OrderArchive next to the
+    snapshot; reads fall through to it, and an archived order that is saved
+    again becomes hot until it ages out.
+
+    The secondary indexes behind find() are built on the first query, so
+    startup stays cheap, and are kept up to date by every add and save after that.
+    """
+
+    def __init__(self, path, snapshot_interval=SNAPSHOT_INTERVAL, snapshot_log_threshold=SNAPSHOT_LOG_THRESHOLD,
+                 group_commit_window=GROUP_COMMIT_WINDOW, load_mode=LOAD_MODE, archive_after=ARCHIVE_AFTER):
+        super().__init__()
+        self.path = path
+        self.index_path = path + '.idx'
+        self.lazy = load_mode == 'lazy'
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        # Log segment being folded into a snapshot by the compactor
+        self.compacting_log_path = self.log_path + '.compacting'
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_log_threshold = snapshot_log_threshold
+
+        self._log = GroupCommitLog(self.log_path, window=group_commit_window)
+        self._snapshot_lock = threading.Lock()
+        self._compactor_stop = threading.Event()
+        self._compactor_thread = None
+        # Memory-mapped snapshot backing orders not yet loaded (lazy mode only)
+        self._base = None
+
+        self.archive_after = archive_after
+        archive_dir = os.path.splitext(path)[0] + '_archive'
+        self.archive = OrderArchive(archive_dir) if archive_after is not None or os.path.isdir(archive_dir) else None
+        # Orders saved since the last snapshot began; compaction must not evict these
+        self._dirty = set()
+        self._evict_lock = threading.Lock()
+        self._indexes_ready = False
+
+        self.load()
+
+    def get(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None:
+            base = self._base
+            raw = base.raw(order_id) if base is not None else None
+            if raw is not None:
+                order = self.orders.setdefault(order_id, Order.from_dict(json.loads(raw)))
+            elif self.archive is not None:
+                # Archived orders are read through without being cached in the hot set
+                return self.archive.get(order_id)
+        return order.copy() if order is not None else None
+
+    def all(self):
+        return {order_id: self._peek(order_id).to_dict() for order_id in self.ids()}
+
+    def _id_set(self):
+        order_ids = set(self.orders)
+        base = self._base
+        if base is not None:
+            order_ids.update(base.index.ids())
+        if self.archive is not None:
+            order_ids.update(self.archive.ids())
+        return order_ids
+
+    def ids(self):
+        return sorted(self._id_set())
+
+    def max_id(self):
+        base = self._base
+        return max(
+            self.orders.max_id(),
+            base.index.max_id() if base is not None else 0,
+            self.archive.max_id() if self.archive is not None else 0
+        )
+
+    def id_sequence(self, floor):
+        # Leases survive restarts in orders.json.lease, next to the snapshot
+        return FileIdSequence(self.path + '.lease', 'orders', max(floor, self.max_id()))
+
+    def __len__(self):
+        if self._base is None and self.archive is None:
+            return len(self.orders)
+        return len(self._id_set())
+
+    def _ids_after(self, after_id, limit):
+        # Each tier contributes its own first `limit` IDs; the smallest of their union form the page
+        order_ids = set(super()._ids_after(after_id, limit))
+        base = self._base
+        if base is not None:
+            order_ids.update(base.index.ids_after(after_id, limit))
+        if self.archive is not None:
+            order_ids.update(self.archive.ids_after(after_id, limit))
+        return sorted(order_ids)[:limit]
+
+    def __contains__(self, order_id):
+        base = self._base
+        return (order_id in self.orders
+                or (base is not None and order_id in base.index)
+                or (self.archive is not None and order_id in self.archive))
+
+    def _publish(self, order):
+        with self._evict_lock:
+            self._dirty.add(order['id'])
+            self.orders[order['id']] = order
+            if self._indexes_ready:
+                self.indexes.update(order)
+
+    def _peek(self, order_id):
+        """Read an order from whichever tier holds it, without caching it in the hot set"""
+        order = self.orders.get(order_id)
+        if order is None:
+            base = self._base
+            raw = base.raw(order_id) if base is not None else None
+            if raw is not None:
+                order = Order.from_dict(json.loads(raw))
+            elif self.archive is not None:
+                order = self.archive.get(order_id)
+        return order
+
+    def _build_indexes(self):
+        if self._indexes_ready:
+            return
+        # Writers publish under the same lock, so no change slips between the scan and going live
+        with self._evict_lock:
+            if self._indexes_ready:
+                return
+            started = time.monotonic()
+            for order_id in self._id_set():
+                order = self._peek(order_id)
+                if order is not None:
+                    self.indexes.update(order)
+            self._indexes_ready = True
+        logger.info(f"Indexed {len(self)} orders by customer and status in {time.monotonic() - started:.2f}s")
+
+    def _query_indexes(self, customer_email, status, payment_status, after_id=None, limit=None):
+        self._build_indexes()
+        return super()._query_indexes(customer_email, status, payment_status, after_id, limit)
+
+    def add(self, order):
+        # The order is published before it is logged so a concurrent snapshot can never
+        # drop it; a failed append takes it back out
+        order = Order.from_dict(order)
+        self._publish(order)
+        try:
+            self._append_log(order)
+        except Exception:
+            self.orders.pop(order['id'], None)
+            self.indexes.remove(order['id'])
+            raise
+
+    def save(self, order):
+        order = Order.from_dict(order)
+        self._publish(order)
+        self._append_log(order)
+
+    def _append_log(self, order):
+        """Durably append the current state of a single order to the mutation log"""
+        self._log.append(json.dumps(order, default=json_default) + '\n')
+
+    def load(self):
+        """Load the last snapshot and replay the mutation log on top of it
+
+        Raises if the snapshot or a log cannot be read, since starting without
+        those orders would let the next compaction overwrite them.
+        """
+        self.orders.clear()
+        self._base = None
+        if os.path.exists(self.path):
+            try:
+                if self.lazy:
+                    self._base = open_json_snapshot(self.path, self.index_path)
+                if self._base is not None:
+                    logger.info(f"Indexed {len(self._base.index)} orders in {self.path}")
+                else:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        loaded = json.load(f)
+                        # Convert keys back to int
+                        for k, v in loaded.items():
+                            self.orders[int(k)] = Order.from_dict(v)
+                    logger.info(f"Orders loaded from {self.path}")
+            except Exception as e:
+                logger.error(f"Error loading orders from {self.path}: {e}; fix or restore the file before starting")
+                raise
+        else:
+            logger.info(f"No existing orders file found at {self.path}")
+        try:
+            # An unfinished compaction leaves older entries in the compacting segment
+            for path in (self.compacting_log_path, self.log_path):
+                replayed = self._replay_log(path)
+                if replayed:
+                    logger.info(f"Replayed {replayed} order mutations from {path}")
+        except Exception as e:
+            logger.error(f"Error replaying order log: {e}")
+            raise
+
+    def _replay_log(self, path):
+        """Apply logged order mutations on top of the loaded snapshot
+
+        A crash mid-append can leave a torn final record; it is cut off so new
+        records start on a line of their own. An unreadable record anywhere
+        else raises, since skipping it would lose that change for good at the
+        next compaction.
+        """
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        torn = None
+        end = 0
+        with open(path, 'rb') as f:
+            for line_no, line in enumerate(f, 1):
+                start, end = end, end + len(line)
+                if not line.strip():
+                    continue
+                if torn is not None:
+                    raise ValueError(f"Unreadable record at {path}:{torn[0]} is followed by more records")
+                try:
+                    order = json.loads(line)
+                except ValueError:
+                    torn = (line_no, start)
+                    continue
+                self.orders[int(order['id'])] = Order.from_dict(order)
+                replayed += 1
+            # A record whose newline was lost is complete, but the next append would run into it
+            unterminated = end > 0 and not line.endswith(b'\n')
+        if torn is not None:
+            logger.warning(f"Dropping torn final record at {path}:{torn[0]}")
+            with open(path, 'r+b') as f:
+                f.truncate(torn[1])
+                os.fsync(f.fileno())
+        elif unterminated:
+            with open(path, 'ab') as f:
+                f.write(b'\n')
+                os.fsync(f.fileno())
+        return replayed
+
+    def _rotate_log(self):
+        """Move the active log aside so new mutations go to a fresh file (caller pauses the log)"""
+        if not os.path.exists(self.log_path):
+            return
+        if os.path.exists(self.compacting_log_path):
+            # A previous compaction did not finish; keep its entries as well
+            with open(self.log_path, 'r', encoding='utf-8') as src, \
+                    open(self.compacting_log_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.compacting_log_path)
+
+    def snapshot(self):
+        """Atomically write a full snapshot of all orders and drop the log entries it covers"""
+        with self._snapshot_lock:
+            try:
+                with self._log.paused():
+                    self._rotate_log()
+                    # Shallow copies are enough since only top-level order fields change after creation;
+                    # an order mutated after this point is re-logged to the fresh log file
+                    snapshot = {order_id: order.copy() for order_id, order in list(self.orders.items())}
+                    base = self._base
+                    self._dirty = set()
+
+                archived = {}
+                if self.archive_after is not None:
+                    archived = self._archive_candidates(snapshot, base)
+                    # Archive first: until the new snapshot lands these orders are in both tiers,
+                    # and the snapshot copy wins
+                    self.archive.write_segment(list(archived.values()))
+
+                tmp_path = self.path + '.tmp'
+                entries = self._write_snapshot(tmp_path, snapshot, base, exclude=archived)
+                # The index is written against the temp file, whose size and mtime survive the rename
+                write_offset_index(self.index_path, entries, tmp_path)
+                os.replace(tmp_path, self.path)
+                if os.path.exists(self.compacting_log_path):
+                    os.remove(self.compacting_log_path)
+                if self.lazy:
+                    self._base = open_json_snapshot(self.path, self.index_path)
+                if archived:
+                    self._evict(archived)
+                logger.info(f"Orders saved to {self.path}")
+            except Exception as e:
+                logger.error(f"Error saving orders: {e}")
+
+    def _archive_candidates(self, loaded, base):
+        """Pick the finished orders that have been idle for longer than archive_after"""
+        return dict(self._iter_archive_candidates(loaded, base))
+
+    def _iter_archive_candidates(self, loaded, base):
+        cutoff = datetime.now() - timedelta(seconds=self.archive_after)
+        for order_id, order in loaded.items():
+            if is_archivable(order, cutoff):
+                yield order_id, order
+        if base is not None:
+            for order_id in base.index.ids():
+                if order_id not in loaded:
+                    order = Order.from_dict(json.loads(base.raw(order_id)))
+                    if is_archivable(order, cutoff):
+                        yield order_id, order
+
+    def _archive_due(self):
+        """Whether a compaction now would move any order to the archive"""
+        if self.archive_after is None:
+            return False
+        return any(True for _ in self._iter_archive_candidates(dict(self.orders), self._base))
+
+    def _evict(self, archived):
+        """Drop archived orders from the hot set unless they were saved again meanwhile"""
+        with self._evict_lock:
+            for order_id in archived:
+                if order_id not in self._dirty:
+                    self.orders.pop(order_id, None)
+
+    def _write_snapshot(self, path, loaded, base, exclude=()):
+        """Write orders in json.dump(..., indent=2) layout and return their (id, offset, length) entries
+
+        Orders never loaded from the previous snapshot are copied over byte for byte.
+        """
+        order_ids = set(loaded)
+        if base is not None:
+            order_ids.update(base.index.ids())
+        order_ids.difference_update(exclude)
+        entries = []
+        with open(path, 'wb') as f:
+            f.write(b'{')
+            position = 1
+            for n, order_id in enumerate(sorted(order_ids)):
+                prefix = f'{"," if n else ""}\n  "{order_id}": '.encode('ascii')
+                if order_id in loaded:
+                    value = json.dumps(loaded[order_id], indent=2, default=json_default).replace('\n', '\n  ').encode('ascii')
+                else:
+                    value = base.raw(order_id)
+                f.write(prefix)
+                position += len(prefix)
+                entries.append((order_id, position, len(value)))
+                f.write(value)
+                position += len(value)
+            f.write(b'\n}' if entries else b'}')
+            f.flush()
+            os.fsync(f.fileno())
+        return entries
+
+    def _log_size(self):
+        size = 0
+        for path in (self.compacting_log_path, self.log_path):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _run_compactor(self):
+        """Background loop that folds the mutation log into the snapshot"""
+        last_snapshot = time.monotonic()
+        while not self._compactor_stop.wait(SNAPSHOT_CHECK_INTERVAL):
+            log_size = self._log_size()
+            if log_size >= self.snapshot_log_threshold or time.monotonic() - last_snapshot >= self.snapshot_interval:
+                # With nothing logged and nothing to archive the snapshot is already current
+                if log_size or self._archive_due():
+                    self.snapshot()
+                last_snapshot = time.monotonic()
+
+    def start_compactor(self):
+        """Start the background snapshot compactor if it is not already running"""
+        if self._compactor_thread is not None and self._compactor_thread.is_alive():
+            return
+        self._compactor_stop.clear()
+        self._compactor_thread = threading.Thread(target=self._run_compactor, name='orders-compactor', daemon=True)
+        self._compactor_thread.start()
+        logger.info(f"Snapshot compactor started (interval {self.snapshot_interval}s, "
+                    f"log threshold {self.snapshot_log_threshold} bytes)")
+
+    def stop_compactor(self):
+        """Stop the background snapshot compactor"""
+        self._compactor_stop.set()
+        if self._compactor_thread is not None:
+            self._compactor_thread.join()
+
+    def close(self):
+        self.stop_compactor()
+        self._log.close()
+
+
+class SqliteDatabase:
+    """SQLite connection holder shared by the SQLite order and user stores
+
+    SQLite connections cannot be shared between threads or forked processes,
+    so each thread of each process gets its own connection to the same
+    WAL-journaled database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def connection(self):
+        if self._pid != os.getpid():
+            # Forked worker: never touch the connections inherited from the parent
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SqliteIdSequence:
+    """ID sequence kept in a row of the id_sequences table, shared by threads and worker processes"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db, name, last_id):
+        self.db = db
+        self.name = name
+        with self.db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            conn.execute('INSERT OR IGNORE INTO id_sequences (name, value) VALUES (?, ?)', (name, last_id))
+            conn.execute('UPDATE id_sequences SET value = MAX(value, ?) WHERE name = ?', (last_id, name))
+
+    def lease(self, count):
+        with self.db.connection() as conn:
+            return conn.execute('UPDATE id_sequences SET value = value + ? WHERE name = ? RETURNING value',
+                                (count, self.name)).fetchone()[0]
+
+
+class SqliteOrderStore(OrderStore):
+    """Order store backed by an indexed SQLite table"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY,
+            customer_email TEXT,
+            status TEXT,
+            payment_status TEXT,
+            created_at TEXT,
+            data TEXT NOT NULL,
+            customer_email_norm TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    # Rows within one index key are kept in rowid (= order ID) order, so find() needs no sort
+    INDEXES = """
+        DROP INDEX IF EXISTS idx_orders_customer_email;
+        CREATE INDEX IF NOT EXISTS idx_orders_customer_email_norm ON orders (customer_email_norm);
+        CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);
+        CREATE INDEX IF NOT EXISTS idx_orders_payment_status ON orders (payment_status);
+        CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);
+    """
+
+    def __init__(self, path, db=None):
+        super().__init__()
+        self.path = path
+        self.db = db or SqliteDatabase(path)
+        with self.db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            _add_normalized_email_column(conn, 'orders', 'customer_email', 'customer_email_norm')
+            if 'version' not in [row[1] for row in conn.execute('PRAGMA table_info(orders)')]:
+                conn.execute('ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            conn.executescript(self.INDEXES)
+        logger.info(f"SQLite order store opened at {path}")
+
+    def get(self, order_id):
+        row = self.db.connection().execute('SELECT data FROM orders WHERE id = ?', (order_id,)).fetchone()
+        return Order.from_dict(json.loads(row[0])) if row else None
+
+    def get_many(self, order_ids):
+        order_ids = list(order_ids)
+        found = {}
+        conn = self.db.connection()
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            rows = conn.execute(f"SELECT id, data FROM orders WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update((order_id, data) for order_id, data in rows)
+        return [Order.from_dict(json.loads(found[order_id])) if order_id in found else None
+                for order_id in order_ids]
+
+    @staticmethod
+    def _row(order):
+        return (
+            order.get('customer_email'),
+            order.get('status'),
+            order.get('payment_status'),
+            order.get('created_at'),
+            json.dumps(order, default=json_default),
+            normalize_email(order.get('customer_email')),
+            order.get('version', 0),
+            order['id']
+        )
+
+    def _write(self, order, sql):
+        with self.db.connection() as conn:
+            conn.execute(sql, self._row(order))
+
+    def add(self, order):
+        self._write(order, 'INSERT INTO orders '
+                           '(customer_email, status, payment_status, created_at, data, customer_email_norm, version, id) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+    def save(self, order):
+        self._write(order, 'INSERT OR REPLACE INTO orders '
+                           '(customer_email, status, payment_status, created_at, data, customer_email_norm, version, id) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+    def compare_and_save(self, order):
+        version = order.get('version', 0)
+        order['version'] = version + 1
+        with self.db.connection() as conn:
+            updated = conn.execute('UPDATE orders SET customer_email = ?, status = ?, payment_status = ?, '
+                                   'created_at = ?, data = ?, customer_email_norm = ?, version = ? '
+                                   'WHERE id = ? AND version = ?', self._row(order) + (version,)).rowcount
+        if not updated:
+            order['version'] = version
+        return updated == 1
+
+    def all(self):
+        rows = self.db.connection().execute('SELECT id, data FROM orders ORDER BY id')
+        return {order_id: json.loads(data) for order_id, data in rows}
+
+    @staticmethod
+    def _criteria(customer_email, status, payment_status):
+        """Map the given filters to indexed columns"""
+        criteria = {'customer_email_norm': customer_email, 'status': status, 'payment_status': payment_status}
+        if customer_email is not None:
+            criteria['customer_email_norm'] = normalize_email(customer_email)
+        return {column: value for column, value in criteria.items() if value is not None}
+
+    def find(self, customer_email=None, status=None, payment_status=None):
+        criteria = self._criteria(customer_email, status, payment_status)
+        if not criteria:
+            raise ValueError("At least one of customer_email, status or payment_status is required")
+        where = ' AND '.join(f'{column} = ?' for column in criteria)
+        rows = self.db.connection().execute(f'SELECT data FROM orders WHERE {where} ORDER BY id',
+                                            tuple(criteria.values()))
+        return [json.loads(data) for data, in rows]
+
+    def page(self, after_id, limit, customer_email=None, status=None, payment_status=None):
+        criteria = self._criteria(customer_email, status, payment_status)
+        where = ''.join(f' AND {column} = ?' for column in criteria)
+        rows = self.db.connection().execute(
+            f'SELECT id, data FROM orders WHERE id > ?{where} ORDER BY id LIMIT ?',
+            (after_id or 0, *criteria.values(), limit + 1)).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor
+
+    def ids(self):
+        return [row[0] for row in self.db.connection().execute('SELECT id FROM orders ORDER BY id')]
+
+    def max_id(self):
+        return self.db.connection().execute('SELECT COALESCE(MAX(id), 0) FROM orders').fetchone()[0]
+
+    def id_sequence(self, floor):
+        return SqliteIdSequence(self.db, 'orders', max(floor, self.max_id()))
+
+    def __len__(self):
+        return self.db.connection().execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+    def __contains__(self, order_id):
+        return self.db.connection().execute('SELECT 1 FROM orders WHERE id = ?', (order_id,)).fetchone() is not None
+
+    def close(self):
+        self.db.close()
+
+
+class UserStore:
+    """Interface shared by all user storage backends
+
+    Registration checks an email and adds the user under locked(email), so
+    the same email cannot be registered twice by concurrent requests. Stores
+    shared by several processes also raise DuplicateEmail from add().
+    """
+
+    def __init__(self):
+        self._stripes = StripedLocks()
+
+    def locked(self, email):
+        """Return the lock serializing registrations for the given email (a context manager)"""
+        return self._stripes.lock_for(normalize_email(email))
+
+    def id_sequence(self, floor):
+        """Return the sequence user IDs are leased from, continuing above floor and every stored ID"""
+        return IdSequence(max(floor, self.max_id()))
+
+    def id_allocator(self, floor):
+        """Return an allocator handing out user IDs above both floor and every stored ID"""
+        return BlockIdAllocator(self.id_sequence(floor))
+
+    def get(self, user_id):
+        """Return the user with the given ID, or None"""
+        raise NotImplementedError
+
+    def add(self, user):
+        """Store a newly registered user"""
+        raise NotImplementedError
+
+    def find_by_email(self, email, user_type=None):
+        """Return the first user with the given email (and type, if given), or None
+
+        Emails are compared case-insensitively, ignoring surrounding whitespace.
+        """
+        raise NotImplementedError
+
+    def max_id(self):
+        """Return the highest user ID in the store, or 0 when empty"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class MemoryUserStore(UserStore):
+    """Non-persistent user store backed by a dict, with an email index"""
+
+    def __init__(self):
+        super().__init__()
+        self.users = {}
+        # Normalized email -> ID of the first user, and (email, type) -> ID for typed lookups
+        self._by_email = {}
+        self._by_email_type = {}
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def add(self, user):
+        self.users[user['id']] = user
+        email = normalize_email(user.get('email'))
+        self._by_email.setdefault(email, user['id'])
+        self._by_email_type.setdefault((email, user.get('type')), user['id'])
+
+    def find_by_email(self, email, user_type=None):
+        email = normalize_email(email)
+        if user_type is None:
+            user_id = self._by_email.get(email)
+        else:
+            user_id = self._by_email_type.get((email, user_type))
+        return self.users.get(user_id) if user_id is not None else None
+
+    def max_id(self):
+        return max(self.users, default=0)
+
+    def __len__(self):
+        return len(self.users)
+
+
+class SqliteUserStore(UserStore):
+    """User store backed by an SQLite table"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            email TEXT,
+            type TEXT,
+            data TEXT NOT NULL,
+            email_norm TEXT
+        );
+    """
+
+    INDEXES = """
+        DROP INDEX IF EXISTS idx_users_email;
+        CREATE INDEX IF NOT EXISTS idx_users_email_norm ON users (email_norm, type, id);
+    """
+
+    # Holds across processes, where locked() only serializes registrations within one
+    MEMBER_EMAIL_INDEX = """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_member_email ON users (email_norm) WHERE type = 'member'
+    """
+
+    def __init__(self, path, db=None):
+        super().__init__()
+        self.path = path
+        self.db = db or SqliteDatabase(path)
+        with self.db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            _add_normalized_email_column(conn, 'users', 'email', 'email_norm')
+            conn.executescript(self.INDEXES)
+            try:
+                conn.execute(self.MEMBER_EMAIL_INDEX)
+            except sqlite3.IntegrityError:
+                logger.warning(f"{path} has several members with the same email; "
+                               f"registrations are only checked within each process until they are merged")
+
+    def get(self, user_id):
+        row = self.db.connection().execute('SELECT data FROM users WHERE id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, user):
+        try:
+            with self.db.connection() as conn:
+                conn.execute('INSERT INTO users (id, email, type, data, email_norm) VALUES (?, ?, ?, ?, ?)',
+                             (user['id'], user.get('email'), user.get('type'), json.dumps(user, default=str),
+                              normalize_email(user.get('email'))))
+        except sqlite3.IntegrityError as e:
+            if 'email_norm' not in str(e):
+                raise
+            raise DuplicateEmail(f"Email {user.get('email')} is already registered")
+
+    def find_by_email(self, email, user_type=None):
+        email = normalize_email(email)
+        if user_type is None:
+            row = self.db.connection().execute(
+                'SELECT data FROM users WHERE email_norm = ? ORDER BY id LIMIT 1', (email,)).fetchone()
+        else:
+            row = self.db.connection().execute(
+                'SELECT data FROM users WHERE email_norm = ? AND type = ? ORDER BY id LIMIT 1',
+                (email, user_type)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def max_id(self):
+        return self.db.connection().execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+
+    def id_sequence(self, floor):
+        return SqliteIdSequence(self.db, 'users', max(floor, self.max_id()))
+
+    def __len__(self):
+        return self.db.connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class IdempotencyKeyStore:
+    """Idempotency keys shared by the processes of a server (see idempotency.py)
+
+    Each (operation, key) holds the encoded request of the call made with it
+    and, once that call has succeeded, its encoded result. While the call runs,
+    the process running it holds the key for up to `hold` seconds.
+    """
+
+    def claim(self, operation, key, request, hold):
+        """Hold the key for running its call, unless it is already known
+
+        Returns None if the caller now holds the key, otherwise the stored
+        (request, result); result is None while another process runs the call.
+        """
+        raise NotImplementedError
+
+    def finish(self, operation, key, result, ttl):
+        """Store the result of the held key's call and keep it for ttl seconds"""
+        raise NotImplementedError
+
+    def release(self, operation, key):
+        """Give up a held key whose call failed, so a retry can run it again"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class MemoryIdempotencyKeyStore(IdempotencyKeyStore):
+    """Idempotency keys in a dict, for the state daemon to share between its clients"""
+
+    def __init__(self):
+        # (operation, key) -> [request, result, expires], and a heap of (expires, operation, key)
+        self._entries = {}
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, operation, key = heapq.heappop(self._expiry)
+            entry = self._entries.get((operation, key))
+            if entry is not None and entry[2] <= now:
+                del self._entries[(operation, key)]
+
+    def _schedule(self, operation, key, entry, expires):
+        entry[2] = expires
+        heapq.heappush(self._expiry, (expires, operation, key))
+
+    def claim(self, operation, key, request, hold):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get((operation, key))
+            if entry is not None:
+                return entry[0], entry[1]
+            entry = self._entries[(operation, key)] = [request, None, None]
+            self._schedule(operation, key, entry, now + hold)
+        return None
+
+    def finish(self, operation, key, result, ttl):
+        with self._lock:
+            entry = self._entries.get((operation, key))
+            if entry is not None:
+                entry[1] = result
+                self._schedule(operation, key, entry, time.time() + ttl)
+
+    def release(self, operation, key):
+        with self._lock:
+            entry = self._entries.get((operation, key))
+            if entry is not None and entry[1] is None:
+                del self._entries[(operation, key)]
+
+
+class SqliteIdempotencyKeyStore(IdempotencyKeyStore):
+    """Idempotency keys in an SQLite table, shared by all worker processes using the database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            operation TEXT NOT NULL,
+            key TEXT NOT NULL,
+            request TEXT NOT NULL,
+            result TEXT,
+            expires REAL NOT NULL,
+            PRIMARY KEY (operation, key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires);
+    """
+
+    def __init__(self, path, db=None):
+        self.path = path
+        self.db = db or SqliteDatabase(path)
+        with self.db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def claim(self, operation, key, request, hold):
+        now = time.time()
+        with self.db.connection() as conn:
+            conn.execute('DELETE FROM idempotency_keys WHERE expires <= ?', (now,))
+            if conn.execute('INSERT OR IGNORE INTO idempotency_keys (operation, key, request, expires) '
+                            'VALUES (?, ?, ?, ?)', (operation, key, request, now + hold)).rowcount:
+                return None
+            return conn.execute('SELECT request, result FROM idempotency_keys WHERE operation = ? AND key = ?',
+                                (operation, key)).fetchone()
+
+    def finish(self, operation, key, result, ttl):
+        with self.db.connection() as conn:
+            conn.execute('UPDATE idempotency_keys SET result = ?, expires = ? WHERE operation = ? AND key = ?',
+                         (result, time.time() + ttl, operation, key))
+
+    def release(self, operation, key):
+        with self.db.connection() as conn:
+            conn.execute('DELETE FROM idempotency_keys WHERE operation = ? AND key = ? AND result IS NULL',
+                         (operation, key))
+
+    def close(self):
+        self.db.close()
+
+
+def create_order_store(backend, path=None):
+    """Create an order store for the given backend ('memory', 'json', 'sqlite' or 'daemon')
+
+    For 'daemon', path is the state daemon's socket (STATE_SOCKET by default).
+    """
+    if backend == 'memory':
+        return MemoryOrderStore()
+    if backend == 'json':
+        store = JsonOrderStore(path)
+        store.start_compactor()
+        return store
+    if backend == 'sqlite':
+        return SqliteOrderStore(path)
+    if backend == 'daemon':
+        # Imported here because state_daemon builds on this module
+        from state_daemon import RemoteOrderStore
+        return RemoteOrderStore(path or STATE_SOCKET)
+    raise ValueError(f"Unknown store backend '{backend}'")
+
+
+def create_user_store(backend, path=None):
+    """Create a user store for the given backend ('memory', 'json', 'sqlite' or 'daemon')"""
+    if backend == 'sqlite':
+        return SqliteUserStore(path)
+    if backend == 'json':
+        logger.warning("The json backend does not persist users; keeping them in memory")
+        return MemoryUserStore()
+    if backend == 'memory':
+        return MemoryUserStore()
+    if backend == 'daemon':
+        from state_daemon import RemoteUserStore
+        return RemoteUserStore(path or STATE_SOCKET)
+    raise ValueError(f"Unknown store backend '{backend}'")
+
+
+def create_idempotency_key_store(backend, path=None):
+    """Create the idempotency key store shared by the server's processes, or None for backends
+    that only serve one process ('memory' and 'json'), where each process's own cache suffices"""
+    if backend == 'sqlite':
+        return SqliteIdempotencyKeyStore(path)
+    if backend == 'daemon':
+        from state_daemon import RemoteIdempotencyKeyStore
+        return RemoteIdempotencyKeyStore(path or STATE_SOCKET)
+    if backend in ('memory', 'json'):
+        return None
+    raise ValueError(f"Unknown store backend '{backend}'")
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Hash-partitioned order service for Eclipse Coffee Shop
+Orders are spread over N partitions, each a soap_server_complete.py process with
+its own SQLite database, behind a SOAP router that forwards every order_id call
+to the partition owning that ID on a consistent-hash ring. Users live in one
+database shared by all partitions.
+
+    python partition_router.py init --partitions 4     # write partitions.json
+    python partition_router.py serve                   # start partitions + router on :8000
+    python partition_router.py add-partition           # (services stopped) grow the ring and move orders
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import request_uri
+
+import requests
+from lxml import etree
+
+from order_store import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SqliteOrderStore
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(CURRENT_DIR, 'partitions.json')
+DEFAULT_VNODES = 64
+FIRST_PARTITION_PORT = 8101
+PARTITION_TIMEOUT = 30
+
+SOAP_ENV = 'http://schemas.xmlsoap.org/soap/envelope/'
+# Operations answered by every partition and merged by the router
+FAN_OUT_OPERATIONS = ('getAllOrders', 'getOrdersByCustomer', 'listOrdersByStatus')
+# Operations on a list of order_ids, split among the partitions owning them
+SPLIT_OPERATIONS = ('getOrderStatuses', 'cancelOrders')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring mapping order IDs to partition names, with virtual nodes per partition"""
+
+    def __init__(self, partitions, vnodes=DEFAULT_VNODES):
+        points = sorted((_hash(f'{name}#{n}'), name) for name in partitions for n in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def partition_for(self, order_id):
+        pos = bisect(self._hashes, _hash(order_id)) % len(self._hashes)
+        return self._names[pos]
+
+
+class PartitionConfig:
+    """Partition layout read from partitions.json; relative paths are relative to the file"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.vnodes = data.get('vnodes', DEFAULT_VNODES)
+        self.users_db = self._resolve(data['users_db'])
+        self.partitions = data['partitions']
+        self.ring = HashRing([p['name'] for p in self.partitions], self.vnodes)
+
+    def _resolve(self, path):
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), path)
+
+    def db_path(self, partition):
+        return self._resolve(partition['db'])
+
+    def url(self, partition):
+        return f"http://127.0.0.1:{partition['port']}/"
+
+    def by_name(self, name):
+        return next(p for p in self.partitions if p['name'] == name)
+
+
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return PartitionConfig(path, json.load(f))
+
+
+def _write_config(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _partition_entry(index):
+    return {'name': f'p{index}', 'port': FIRST_PARTITION_PORT + index, 'db': f'partitions/p{index}.db'}
+
+
+class PartitionIdAllocator:
+    """Wraps an ID allocator so a partition only hands out IDs that hash to itself
+
+    Partitions never share an ID this way, without talking to each other.
+    """
+
+    def __init__(self, allocator, config, partition):
+        self.allocator = allocator
+        self.ring = config.ring
+        self.partition = partition
+
+    def next(self):
+        while True:
+            order_id = self.allocator.next()
+            if self.ring.partition_for(order_id) == self.partition:
+                return order_id
+
+
+def _parse_call(body):
+    """Return the operation element of a SOAP request"""
+    root = etree.fromstring(body)
+    soap_body = root.find(f'{{{SOAP_ENV}}}Body')
+    if soap_body is None or len(soap_body) == 0:
+        raise ValueError("No SOAP Body in request")
+    return soap_body[0]
+
+
+def _arg(operation, name):
+    element = operation.find(f'{{*}}{name}')
+    if element is None or element.text is None or not element.text.strip():
+        return None
+    return element.text.strip()
+
+
+class PartitionRouter:
+    """WSGI app routing SOAP calls to order partitions
+
+    Calls carrying an order_id go to the partition that owns it, batch calls
+    on order_ids are split among the owners, and keyed createOrder(s) calls go
+    to the partition owning the (first) idempotency key; listing operations go
+    to every partition and their results are merged; all other
+    calls (createOrder, registration, login, WSDL) are spread round-robin.
+    Calls to the typed v2 service under /v2 are routed the same way. Only
+    SOAP calls are routed; JSON calls are refused.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.urls = {p['name']: config.url(p) for p in config.partitions}
+        self._names = list(self.urls)
+        self._round_robin = itertools.count()
+        self._local = threading.local()
+        self._fan_out = ThreadPoolExecutor(max_workers=4 * len(self._names), thread_name_prefix='fan-out')
+
+    def _session(self):
+        # One keep-alive connection pool per router thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next_partition(self):
+        return self._names[next(self._round_robin) % len(self._names)]
+
+    def _forward(self, name, environ, body):
+        headers = {'Host': environ.get('HTTP_HOST', '')}
+        for key, header in (('CONTENT_TYPE', 'Content-Type'), ('HTTP_SOAPACTION', 'SOAPAction')):
+            if environ.get(key):
+                headers[header] = environ[key]
+        # The typed v2 service lives under /v2 on every partition too
+        url = self.urls[name] + environ.get('PATH_INFO', '').lstrip('/')
+        if environ.get('QUERY_STRING'):
+            url += '?' + environ['QUERY_STRING']
+        return self._session().request(environ['REQUEST_METHOD'], url, data=body, headers=headers,
+                                       timeout=PARTITION_TIMEOUT)
+
+    def __call__(self, environ, start_response):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length) if length else b''
+            if environ['REQUEST_METHOD'] != 'POST':
+                response = self._forward(self._next_partition(), environ, body)
+                content = response.content
+                if response.status_code == 200 and 'wsdl' in environ.get('QUERY_STRING', '').lower():
+                    content = self._point_wsdl_here(content, environ)
+                return self._respond(start_response, response.status_code, response.headers, content)
+
+            if 'xml' not in environ.get('CONTENT_TYPE', ''):
+                return self._respond(start_response, 415, {'Content-Type': 'text/plain'},
+                                     b"The partition router only routes SOAP calls")
+            operation = _parse_call(body)
+            name = etree.QName(operation).localname
+            order_id = _arg(operation, 'order_id')
+            idempotency_key = _arg(operation, 'idempotency_key')
+            first_order = operation.find('{*}orders/{*}OrderRequest')
+            if name == 'createOrders' and first_order is not None:
+                # A retried batch goes where its first key does, so its keys are remembered there
+                idempotency_key = _arg(first_order, 'idempotency_key')
+            if order_id is not None:
+                target = self.config.ring.partition_for(int(order_id))
+                response = self._forward(target, environ, body)
+            elif idempotency_key is not None:
+                # Retries must reach the partition that remembers the key
+                response = self._forward(self.config.ring.partition_for(idempotency_key), environ, body)
+            elif name in FAN_OUT_OPERATIONS:
+                return self._fan_out_call(start_response, environ, body, operation, name)
+            elif name in SPLIT_OPERATIONS and operation.find('{*}order_ids/*') is not None:
+                return self._split_call(start_response, environ, body, operation, name)
+            else:
+                response = self._forward(self._next_partition(), environ, body)
+            return self._respond(start_response, response.status_code, response.headers, response.content)
+        except Exception as e:
+            logger.error(f"Router error: {str(e)}")
+            return self._respond(start_response, 502, {'Content-Type': 'text/plain'}, f"Router error: {e}".encode())
+
+    def _point_wsdl_here(self, content, environ):
+        # Partitions cache the WSDL with their own address in it; clients must call the router
+        wsdl = etree.fromstring(content)
+        for address in wsdl.iterfind('.//{*}service/{*}port/{*}address'):
+            address.set('location', request_uri(environ, include_query=False))
+        return etree.tostring(wsdl, xml_declaration=True, encoding='UTF-8')
+
+    def _respond(self, start_response, status, headers, content):
+        reason = requests.status_codes._codes.get(status, ('',))[0].replace('_', ' ').upper()
+        start_response(f'{status} {reason}', [
+            ('Content-Type', headers.get('Content-Type', 'text/xml; charset=utf-8')),
+            ('Content-Length', str(len(content)))
+        ])
+        return [content]
+
+    def _fan_out_call(self, start_response, environ, body, operation, name):
+        responses = list(self._fan_out.map(lambda partition: self._forward(partition, environ, body), self._names))
+        for response in responses:
+            if response.status_code != 200:
+                return self._respond(start_response, response.status_code, response.headers, response.content)
+        if len(etree.fromstring(responses[0].content).find(f'.//{{*}}{name}Result')):
+            # A typed v2 OrderList rather than JSON text
+            return self._merge_typed(start_response, responses, operation, name)
+
+        results = []
+        for response in responses:
+            result = etree.fromstring(response.content).find(f'.//{{*}}{name}Result')
+            try:
+                results.append(json.loads(result.text))
+            except (TypeError, ValueError):
+                # Errors come back as plain strings; pass the first one through
+                return self._respond(start_response, 200, response.headers, response.content)
+
+        merged = self._merge(name, operation, results)
+        # Reuse the first partition's envelope for the merged result
+        envelope = etree.fromstring(responses[0].content)
+        envelope.find(f'.//{{*}}{name}Result').text = json.dumps(merged)
+        content = etree.tostring(envelope, xml_declaration=True, encoding='UTF-8')
+        return self._respond(start_response, 200, responses[0].headers, content)
+
+    def _split_call(self, start_response, environ, body, operation, name):
+        owners = [self.config.ring.partition_for(int(item.text)) for item in operation.find('{*}order_ids')]
+        partitions = sorted(set(owners))
+
+        def forward(partition):
+            # Each partition is sent only the order IDs it owns
+            envelope = etree.fromstring(body)
+            order_ids = envelope.find(f'.//{{*}}{name}/{{*}}order_ids')
+            for item, owner in zip(list(order_ids), owners):
+                if owner != partition:
+                    order_ids.remove(item)
+            return self._forward(partition, environ, etree.tostring(envelope, xml_declaration=True, encoding='UTF-8'))
+
+        responses = dict(zip(partitions, self._fan_out.map(forward, partitions)))
+        results = {}
+        for partition, response in responses.items():
+            if response.status_code != 200:
+                return self._respond(start_response, response.status_code, response.headers, response.content)
+            results[partition] = iter(etree.fromstring(response.content).find(f'.//{{*}}{name}Result'))
+
+        # Put the answers back in request order, in the first partition's envelope
+        first = responses[partitions[0]]
+        envelope = etree.fromstring(first.content)
+        merged = envelope.find(f'.//{{*}}{name}Result')
+        for child in list(merged):
+            merged.remove(child)
+        for owner in owners:
+            merged.append(next(results[owner]))
+        content = etree.tostring(envelope, xml_declaration=True, encoding='UTF-8')
+        return self._respond(start_response, 200, first.headers, content)
+
+    def _merge_typed(self, start_response, responses, operation, name):
+        """Merge the v2 OrderLists of every partition by order ID, keeping one page for getAllOrders"""
+        envelopes = [etree.fromstring(response.content) for response in responses]
+        results = [envelope.find(f'.//{{*}}{name}Result') for envelope in envelopes]
+        for response, result in zip(responses, results):
+            if _arg(result, 'error_code') is not None:
+                return self._respond(start_response, 200, response.headers, response.content)
+
+        orders = sorted((order for result in results for order in result.iterfind('{*}orders')),
+                        key=lambda order: int(_arg(order, 'order_id')))
+        next_cursor = None
+        if name == 'getAllOrders':
+            limit = min(max(int(_arg(operation, 'limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+            more = len(orders) > limit or any(_arg(result, 'next_cursor') is not None for result in results)
+            orders = orders[:limit]
+            next_cursor = _arg(orders[-1], 'order_id') if more and orders else None
+
+        # orders, order_count and next_cursor end the OrderList; rebuild them in the first envelope
+        merged = results[0]
+        for child in list(merged):
+            if etree.QName(child).localname in ('orders', 'order_count', 'next_cursor'):
+                merged.remove(child)
+        namespace = etree.QName(merged).namespace
+        merged.extend(orders)
+        etree.SubElement(merged, f'{{{namespace}}}order_count').text = str(len(orders))
+        if next_cursor is not None:
+            etree.SubElement(merged, f'{{{namespace}}}next_cursor').text = next_cursor
+        content = etree.tostring(envelopes[0], xml_declaration=True, encoding='UTF-8')
+        return self._respond(start_response, 200, responses[0].headers, content)
+
+    def _merge(self, name, operation, results):
+        if name != 'getAllOrders':
+            merged = dict(results[0])
+            merged['orders'] = sorted((order for r in results for order in r['orders']), key=lambda o: o['id'])
+            merged['order_count'] = len(merged['orders'])
+            return merged
+
+        orders = sorted((order for r in results for order in r['orders'].values()), key=lambda o: o['id'])
+        paged = any(_arg(operation, arg) is not None
+                    for arg in ('limit', 'after_id', 'status', 'payment_status', 'customer_email'))
+        next_cursor = None
+        if paged:
+            limit = min(max(int(_arg(operation, 'limit') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+            more = len(orders) > limit or any(r.get('next_cursor') is not None for r in results)
+            orders = orders[:limit]
+            next_cursor = orders[-1]['id'] if more and orders else None
+        merged = {
+            'orders': {order['id']: order for order in orders},
+            'order_count': len(orders),
+            'order_ids': [order['id'] for order in orders]
+        }
+        if paged:
+            merged['next_cursor'] = next_cursor
+        return merged
+
+
+def init(args):
+    """Write a partition layout with N partitions"""
+    if os.path.exists(args.config) and not args.force:
+        sys.exit(f"{args.config} already exists (use --force to overwrite)")
+    data = {
+        'vnodes': DEFAULT_VNODES,
+        'users_db': 'partitions/users.db',
+        'partitions': [_partition_entry(n) for n in range(args.partitions)]
+    }
+    _write_config(args.config, data)
+    logger.info(f"Wrote {args.config} with {args.partitions} partitions")
+
+
+def rebalance(args):
+    """Move every order to the partition that owns it on the current ring (services must be stopped)"""
+    config = load_config(args.config)
+    stores = {}
+    for partition in config.partitions:
+        os.makedirs(os.path.dirname(config.db_path(partition)), exist_ok=True)
+        stores[partition['name']] = SqliteOrderStore(config.db_path(partition))
+    moved = 0
+    for name, store in stores.items():
+        misplaced = [order_id for order_id in store.ids() if config.ring.partition_for(order_id) != name]
+        for order_id in misplaced:
+            # Copy before delete, so an interrupted run loses nothing and can simply be repeated
+            stores[config.ring.partition_for(order_id)].save(store.get(order_id))
+            with store.db.connection() as conn:
+                conn.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+        if misplaced:
+            logger.info(f"Moved {len(misplaced)} orders out of partition {name}")
+        moved += len(misplaced)
+    for store in stores.values():
+        store.close()
+    logger.info(f"Rebalance complete: {moved} orders moved across {len(stores)} partitions")
+
+
+def add_partition(args):
+    """Add partitions to the ring, then rebalance (services must be stopped)"""
+    with open(args.config, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    start = max((int(p['name'][1:]) for p in data['partitions']), default=-1) + 1
+    for n in range(start, start + args.count):
+        data['partitions'].append(_partition_entry(n))
+    _write_config(args.config, data)
+    logger.info(f"Added {args.count} partition(s); ring now has {len(data['partitions'])}")
+    rebalance(args)
+
+
+def serve(args):
+    """Start every partition and the router in front of them"""
+    from wsgi_server import serve as serve_wsgi
+
+    config = load_config(args.config)
+    os.makedirs(os.path.dirname(config.users_db), exist_ok=True)
+    children = []
+    for partition in config.partitions:
+        os.makedirs(os.path.dirname(config.db_path(partition)), exist_ok=True)
+        env = dict(os.environ,
+                   COFFEESHOP_STORE='sqlite',
+                   COFFEESHOP_STORE_PATH=config.db_path(partition),
+                   COFFEESHOP_USER_STORE_PATH=config.users_db,
+                   COFFEESHOP_PARTITION=partition['name'],
+                   COFFEESHOP_PARTITION_CONFIG=os.path.abspath(args.config))
+        children.append(subprocess.Popen(
+            [sys.executable, os.path.join(CURRENT_DIR, 'soap_server_complete.py'),
+             '--host', '127.0.0.1', '--port', str(partition['port']), '--threads', str(args.threads)],
+            env=env))
+        logger.info(f"Started partition {partition['name']} on port {partition['port']}")
+
+    try:
+        _wait_for_partitions(config)
+        serve_wsgi(PartitionRouter(config), args.host, args.port, threads=args.threads)
+    finally:
+        for child in children:
+            child.send_signal(signal.SIGTERM)
+        for child in children:
+            child.wait()
+        logger.info("All partitions stopped")
+
+
+def _wait_for_partitions(config, timeout=30):
+    deadline = time.monotonic() + timeout
+    for partition in config.partitions:
+        while True:
+            try:
+                requests.get(config.url(partition) + '?wsdl', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Partition {partition['name']} did not start")
+                time.sleep(0.2)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Eclipse Coffee Shop partitioned order service')
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help='partition layout file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = subparsers.add_parser('init', help=init.__doc__)
+    init_parser.add_argument('--partitions', type=int, default=4)
+    init_parser.add_argument('--force', action='store_true')
+    init_parser.set_defaults(func=init)
+
+    serve_parser = subparsers.add_parser('serve', help=serve.__doc__)
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--threads', type=int, default=16, help='request threads per process')
+    serve_parser.set_defaults(func=serve)
+
+    add_parser = subparsers.add_parser('add-partition', help=add_partition.__doc__)
+    add_parser.add_argument('--count', type=int, default=1)
+    add_parser.set_defaults(func=add_partition)
+
+    rebalance_parser = subparsers.add_parser('rebalance', help=rebalance.__doc__)
+    rebalance_parser.set_defaults(func=rebalance)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
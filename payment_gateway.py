@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Payment gateway for Eclipse Coffee Shop
+Card and TNG payments are charged through the gateway before an order is
+confirmed. Until a real provider is wired in, SimulatedPaymentGateway approves
+every charge after PAYMENT_GATEWAY_LATENCY_MS milliseconds (default 0), which
+is enough to load-test servers against a slow provider.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_GATEWAY_LATENCY = float(os.environ.get('PAYMENT_GATEWAY_LATENCY_MS', '0')) / 1000
+
+
+class PaymentDeclined(Exception):
+    """The gateway refused a charge; nothing was taken from the customer"""
+
+
+class SimulatedPaymentGateway:
+    """Approves every charge after a fixed delay
+
+    charge() blocks the calling thread for the delay; charge_async() only
+    suspends the calling coroutine, for the asyncio server.
+    """
+
+    def __init__(self, latency=PAYMENT_GATEWAY_LATENCY):
+        self.latency = latency
+
+    def _transaction(self, kind, order_id, amount, payment_method):
+        transaction_id = f'{kind}-{uuid.uuid4().hex[:12]}'
+        logger.debug(f"Gateway {kind} {transaction_id}: order {order_id}, ${amount:.2f} by {payment_method}")
+        return transaction_id
+
+    def charge(self, order_id, amount, payment_method):
+        """Charge the customer and return the gateway's transaction ID; raises PaymentDeclined if refused"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self._transaction('charge', order_id, amount, payment_method)
+
+    async def charge_async(self, order_id, amount, payment_method):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._transaction('charge', order_id, amount, payment_method)
+
+
+payment_gateway = SimulatedPaymentGateway()
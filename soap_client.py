@@ -4,48 +4,313 @@ SOAP Client for Eclipse Coffee Shop Service
 This client demonstrates how to interact with the SOAP service
 """
 
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlparse
 from zeep import Client
+from zeep.cache import SqliteCache
+from zeep.exceptions import Fault, TransportError
+from zeep.helpers import serialize_object
 from zeep.transports import Transport
-from requests import Session
+from requests import ConnectionError, Session, Timeout
+from requests.adapters import HTTPAdapter
 import json
 import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Keyed calls are retried this many times after connection errors, timeouts and HTTP errors
+RETRIES = 3
+# First retry delay in seconds, doubling (with jitter) for every further retry
+RETRY_BACKOFF = 0.2
+
+# Clients are built from the WSDL bundled with the code (regenerate it with
+# `python soap_server_complete.py --dump-wsdl service.wsdl`), so they start without the server
+WSDL_PATH = os.environ.get('COFFEESHOP_WSDL',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service.wsdl'))
+SOAP_ENDPOINT = os.environ.get('COFFEESHOP_SOAP_URL', 'http://localhost:8000/')
+SOAP_BINDING = '{urn:coffeeshop.soap}Application'
+# The typed v2 service (`--dump-wsdl-v2 service_v2.wsdl`), served under /v2
+WSDL_V2_PATH = os.environ.get('COFFEESHOP_WSDL_V2',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service_v2.wsdl'))
+SOAP_ENDPOINT_V2 = os.environ.get('COFFEESHOP_SOAP_V2_URL', urljoin(SOAP_ENDPOINT, 'v2'))
+SOAP_BINDING_V2 = '{urn:coffeeshop.soap.v2}Application'
+# 'json' sends the same calls to the JSON mount under the endpoint (json/), skipping
+# SOAP envelopes and schema validation; meant for internal callers
+PROTOCOLS = ('soap', 'json')
+PROTOCOL = os.environ.get('COFFEESHOP_SOAP_PROTOCOL', 'soap')
+JSON_PATH = 'json'
+# WSDLs and schemas fetched over HTTP are kept here between process starts
+WSDL_CACHE_PATH = os.environ.get('COFFEESHOP_WSDL_CACHE',
+                                 os.path.join(tempfile.gettempdir(), 'coffeeshop-wsdl-cache.db'))
+WSDL_CACHE_TTL = 24 * 3600
+
+# Orders sent per createOrders/getOrderStatuses/cancelOrders call (the server takes up to 1000)
+BATCH_SIZE = 100
+
+# Connections kept open to the server; threads beyond this wait for a free connection
+# instead of opening throwaway ones
+POOL_SIZE = int(os.environ.get('COFFEESHOP_SOAP_POOL_SIZE', '20'))
+CONNECT_TIMEOUT = float(os.environ.get('COFFEESHOP_SOAP_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('COFFEESHOP_SOAP_READ_TIMEOUT', '10'))
+# Seconds to wait for the answer, by operation: lookups should fail fast, payments may wait on the gateway
+OPERATION_TIMEOUTS = {
+    'getOrderStatus': 3.0,
+    'loginMember': 5.0,
+    'processPayment': 30.0,
+    'processRefund': 30.0,
+    'getAllOrders': 30.0,
+}
+
+
+class PooledTransport(Transport):
+    """zeep transport with a bounded keep-alive connection pool and per-operation timeouts
+
+    The operation is taken from the SOAPAction header, so one transport can be
+    shared by all threads. Timed-out calls are counted by operation.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 operation_timeouts=None, keep_alive=True, cache=None):
+        session = Session()
+        self.adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.operation_timeouts = dict(OPERATION_TIMEOUTS, **(operation_timeouts or {}))
+        self.timeouts = Counter()
+        self._lock = threading.Lock()
+        super().__init__(cache=cache, timeout=(connect_timeout, read_timeout), session=session)
+
+    def post(self, address, message, headers):
+        return self.post_operation(headers.get('SOAPAction', '').strip('"'), address, message, headers)
+
+    def post_operation(self, operation, address, message, headers):
+        """POST a call of operation, waiting no longer than its read timeout
+
+        A timeout set through zeep (operation_timeout, e.g. with
+        transport.settings(timeout=...)) takes precedence.
+        """
+        timeout = self.operation_timeout or (self.connect_timeout,
+                                             self.operation_timeouts.get(operation, self.read_timeout))
+        logger.debug(f"HTTP Post to {address}:\n{message}")
+        try:
+            return self.session.post(address, data=message, headers=headers, timeout=timeout)
+        except Timeout:
+            with self._lock:
+                self.timeouts[operation] += 1
+            raise
+
+    def pool_stats(self):
+        """Connections opened, requests sent and idle connections per server, and timeouts by operation"""
+        pools = {}
+        manager = self.adapter.poolmanager
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            idle = list(pool.pool.queue) if pool.pool is not None else []
+            pools[f'{key.key_scheme}://{key.key_host}:{key.key_port}'] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': sum(conn is not None for conn in idle)
+            }
+        with self._lock:
+            timeouts = dict(self.timeouts)
+        return {'pool_size': self.pool_size, 'pools': pools, 'timeouts': timeouts}
+
+class JsonService:
+    """Stands in for a zeep service, sending its operations to the server's JSON mount
+    
+    Arguments are sent positionally as {"operation": [arguments]}. Answers are
+    rebuilt with the WSDL's result types, so callers get what SOAP would return.
+    """
+    
+    def __init__(self, transport, binding, address):
+        self.transport = transport
+        self.binding = binding
+        self.address = address
+    
+    def __getattr__(self, operation):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+        result = self.binding.get(operation).output.body.type.elements[0][1]
+        return lambda *args: self._call(operation, result, args)
+    
+    def _call(self, operation, result, args):
+        message = json.dumps({operation: [_json_argument(arg) for arg in args]})
+        response = self.transport.post_operation(operation, self.address, message,
+                                                 {'Content-Type': 'application/json; charset=utf-8'})
+        try:
+            answer = response.json()
+        except ValueError:
+            answer = None
+        if response.status_code != 200:
+            if isinstance(answer, dict) and 'faultstring' in answer:
+                raise Fault(answer['faultstring'], code=answer.get('faultcode'))
+            raise TransportError(f"Server returned HTTP status {response.status_code}",
+                                 status_code=response.status_code, content=response.content)
+        return _from_json(result, answer)
+
 class CoffeeShopSOAPClient:
-    """SOAP client for Eclipse Coffee Shop service"""
+    """SOAP client for Eclipse Coffee Shop service
+    
+    createOrder and processPayment carry an idempotency key, so they are safely
+    retried and, with hedge_after set, a duplicate is sent when an attempt has
+    not answered after hedge_after seconds; the first answer wins.
+    
+    By default the client is built from the bundled service.wsdl and calls
+    endpoint (COFFEESHOP_SOAP_URL). A wsdl_url on a server is fetched once and
+    cached on disk, and calls go to the address it names unless endpoint is
+    given. With lazy=True the WSDL is only loaded on the first call.
+    
+    protocol (COFFEESHOP_SOAP_PROTOCOL) 'json' makes the same calls on the
+    JSON mount under the endpoint instead, which costs both sides less CPU.
+    Answers are the same; the WSDL still describes the operations.
     
-    def __init__(self, wsdl_url="http://localhost:8000/?wsdl"):
+    One client is meant to be shared by all threads. It keeps up to pool_size
+    connections alive; operation_timeouts maps operation names to read
+    timeouts, overriding OPERATION_TIMEOUTS.
+    """
+    
+    # Bundled WSDL, default endpoint and binding of the service spoken
+    WSDL = WSDL_PATH
+    ENDPOINT = SOAP_ENDPOINT
+    BINDING = SOAP_BINDING
+    
+    def __init__(self, wsdl_url=None, retries=RETRIES, retry_backoff=RETRY_BACKOFF, hedge_after=None,
+                 endpoint=None, lazy=False, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, operation_timeouts=None, keep_alive=True, batch_size=BATCH_SIZE,
+                 protocol=PROTOCOL):
         """Initialize SOAP client"""
-        try:
-            # Create session with timeout
-            session = Session()
-            session.timeout = 10
-            
-            # Create transport
-            transport = Transport(session=session)
-            
-            # Create client
-            self.client = Client(wsdl_url, transport=transport)
-            logger.info(f"SOAP client initialized with WSDL: {wsdl_url}")
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize SOAP client: {str(e)}")
-            raise
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol '{protocol}', expected one of {', '.join(PROTOCOLS)}")
+        self.protocol = protocol
+        self.wsdl_url = wsdl_url or self.WSDL
+        self.endpoint = endpoint or (None if wsdl_url else self.ENDPOINT)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_after = hedge_after
+        self._hedge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='soap-hedge') if hedge_after else None
+        self._transport_options = dict(pool_size=pool_size, connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout, operation_timeouts=operation_timeouts,
+                                       keep_alive=keep_alive)
+        self.transport = None
+        self._client = None
+        self._service = None
+        self._connect_lock = threading.Lock()
+        if not lazy:
+            self._connect()
+    
+    def _connect(self):
+        """Load the WSDL and bind the service, once"""
+        with self._connect_lock:
+            if self._service is not None:
+                return
+            try:
+                # Create transport; only WSDLs fetched over HTTP need the disk cache
+                remote = urlparse(self.wsdl_url).scheme in ('http', 'https')
+                cache = SqliteCache(path=WSDL_CACHE_PATH, timeout=WSDL_CACHE_TTL) if remote else None
+                transport = PooledTransport(cache=cache, **self._transport_options)
+                
+                # Create client
+                client = Client(self.wsdl_url, transport=transport)
+                if self.protocol == 'json':
+                    # The JSON mount sits under the SOAP endpoint, e.g. http://localhost:8000/v2/json
+                    endpoint = self.endpoint or client.service._binding_options['address']
+                    service = JsonService(transport, client.wsdl.bindings[self.BINDING],
+                                          urljoin(endpoint.rstrip('/') + '/', JSON_PATH))
+                else:
+                    service = client.create_service(self.BINDING, self.endpoint) if self.endpoint else client.service
+                logger.info(f"SOAP client initialized with WSDL: {self.wsdl_url} ({self.protocol})")
+                
+            except Exception as e:
+                logger.error(f"Failed to initialize SOAP client: {str(e)}")
+                raise
+            self.transport = transport
+            self._client = client
+            self._service = service
+    
+    @property
+    def client(self):
+        """The zeep client, created on first use if the client is lazy"""
+        if self._client is None:
+            self._connect()
+        return self._client
+    
+    @property
+    def service(self):
+        """The bound service whose methods are the SOAP operations"""
+        if self._service is None:
+            self._connect()
+        return self._service
+    
+    def pool_stats(self):
+        """Connection pool usage and timeouts (see PooledTransport.pool_stats), empty before the first call"""
+        if self.transport is None:
+            return {}
+        return self.transport.pool_stats()
+    
+    def _call_idempotent(self, operation, *args):
+        """Call an operation whose requests carry idempotency keys, retrying and hedging as configured"""
+        method = getattr(self.service, operation)
+        for attempt in range(self.retries + 1):
+            try:
+                if self.hedge_after is None:
+                    return method(*args)
+                return self._hedged(method, args)
+            except (ConnectionError, Timeout, TransportError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning(f"SOAP {operation} attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+                time.sleep(delay)
     
-    def create_order(self, customer_name, customer_email, cart_items):
-        """Create a new order via SOAP"""
+    def _hedged(self, method, args):
+        """Return the first successful answer of the call, sending a second copy if the first is slow"""
+        pending = {self._hedge_pool.submit(method, *args)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+        if not done:
+            logger.debug(f"No answer after {self.hedge_after}s; sending a hedged request")
+            pending.add(self._hedge_pool.submit(method, *args))
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                # Every attempt failed; raise the last error
+                return future.result()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    
+    def create_order(self, customer_name, customer_email, cart_items, idempotency_key=None):
+        """Create a new order via SOAP
+        
+        Retries reuse idempotency_key (a fresh one by default), so at most one order is created.
+        """
         try:
             # Convert cart items to JSON string
             cart_json = json.dumps(cart_items)
             
             # Call SOAP service
-            result = self.client.service.createOrder(
+            result = self._call_idempotent(
+                'createOrder',
                 customer_name, 
                 customer_email, 
-                cart_json
+                cart_json,
+                idempotency_key or uuid.uuid4().hex
             )
             
             logger.debug(f"SOAP createOrder result: {result}")
@@ -55,14 +320,46 @@ class CoffeeShopSOAPClient:
             logger.error(f"SOAP createOrder error: {str(e)}")
             return f"Error creating order: {str(e)}"
     
-    def process_payment(self, order_id, amount, payment_method):
-        """Process payment via SOAP"""
+    def create_orders(self, orders):
+        """Create several orders via SOAP, batch_size per call; returns create_order's answer for each
+        
+        orders are dicts with customer_name, customer_email, cart_items and optionally idempotency_key.
+        """
+        try:
+            requests = [{
+                'customer_name': order['customer_name'],
+                'customer_email': order['customer_email'],
+                'cart_items': json.dumps(order['cart_items']),
+                'idempotency_key': order.get('idempotency_key') or uuid.uuid4().hex
+            } for order in orders]
+            
+            results = []
+            for batch in _batches(requests, self.batch_size):
+                results += self._call_idempotent('createOrders', {'OrderRequest': batch}) or []
+            
+            logger.debug(f"SOAP createOrders created {len(results)} orders")
+            return results
+            
+        except Exception as e:
+            logger.error(f"SOAP createOrders error: {str(e)}")
+            return f"Error creating orders: {str(e)}"
+    
+    def process_payment(self, order_id, amount, payment_method, idempotency_key=None, expected_version=None):
+        """Process payment via SOAP
+        
+        Retries reuse idempotency_key (a fresh one by default), so the order is charged at most once.
+        With expected_version (the 'version' from get_order_status) the payment is refused with a
+        "Conflict" error if the order has changed since it was read.
+        """
         try:
             # Call SOAP service
-            result = self.client.service.processPayment(
+            result = self._call_idempotent(
+                'processPayment',
                 order_id, 
                 amount, 
-                payment_method
+                payment_method,
+                idempotency_key or uuid.uuid4().hex,
+                expected_version
             )
             
             logger.debug(f"SOAP processPayment result: {result}")
@@ -72,14 +369,15 @@ class CoffeeShopSOAPClient:
             logger.error(f"SOAP processPayment error: {str(e)}")
             return f"Error processing payment: {str(e)}"
     
-    def process_refund(self, order_id, reason, refund_amount=None):
+    def process_refund(self, order_id, reason, refund_amount=None, expected_version=None):
         """Process refund via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.processRefund(
+            result = self.service.processRefund(
                 order_id, 
                 reason, 
-                refund_amount
+                refund_amount,
+                expected_version
             )
             
             logger.debug(f"SOAP processRefund result: {result}")
@@ -93,7 +391,7 @@ class CoffeeShopSOAPClient:
         """Get order status via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.getOrderStatus(order_id)
+            result = self.service.getOrderStatus(order_id)
             
             logger.debug(f"SOAP getOrderStatus result: {result}")
             
@@ -108,11 +406,48 @@ class CoffeeShopSOAPClient:
             logger.error(f"SOAP getOrderStatus error: {str(e)}")
             return f"Error getting order status: {str(e)}"
     
-    def cancel_order(self, order_id):
+    def get_order_statuses(self, order_ids):
+        """Get the status of several orders via SOAP, batch_size per call
+        
+        Returns {order_id: answer}, each answer being what get_order_status returns for that order.
+        """
+        try:
+            order_ids = list(order_ids)
+            results = []
+            for batch in _batches(order_ids, self.batch_size):
+                results += self.service.getOrderStatuses({'integer': batch}) or []
+            
+            statuses = {}
+            for order_id, result in zip(order_ids, results):
+                try:
+                    statuses[order_id] = json.loads(result)
+                except json.JSONDecodeError:
+                    # Errors are plain strings
+                    statuses[order_id] = result
+            return statuses
+            
+        except Exception as e:
+            logger.error(f"SOAP getOrderStatuses error: {str(e)}")
+            return f"Error getting order statuses: {str(e)}"
+    
+    def cancel_orders(self, order_ids):
+        """Cancel several orders via SOAP, batch_size per call; returns {order_id: cancel_order's answer}"""
+        try:
+            order_ids = list(order_ids)
+            results = []
+            for batch in _batches(order_ids, self.batch_size):
+                results += self.service.cancelOrders({'integer': batch}) or []
+            return dict(zip(order_ids, results))
+            
+        except Exception as e:
+            logger.error(f"SOAP cancelOrders error: {str(e)}")
+            return f"Error cancelling orders: {str(e)}"
+    
+    def cancel_order(self, order_id, expected_version=None):
         """Cancel order via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.cancelOrder(order_id)
+            result = self.service.cancelOrder(order_id, expected_version)
             
             logger.debug(f"SOAP cancelOrder result: {result}")
             return result
@@ -125,7 +460,7 @@ class CoffeeShopSOAPClient:
         """Register guest via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.registerGuest(name, email, phone, notes)
+            result = self.service.registerGuest(name, email, phone, notes)
             
             logger.debug(f"SOAP registerGuest result: {result}")
             
@@ -144,7 +479,7 @@ class CoffeeShopSOAPClient:
         """Register member via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.registerMember(
+            result = self.service.registerMember(
                 first_name, 
                 last_name, 
                 email, 
@@ -169,7 +504,7 @@ class CoffeeShopSOAPClient:
         """Login member via SOAP"""
         try:
             # Call SOAP service
-            result = self.client.service.loginMember(email, password)
+            result = self.service.loginMember(email, password)
             
             logger.debug(f"SOAP loginMember result: {result}")
             
@@ -184,11 +519,14 @@ class CoffeeShopSOAPClient:
             logger.error(f"SOAP loginMember error: {str(e)}")
             return f"Error logging in member: {str(e)}"
     
-    def get_all_orders(self):
-        """Get all orders via SOAP (for debugging)"""
+    def get_all_orders(self, limit=None, after_id=None, status=None, payment_status=None, customer_email=None):
+        """Get orders via SOAP, one page at a time when a limit, cursor or filter is given
+
+        Paged results carry 'next_cursor': pass it back as after_id for the next page (None on the last page).
+        """
         try:
             # Call SOAP service
-            result = self.client.service.getAllOrders()
+            result = self.service.getAllOrders(limit, after_id, status, payment_status, customer_email)
             
             logger.debug(f"SOAP getAllOrders result: {result}")
             
@@ -202,9 +540,202 @@ class CoffeeShopSOAPClient:
         except Exception as e:
             logger.error(f"SOAP getAllOrders error: {str(e)}")
             return f"Error getting all orders: {str(e)}"
+    
+    def get_orders_by_customer(self, customer_email):
+        """Get all orders for a customer email via SOAP"""
+        try:
+            # Call SOAP service
+            result = self.service.getOrdersByCustomer(customer_email)
+            
+            logger.debug(f"SOAP getOrdersByCustomer result: {result}")
+            
+            # Try to parse JSON response
+            try:
+                return json.loads(result)
+            except json.JSONDecodeError:
+                # If not JSON, return as string
+                return result
+            
+        except Exception as e:
+            logger.error(f"SOAP getOrdersByCustomer error: {str(e)}")
+            return f"Error getting orders by customer: {str(e)}"
+    
+    def list_orders_by_status(self, status=None, payment_status=None):
+        """List orders by status and/or payment status via SOAP"""
+        try:
+            # Call SOAP service
+            result = self.service.listOrdersByStatus(status, payment_status)
+            
+            logger.debug(f"SOAP listOrdersByStatus result: {result}")
+            
+            # Try to parse JSON response
+            try:
+                return json.loads(result)
+            except json.JSONDecodeError:
+                # If not JSON, return as string
+                return result
+            
+        except Exception as e:
+            logger.error(f"SOAP listOrdersByStatus error: {str(e)}")
+            return f"Error listing orders by status: {str(e)}"
+    
+    def iter_orders(self, page_size=100, **filters):
+        """Yield every order matching the filters, fetching one page at a time"""
+        after_id = None
+        while True:
+            result = self.get_all_orders(limit=page_size, after_id=after_id, **filters)
+            if not isinstance(result, dict):
+                raise RuntimeError(result)
+            yield from result['orders'].values()
+            after_id = result.get('next_cursor')
+            if after_id is None:
+                return
+
+class CoffeeShopSOAPClientV2(CoffeeShopSOAPClient):
+    """Client of the typed v2 service, served under /v2 and bundled as service_v2.wsdl
+    
+    Takes the same options and has the same methods as CoffeeShopSOAPClient,
+    but every answer is a dict of the typed result instead of a string to
+    parse. error_code is None on success, or the server's code for the
+    failure (UNAVAILABLE if the call itself failed). message is what the
+    original service would have answered. Carts are sent as items, not JSON.
+    """
+    
+    WSDL = WSDL_V2_PATH
+    ENDPOINT = SOAP_ENDPOINT_V2
+    BINDING = SOAP_BINDING_V2
+    
+    def _call(self, operation, error, *args, idempotent=False):
+        """Call an operation and return its result as a dict, or an UNAVAILABLE error"""
+        try:
+            if idempotent:
+                result = self._call_idempotent(operation, *args)
+            else:
+                result = getattr(self.service, operation)(*args)
+            # Log the dict; printing the zeep object itself costs more than the call
+            result = serialize_object(result, dict)
+            logger.debug(f"SOAP {operation} result: {result}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"SOAP {operation} error: {str(e)}")
+            return {'error_code': 'UNAVAILABLE', 'message': f"{error}: {str(e)}"}
+    
+    def _batched(self, operation, error, element, items, idempotent=False):
+        """Send items batch_size at a time in element arrays; returns the answers, or the first failed call's error"""
+        results = []
+        for batch in _batches(items, self.batch_size):
+            answers = self._call(operation, error, {element: batch}, idempotent=idempotent)
+            if isinstance(answers, dict):
+                return answers
+            results += answers or []
+        return results
+    
+    def create_order(self, customer_name, customer_email, cart_items, idempotency_key=None):
+        """Create a new order; retries reuse idempotency_key (a fresh one by default)"""
+        return self._call('createOrder', 'Error creating order', customer_name, customer_email,
+                          _order_items(cart_items), idempotency_key or uuid.uuid4().hex, idempotent=True)
+    
+    def create_orders(self, orders):
+        """Create several orders, batch_size per call; returns create_order's answer for each"""
+        requests = [{
+            'customer_name': order['customer_name'],
+            'customer_email': order['customer_email'],
+            'items': _order_items(order['cart_items']),
+            'idempotency_key': order.get('idempotency_key') or uuid.uuid4().hex
+        } for order in orders]
+        return self._batched('createOrders', 'Error creating orders', 'OrderRequest', requests, idempotent=True)
+    
+    def process_payment(self, order_id, amount, payment_method, idempotency_key=None, expected_version=None):
+        """Process payment; retries reuse idempotency_key (a fresh one by default)"""
+        return self._call('processPayment', 'Error processing payment', order_id, amount, payment_method,
+                          idempotency_key or uuid.uuid4().hex, expected_version, idempotent=True)
+    
+    def process_refund(self, order_id, reason, refund_amount=None, expected_version=None):
+        return self._call('processRefund', 'Error processing refund', order_id, reason, refund_amount,
+                          expected_version)
+    
+    def get_order_status(self, order_id):
+        return self._call('getOrderStatus', 'Error getting order status', order_id)
+    
+    def get_order_statuses(self, order_ids):
+        """Get the status of several orders, batch_size per call; returns {order_id: answer}"""
+        order_ids = list(order_ids)
+        results = self._batched('getOrderStatuses', 'Error getting order statuses', 'integer', order_ids)
+        return results if isinstance(results, dict) else dict(zip(order_ids, results))
+    
+    def cancel_order(self, order_id, expected_version=None):
+        return self._call('cancelOrder', 'Error cancelling order', order_id, expected_version)
+    
+    def cancel_orders(self, order_ids):
+        """Cancel several orders, batch_size per call; returns {order_id: answer}"""
+        order_ids = list(order_ids)
+        results = self._batched('cancelOrders', 'Error cancelling orders', 'integer', order_ids)
+        return results if isinstance(results, dict) else dict(zip(order_ids, results))
+    
+    def register_guest(self, name, email, phone, notes):
+        return self._call('registerGuest', 'Error registering guest', name, email, phone, notes)
+    
+    def register_member(self, first_name, last_name, email, phone, password):
+        return self._call('registerMember', 'Error registering member', first_name, last_name, email, phone,
+                          password)
+    
+    def login_member(self, email, password):
+        return self._call('loginMember', 'Error logging in member', email, password)
+    
+    def get_all_orders(self, limit=None, after_id=None, status=None, payment_status=None, customer_email=None):
+        """Get one page of orders; 'orders' is a list and 'next_cursor' the after_id of the next page"""
+        return self._call('getAllOrders', 'Error getting all orders', limit, after_id, status, payment_status,
+                          customer_email)
+    
+    def get_orders_by_customer(self, customer_email):
+        return self._call('getOrdersByCustomer', 'Error getting orders by customer', customer_email)
+    
+    def list_orders_by_status(self, status=None, payment_status=None):
+        return self._call('listOrdersByStatus', 'Error listing orders by status', status, payment_status)
+    
+    def iter_orders(self, page_size=100, **filters):
+        """Yield every order matching the filters, fetching one page at a time"""
+        after_id = None
+        while True:
+            result = self.get_all_orders(limit=page_size, after_id=after_id, **filters)
+            if result['error_code']:
+                raise RuntimeError(result['message'])
+            yield from result['orders']
+            after_id = result['next_cursor']
+            if after_id is None:
+                return
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _json_argument(arg):
+    # zeep takes arrays wrapped in their item element, e.g. {'integer': [...]}; JSON takes them bare
+    if isinstance(arg, dict) and len(arg) == 1:
+        value, = arg.values()
+        if isinstance(value, list):
+            return value
+    return arg
+
+def _from_json(element, value):
+    """What zeep returns for the result element when the JSON answer is value"""
+    if isinstance(value, list):
+        # Arrays come bare; zeep unwraps their single item element too
+        (name, _), = element.type.elements
+        return getattr(element(**{name: value}), name)
+    if isinstance(value, dict):
+        return element(**value)
+    return value
+
+def _order_items(cart_items):
+    """Cart dicts as v2 OrderItems; item IDs are sent as strings, and the server stores numeric ones as ints"""
+    return [{'id': None if item.get('id') is None else str(item['id']), 'name': item.get('name'),
+             'price': item.get('price'), 'qty': item.get('qty')} for item in cart_items]
 
-# Create a global client instance
-soap_client = CoffeeShopSOAPClient()
+# Create global client instances; they load their WSDL on the first call, so importers start instantly
+soap_client = CoffeeShopSOAPClient(lazy=True)
+soap_client_v2 = CoffeeShopSOAPClientV2(lazy=True)
 
 def create_soap_client():
     """Create and return a SOAP client"""
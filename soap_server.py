@@ -3,12 +3,17 @@ from spyne.protocol.soap import Soap11
 from spyne.server.wsgi import WsgiApplication
 import json
 import logging
+import os
 from datetime import datetime
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# 'full' validates requests against the XML schema, 'soft' only checks values while decoding, 'off' trusts them
+VALIDATION_MODES = {'full': 'lxml', 'soft': 'soft', 'off': None}
+VALIDATION = os.environ.get('COFFEESHOP_SOAP_VALIDATION', 'full')
+
 orders = {}
 order_counter = 1000
 
@@ -119,7 +124,7 @@ class CoffeeShopService(ServiceBase):
 soap_app = Application(
     [CoffeeShopService],
     tns='urn:coffeeshop.soap',
-    in_protocol=Soap11(validator='lxml'),
+    in_protocol=Soap11(validator=VALIDATION_MODES[VALIDATION]),
     out_protocol=Soap11()
 )
 
@@ -131,7 +136,7 @@ if __name__ == '__main__':
     # Create server
     server = make_server('0.0.0.0', 8000, soap_wsgi_app)
     
-    logger.info("SOAP Server starting on http://0.0.0.0:8000")
+    logger.info(f"SOAP Server starting on http://0.0.0.0:8000 ({VALIDATION} validation)")
     logger.info("WSDL available at http://localhost:8000/?wsdl")
     
     # Start server
@@ -1,305 +1,988 @@
-from spyne import Application, rpc, ServiceBase, Unicode, Integer, Double
+from spyne import Application, rpc, ServiceBase, Unicode, Integer, Double, Array, ComplexModel, Fault
+from spyne.interface.wsdl import Wsdl11
 from spyne.protocol.soap import Soap11
-from spyne.server.wsgi import WsgiApplication
+from spyne.util.wsgi_wrapper import WsgiMounter
+from lxml import etree
+import copy
 import json
 import logging
+import os
 from datetime import datetime
+from order_store import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, DuplicateEmail, VersionConflict,
+                         create_idempotency_key_store, create_order_store, create_user_store)
+from idempotency import IdempotencyCache
+from payment_gateway import PaymentDeclined, payment_gateway
+from json_rpc import JsonRpcApplication
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# In-memory storage for orders (shared with web service)
-orders = {}
-order_counter = 1000
+DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coffeeshop.db')
 
-# In-memory storage for users (members and guests)
-users = {}
-user_counter = 100
+# Storage for orders and users (members and guests), SQLite-backed by default;
+# COFFEESHOP_STORE=daemon shares them with the web service through state_daemon.py
+STORE_BACKEND = os.environ.get('COFFEESHOP_STORE', 'sqlite')
+STORE_PATH = os.environ.get('COFFEESHOP_STORE_PATH') or (None if STORE_BACKEND == 'daemon' else DATABASE_FILE)
+# Users can live apart from orders, e.g. in the database shared by all order partitions
+USER_STORE_PATH = os.environ.get('COFFEESHOP_USER_STORE_PATH') or STORE_PATH
+order_store = create_order_store(STORE_BACKEND, STORE_PATH)
+user_store = create_user_store(STORE_BACKEND, USER_STORE_PATH)
+order_ids = order_store.id_allocator(1000)
+user_ids = user_store.id_allocator(100)
 
-class CoffeeShopService(ServiceBase):
-    """SOAP service for Eclipse Coffee Shop"""
+# As one partition behind partition_router.py, only hand out order IDs this partition owns
+PARTITION = os.environ.get('COFFEESHOP_PARTITION')
+if PARTITION:
+    from partition_router import PartitionIdAllocator, load_config
+    order_ids = PartitionIdAllocator(order_ids, load_config(os.environ['COFFEESHOP_PARTITION_CONFIG']), PARTITION)
+    logger.info(f"Serving order partition {PARTITION}")
+
+# Payment methods charged through the payment gateway
+GATEWAY_PAYMENT_METHODS = ('credit_card', 'debit_card', 'tng')
+
+# Most orders one createOrders/getOrderStatuses/cancelOrders call may carry
+MAX_BATCH_SIZE = 1000
+
+
+# The typed v2 service has its own namespace and WSDL and is served under /v2
+V2_NAMESPACE = 'urn:coffeeshop.soap.v2'
+V2_PATH = 'v2'
+# How SOAP requests are checked before they reach the service: 'full' validates every envelope
+# against the XML schema, 'soft' only checks values while decoding them, and 'off' trusts the
+# caller (for internal clients on their own listener). Picked per listener with --validation/--listen.
+VALIDATION_MODES = {'full': 'lxml', 'soft': 'soft', 'off': None}
+VALIDATION = os.environ.get('COFFEESHOP_SOAP_VALIDATION', 'full')
+
+# Both services also take JSON calls under json/ (/json and /v2/json), for trusted internal callers.
+# JSON arguments are not checked against the schema, so only listeners with validation off serve them.
+JSON_PATH = 'json'
+JSON_VALIDATION = 'off'
+
+
+class OrderRequest(ComplexModel):
+    """One order of a createOrders call, with the arguments of createOrder"""
+    __namespace__ = 'urn:coffeeshop.soap'
+
+    customer_name = Unicode
+    customer_email = Unicode
+    cart_items = Unicode
+    idempotency_key = Unicode
+
+
+class OrderItem(ComplexModel):
+    """One cart line of an order"""
+    __namespace__ = V2_NAMESPACE
+
+    id = Unicode
+    name = Unicode
+    price = Double
+    qty = Integer
+
+
+class NewOrder(ComplexModel):
+    """One order of a v2 createOrders call, with the arguments of createOrder"""
+    __namespace__ = V2_NAMESPACE
+    __type_name__ = 'OrderRequest'
+
+    customer_name = Unicode
+    customer_email = Unicode
+    items = OrderItem.customize(max_occurs='unbounded')
+    idempotency_key = Unicode
+
+
+# Every v2 answer carries error_code and message. error_code is empty on
+# success and otherwise one of NOT_FOUND, INVALID_CART, ALREADY_PAID,
+# CANCELLED, PAYMENT_IN_PROGRESS, PAYMENT_DECLINED, AMOUNT_MISMATCH,
+# UNSUPPORTED_PAYMENT_METHOD, NOT_PAID, ALREADY_REFUNDED, INVALID_REASON,
+# REFUND_TOO_LARGE, CANNOT_CANCEL, INVALID_REQUEST, EMAIL_TAKEN,
+# INVALID_PASSWORD, CONFLICT, IDEMPOTENCY_KEY_REUSED or SERVER_ERROR.
+# message is what the original service answers.
+
+class OrderResult(ComplexModel):
+    """Answer to createOrder and cancelOrder"""
+    __namespace__ = V2_NAMESPACE
+
+    error_code = Unicode
+    message = Unicode
+    order_id = Integer
+    status = Unicode
+    total_amount = Double
+
+
+class PaymentResult(ComplexModel):
+    """Answer to processPayment and processRefund; amount is what was charged or refunded"""
+    __namespace__ = V2_NAMESPACE
+
+    error_code = Unicode
+    message = Unicode
+    order_id = Integer
+    status = Unicode
+    payment_status = Unicode
+    amount = Double
+
+
+# Results of createOrder/processPayment calls by idempotency key, replayed to retries. With the
+# sqlite or daemon backend the keys are shared, so a retry reaching another worker is replayed too.
+idempotency_cache = IdempotencyCache(shared=create_idempotency_key_store(STORE_BACKEND, STORE_PATH),
+                                     result_types={'createOrder': OrderResult, 'processPayment': PaymentResult})
+
+
+class OrderStatus(ComplexModel):
+    """An order, as getOrderStatus and the listing operations return it"""
+    __namespace__ = V2_NAMESPACE
+
+    error_code = Unicode
+    message = Unicode
+    order_id = Integer
+    customer_name = Unicode
+    customer_email = Unicode
+    status = Unicode
+    payment_status = Unicode
+    total_amount = Double
+    items = OrderItem.customize(max_occurs='unbounded')
+    version = Integer
+    created_at = Unicode
+    payment_method = Unicode
+    payment_date = Unicode
+    refund_status = Unicode
+    refund_amount = Double
+    refund_reason = Unicode
+    refund_date = Unicode
+
+
+class OrderList(ComplexModel):
+    """A page of orders; next_cursor is the after_id of the next page, empty on the last one"""
+    __namespace__ = V2_NAMESPACE
+
+    error_code = Unicode
+    message = Unicode
+    orders = OrderStatus.customize(max_occurs='unbounded')
+    order_count = Integer
+    next_cursor = Integer
+
+
+class User(ComplexModel):
+    """A registered guest or member, without the password"""
+    __namespace__ = V2_NAMESPACE
+
+    error_code = Unicode
+    message = Unicode
+    id = Integer
+    type = Unicode
+    name = Unicode
+    first_name = Unicode
+    last_name = Unicode
+    email = Unicode
+    phone = Unicode
+    notes = Unicode
+    points = Integer
+    created_at = Unicode
+
+
+def _message(result):
+    """The original service's answer for a typed result"""
+    # Replayed idempotency key errors are already strings
+    return result if isinstance(result, str) else result.message
+
+
+def _typed(result, result_class):
+    """The v2 answer for a result, giving replayed idempotency key errors their code"""
+    if isinstance(result, str):
+        return result_class(error_code='IDEMPOTENCY_KEY_REUSED', message=result)
+    return result
+
+
+def _payment_result(order, amount, message):
+    return PaymentResult(message=message, order_id=order['id'], status=order['status'],
+                         payment_status=order['payment_status'], amount=amount)
+
+
+def _record_cash_payment(order):
+    order['payment_status'] = 'unpaid'
+    order['payment_method'] = 'cash'
+    order['status'] = 'awaiting_cash_payment'
+    order['payment_date'] = datetime.now().isoformat()
+    return _payment_result(order, order['total_amount'],
+                           f"Order {order['id']} marked for cash payment. Please pay at the counter.")
+
+
+def _payment_error(order, amount, payment_method):
+    """Return why a payment cannot be taken for the order, as a PaymentResult, or None"""
+    if order['payment_status'] == 'paid':
+        return PaymentResult(error_code='ALREADY_PAID', message=f"Error: Order {order['id']} is already paid")
+    if order['status'] == 'cancelled':
+        return PaymentResult(error_code='CANCELLED', message=f"Error: Order {order['id']} is cancelled")
+    if order['status'] == 'payment_processing':
+        return PaymentResult(error_code='PAYMENT_IN_PROGRESS',
+                             message=f"Error: A payment for order {order['id']} is already in progress")
+    if payment_method.lower() == 'cash':
+        return None
+    if abs(order['total_amount'] - amount) > 0.01:
+        return PaymentResult(error_code='AMOUNT_MISMATCH',
+                             message=f"Error: Payment amount ${amount:.2f} does not match order total "
+                                     f"${order['total_amount']:.2f}")
+    if payment_method.lower() not in GATEWAY_PAYMENT_METHODS:
+        return PaymentResult(error_code='UNSUPPORTED_PAYMENT_METHOD',
+                             message=f"Error: Unsupported payment method '{payment_method}'")
+    return None
+
+
+def _record_payment(order, amount, payment_method):
+    """Confirm an order once the gateway has taken the payment"""
+    order['payment_status'] = 'paid'
+    order['payment_method'] = payment_method
+    order['payment_date'] = datetime.now().isoformat()
+    order['status'] = 'confirmed'
+    
+    logger.debug(f"SOAP Payment processed for order {order['id']}")
+    return _payment_result(order, amount, f"Payment of ${amount:.2f} processed successfully for order "
+                                          f"{order['id']}. Order confirmed.")
+
+
+def _create_order(customer_name, customer_email, cart_items):
+    """Create a new order from a cart list, or its JSON as the original service takes it; returns an OrderResult"""
+    order_id = order_ids.next()
+
+    logger.debug(f"SOAP createOrder called with - Name: {customer_name}, Email: {customer_email}")
+
+    try:
+        cart_data = json.loads(cart_items) if isinstance(cart_items, str) else cart_items
+        total_amount = sum(item['price'] * item['qty'] for item in cart_data)
+
+        order = {
+            'id': order_id,
+            'customer_name': customer_name,
+            'customer_email': customer_email,
+            'items': cart_data,
+            'total_amount': total_amount,
+            'status': 'pending',
+            'created_at': datetime.now().isoformat(),
+            'payment_status': 'unpaid'
+        }
+
+        order_store.add(order)
+        logger.debug(f"SOAP Order {order_id} created successfully")
+
+        return OrderResult(message=f"Order created successfully. Order ID: {order_id}, Total: ${total_amount:.2f}",
+                           order_id=order_id, status=order['status'], total_amount=total_amount)
+
+    except Exception as e:
+        logger.error(f"SOAP Error creating order: {str(e)}")
+        return OrderResult(error_code='INVALID_CART', message=f"Error creating order: {str(e)}")
+
+
+def _reserve_payment(order_id, amount, payment_method, expected_version=None):
+    """First step of processPayment: check the order and claim it for a single charge
+
+    Returns (answer, status). Cash payments and refused payments are answered
+    right away. Otherwise answer is None: the order has been moved from
+    status to payment_processing by compare-and-set, so of several
+    concurrent payments only this one charges the gateway, once, and then
+    calls _settle_payment().
+    """
+    def apply(order):
+        if order is None:
+            return (PaymentResult(error_code='NOT_FOUND', message=f"Error: Order {order_id} not found"), None), False
+
+        error = _payment_error(order, amount, payment_method)
+        if error:
+            return (error, None), False
+
+        # Handle cash payment differently
+        if payment_method.lower() == 'cash':
+            return (_record_cash_payment(order), None), True
+
+        status = order['status']
+        order['status'] = 'payment_processing'
+        return (None, status), True
+
+    try:
+        return order_store.transition(order_id, apply, expected_version)
+
+    except VersionConflict as e:
+        return PaymentResult(error_code='CONFLICT', message=f"Error: Conflict: {e}"), None
+    except Exception as e:
+        logger.error(f"SOAP Error processing payment: {str(e)}")
+        return PaymentResult(error_code='SERVER_ERROR', message=f"Error processing payment: {str(e)}"), None
+
+
+def _settle_payment(order_id, amount, payment_method, status, error=None):
+    """Second step of processPayment: confirm a claimed order once the gateway charged it
+
+    error is what the charge raised. A declined order gets its status back
+    so it can be paid again; after any other error the charge may or may
+    not have gone through, so the order stays in payment_processing.
+    """
+    if error is not None and not isinstance(error, PaymentDeclined):
+        logger.error(f"SOAP Error charging order {order_id}, left in payment_processing: {str(error)}")
+        return PaymentResult(error_code='SERVER_ERROR', message=f"Error processing payment: {str(error)}")
+
+    def apply(order):
+        if error is not None:
+            order['status'] = status
+            return PaymentResult(error_code='PAYMENT_DECLINED',
+                                 message=f"Error: Payment for order {order_id} was declined: {error}"), True
+        return _record_payment(order, amount, payment_method), True
+
+    # No other request changes an order in payment_processing, so there is nothing to re-check on a retry
+    try:
+        return order_store.transition(order_id, apply)
+
+    except Exception as e:
+        logger.error(f"SOAP Error recording payment for order {order_id}: {str(e)}")
+        return PaymentResult(error_code='SERVER_ERROR', message=f"Error processing payment: {str(e)}")
+
+
+def _process_payment(order_id, amount, payment_method, expected_version=None):
+    """Process payment for an order; returns a PaymentResult"""
+    answer, status = _reserve_payment(order_id, amount, payment_method, expected_version)
+    if answer is not None:
+        return answer
+    try:
+        payment_gateway.charge(order_id, amount, payment_method)
+    except Exception as e:
+        return _settle_payment(order_id, amount, payment_method, status, e)
+    return _settle_payment(order_id, amount, payment_method, status)
+
+
+def _process_refund(order_id, reason, refund_amount=None, expected_version=None):
+    """Process refund for an order; returns a PaymentResult"""
+    def apply(order):
+        if order is None:
+            return PaymentResult(error_code='NOT_FOUND', message=f"Error: Order {order_id} not found"), False
+        
+        # Check if order is paid
+        if order['payment_status'] != 'paid':
+            return PaymentResult(error_code='NOT_PAID',
+                                 message=f"Error: Order {order_id} is not paid and cannot be refunded"), False
+        
+        if order.get('refund_status') == 'refunded':
+            return PaymentResult(error_code='ALREADY_REFUNDED',
+                                 message=f"Error: Order {order_id} is already refunded"), False
+        
+        # Validate refund reason
+        valid_reasons = [
+            'wrong_order', 'quality_issue', 'delivery_delay', 
+            'duplicate_charge', 'customer_request', 'technical_error'
+        ]
+        
+        if reason not in valid_reasons:
+            return PaymentResult(error_code='INVALID_REASON',
+                                 message=f"Error: Invalid refund reason. Valid reasons: {', '.join(valid_reasons)}"), False
+        
+        # Set refund amount (default to full amount if not specified)
+        amount = order['total_amount'] if refund_amount is None else refund_amount
+        
+        # Validate refund amount
+        if amount > order['total_amount']:
+            return PaymentResult(error_code='REFUND_TOO_LARGE',
+                                 message=f"Error: Refund amount ${amount:.2f} cannot exceed order total "
+                                         f"${order['total_amount']:.2f}"), False
+        
+        # Process refund
+        order['refund_status'] = 'refunded'
+        order['refund_amount'] = amount
+        order['refund_reason'] = reason
+        order['refund_date'] = datetime.now().isoformat()
+        order['status'] = 'refunded'
+        
+        logger.debug(f"SOAP Refund processed for order {order_id}: ${amount:.2f} - Reason: {reason}")
+        return _payment_result(order, amount, f"Refund of ${amount:.2f} processed successfully for order "
+                                              f"{order_id}. Reason: {reason}"), True
+    
+    try:
+        return order_store.transition(order_id, apply, expected_version)
+        
+    except VersionConflict as e:
+        return PaymentResult(error_code='CONFLICT', message=f"Error: Conflict: {e}")
+    except Exception as e:
+        logger.error(f"SOAP Error processing refund: {str(e)}")
+        return PaymentResult(error_code='SERVER_ERROR', message=f"Error processing refund: {str(e)}")
+
+
+def _order_status(order_id, order):
+    """Return getOrderStatus's answer for an order, or the error if it does not exist"""
+    if order is None:
+        return f"Error: Order {order_id} not found"
     
-    @rpc(Unicode, Unicode, Unicode, _returns=Unicode)
-    def createOrder(ctx, customer_name, customer_email, cart_items):
-        """Create a new order"""
-        global order_counter, orders
-        order_counter += 1
-        order_id = order_counter
+    status_info = {
+        'order_id': order_id,
+        'status': order['status'],
+        'payment_status': order['payment_status'],
+        'total_amount': order['total_amount'],
+        'customer_name': order['customer_name'],
+        'items': order['items'],
+        'version': order.get('version', 0)
+    }
+    
+    # Add payment method if available
+    if 'payment_method' in order:
+        status_info['payment_method'] = order['payment_method']
+    
+    # Add refund information if available
+    if 'refund_status' in order:
+        status_info['refund_status'] = order['refund_status']
+        status_info['refund_amount'] = order['refund_amount']
+        status_info['refund_reason'] = order['refund_reason']
+        status_info['refund_date'] = order['refund_date']
+    
+    return json.dumps(status_info)
+
+
+def _typed_order_status(order_id, order):
+    """Return the v2 getOrderStatus answer for an order, or the error if it does not exist"""
+    if order is None:
+        return OrderStatus(error_code='NOT_FOUND', message=f"Error: Order {order_id} not found")
+    
+    items = [OrderItem(id=None if item.get('id') is None else str(item['id']), name=item.get('name'),
+                       price=item.get('price'), qty=item.get('qty')) for item in order['items']]
+    return OrderStatus(order_id=order['id'], customer_name=order['customer_name'],
+                       customer_email=order.get('customer_email'), status=order['status'],
+                       payment_status=order['payment_status'], total_amount=order['total_amount'], items=items,
+                       version=order.get('version', 0), created_at=order.get('created_at'),
+                       payment_method=order.get('payment_method'), payment_date=order.get('payment_date'),
+                       refund_status=order.get('refund_status'), refund_amount=order.get('refund_amount'),
+                       refund_reason=order.get('refund_reason'), refund_date=order.get('refund_date'))
+
+
+def _cart(items):
+    """Cart lines of a v2 order as the dicts orders store"""
+    return [{'id': _item_id(item.id), 'name': item.name, 'price': item.price, 'qty': item.qty}
+            for item in items or []]
+
+
+def _item_id(item_id):
+    # v2 sends item IDs as strings; menu IDs are stored as ints, as v1 carts have them
+    if isinstance(item_id, str) and item_id.isdigit():
+        return int(item_id)
+    return item_id
+
+
+def _cancel_order(order_id, expected_version=None):
+    """Cancel an order; returns an OrderResult"""
+    def apply(order):
+        if order is None:
+            return OrderResult(error_code='NOT_FOUND', message=f"Error: Order {order_id} not found"), False
         
-        logger.debug(f"SOAP createOrder called with - Name: {customer_name}, Email: {customer_email}")
+        if order['payment_status'] == 'paid':
+            return OrderResult(error_code='CANNOT_CANCEL',
+                               message=f"Error: Cannot cancel order {order_id} - payment already processed"), False
+        if order['status'] == 'payment_processing':
+            return OrderResult(error_code='CANNOT_CANCEL',
+                               message=f"Error: Cannot cancel order {order_id} - payment in progress"), False
         
-        try:
-            cart_data = json.loads(cart_items)
-            total_amount = sum(item['price'] * item['qty'] for item in cart_data)
+        order['status'] = 'cancelled'
+        logger.debug(f"SOAP Order {order_id} cancelled")
+        return OrderResult(message=f"Order {order_id} cancelled successfully", order_id=order_id,
+                           status=order['status'], total_amount=order['total_amount']), True
+    
+    try:
+        return order_store.transition(order_id, apply, expected_version)
+        
+    except VersionConflict as e:
+        return OrderResult(error_code='CONFLICT', message=f"Error: Conflict: {e}")
+    except Exception as e:
+        logger.error(f"SOAP Error cancelling order: {str(e)}")
+        return OrderResult(error_code='SERVER_ERROR', message=f"Error cancelling order: {str(e)}")
+
+
+def _register_guest(name, email, phone, notes):
+    """Register a guest; returns the stored user, or a User carrying the error"""
+    user_id = user_ids.next()
+    
+    try:
+        guest_data = {
+            'id': user_id,
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'notes': notes,
+            'type': 'guest',
+            'created_at': datetime.now().isoformat()
+        }
+        
+        user_store.add(guest_data)
+        logger.debug(f"SOAP Guest registered: {user_id}")
+        
+        return guest_data
+        
+    except Exception as e:
+        logger.error(f"SOAP Error registering guest: {str(e)}")
+        return User(error_code='SERVER_ERROR', message=f"Error registering guest: {str(e)}")
+
+
+def _register_member(first_name, last_name, email, phone, password):
+    """Register a member; returns the stored user, or a User carrying the error"""
+    user_id = user_ids.next()
+    
+    try:
+        # The email check and the insert must not interleave with another registration
+        with user_store.locked(email):
+            # Check if email already exists
+            if user_store.find_by_email(email) is not None:
+                return User(error_code='EMAIL_TAKEN', message=f"Error: Email {email} already registered")
             
-            order = {
-                'id': order_id,
-                'customer_name': customer_name,
-                'customer_email': customer_email,
-                'items': cart_data,
-                'total_amount': total_amount,
-                'status': 'pending',
+            member_data = {
+                'id': user_id,
+                'first_name': first_name,
+                'last_name': last_name,
+                'name': f"{first_name} {last_name}",
+                'email': email,
+                'phone': phone,
+                'password': password,  # In production, this should be hashed
+                'type': 'member',
                 'created_at': datetime.now().isoformat(),
-                'payment_status': 'unpaid'
+                'points': 0
             }
             
-            orders[order_id] = order
-            logger.debug(f"SOAP Order {order_id} created successfully")
-            
-            return f"Order created successfully. Order ID: {order_id}, Total: ${total_amount:.2f}"
-            
-        except Exception as e:
-            logger.error(f"SOAP Error creating order: {str(e)}")
-            return f"Error creating order: {str(e)}"
+            user_store.add(member_data)
+        logger.debug(f"SOAP Member registered: {user_id}")
+        
+        return member_data
+        
+    except DuplicateEmail:
+        # Registered by another worker process between the check and the insert
+        return User(error_code='EMAIL_TAKEN', message=f"Error: Email {email} already registered")
+    except Exception as e:
+        logger.error(f"SOAP Error registering member: {str(e)}")
+        return User(error_code='SERVER_ERROR', message=f"Error registering member: {str(e)}")
+
+
+def _login_member(email, password):
+    """Log a member in; returns the user without the password, or a User carrying the error"""
+    try:
+        user = user_store.find_by_email(email, user_type='member')
+        if user is None:
+            return User(error_code='NOT_FOUND', message=f"Error: Member with email {email} not found")
+        
+        if user.get('password') == password:  # In production, verify hash
+            # Remove password from response
+            return {k: v for k, v in user.items() if k != 'password'}
+        else:
+            return User(error_code='INVALID_PASSWORD', message=f"Error: Invalid password for email {email}")
+        
+    except Exception as e:
+        logger.error(f"SOAP Error logging in member: {str(e)}")
+        return User(error_code='SERVER_ERROR', message=f"Error logging in member: {str(e)}")
+
+
+def _user_json(result):
+    """The original service's answer for a registration or login: the user as JSON, or the error"""
+    return result.message if isinstance(result, User) else json.dumps(result)
+
+
+def _typed_user(result):
+    if isinstance(result, User):
+        return result
+    fields = ('id', 'type', 'name', 'first_name', 'last_name', 'email', 'phone', 'notes', 'points', 'created_at')
+    return User(**{field: result.get(field) for field in fields})
+
+
+def _batch(items):
+    """Return the items of a batch call as a list, refusing batches over MAX_BATCH_SIZE"""
+    items = list(items or [])
+    if len(items) > MAX_BATCH_SIZE:
+        raise Fault('Client.BatchTooLarge', f"At most {MAX_BATCH_SIZE} orders per call, got {len(items)}")
+    return items
+
+
+class CoffeeShopService(ServiceBase):
+    """SOAP service for Eclipse Coffee Shop"""
     
-    @rpc(Integer, Double, Unicode, _returns=Unicode)
-    def processPayment(ctx, order_id, amount, payment_method):
-        """Process payment for an order"""
-        try:
-            if order_id not in orders:
-                return f"Error: Order {order_id} not found"
-            
-            order = orders[order_id]
-            
-            # Handle cash payment differently
-            if payment_method.lower() == 'cash':
-                order['payment_status'] = 'unpaid'
-                order['payment_method'] = 'cash'
-                order['status'] = 'awaiting_cash_payment'
-                order['payment_date'] = datetime.now().isoformat()
-                return f"Order {order_id} marked for cash payment. Please pay at the counter."
-            
-            # Validate amount for other payment methods
-            if abs(order['total_amount'] - amount) > 0.01:
-                return f"Error: Payment amount ${amount:.2f} does not match order total ${order['total_amount']:.2f}"
-            
-            # Simulate payment processing
-            if payment_method.lower() in ['credit_card', 'debit_card', 'tng']:
-                order['payment_status'] = 'paid'
-                order['payment_method'] = payment_method
-                order['payment_date'] = datetime.now().isoformat()
-                order['status'] = 'confirmed'
-                
-                logger.debug(f"SOAP Payment processed for order {order_id}")
-                return f"Payment of ${amount:.2f} processed successfully for order {order_id}. Order confirmed."
-            else:
-                return f"Error: Unsupported payment method '{payment_method}'"
-                
-        except Exception as e:
-            logger.error(f"SOAP Error processing payment: {str(e)}")
-            return f"Error processing payment: {str(e)}"
+    @rpc(Unicode, Unicode, Unicode, Unicode, _returns=Unicode)
+    def createOrder(ctx, customer_name, customer_email, cart_items, idempotency_key):
+        """Create a new order; a retry with the same idempotency_key returns the first result"""
+        return _message(idempotency_cache.call('createOrder', idempotency_key,
+                                               (customer_name, customer_email, cart_items),
+                                               lambda: _create_order(customer_name, customer_email, cart_items)))
     
-    @rpc(Integer, Unicode, Double, _returns=Unicode)
-    def processRefund(ctx, order_id, reason, refund_amount=None):
+    @rpc(Integer, Double, Unicode, Unicode, Integer, _returns=Unicode)
+    def processPayment(ctx, order_id, amount, payment_method, idempotency_key, expected_version):
+        """Process payment for an order; a retry with the same idempotency_key is not charged again"""
+        return _message(idempotency_cache.call('processPayment', idempotency_key,
+                                               (order_id, amount, payment_method, expected_version),
+                                               lambda: _process_payment(order_id, amount, payment_method,
+                                                                        expected_version)))
+    
+    @rpc(Integer, Unicode, Double, Integer, _returns=Unicode)
+    def processRefund(ctx, order_id, reason, refund_amount=None, expected_version=None):
         """Process refund for an order"""
-        try:
-            if order_id not in orders:
-                return f"Error: Order {order_id} not found"
-            
-            order = orders[order_id]
-            
-            # Check if order is paid
-            if order['payment_status'] != 'paid':
-                return f"Error: Order {order_id} is not paid and cannot be refunded"
-            
-            # Validate refund reason
-            valid_reasons = [
-                'wrong_order', 'quality_issue', 'delivery_delay', 
-                'duplicate_charge', 'customer_request', 'technical_error'
-            ]
-            
-            if reason not in valid_reasons:
-                return f"Error: Invalid refund reason. Valid reasons: {', '.join(valid_reasons)}"
-            
-            # Set refund amount (default to full amount if not specified)
-            if refund_amount is None:
-                refund_amount = order['total_amount']
-            
-            # Validate refund amount
-            if refund_amount > order['total_amount']:
-                return f"Error: Refund amount ${refund_amount:.2f} cannot exceed order total ${order['total_amount']:.2f}"
-            
-            # Process refund
-            order['refund_status'] = 'refunded'
-            order['refund_amount'] = refund_amount
-            order['refund_reason'] = reason
-            order['refund_date'] = datetime.now().isoformat()
-            order['status'] = 'refunded'
-            
-            logger.debug(f"SOAP Refund processed for order {order_id}: ${refund_amount:.2f} - Reason: {reason}")
-            return f"Refund of ${refund_amount:.2f} processed successfully for order {order_id}. Reason: {reason}"
-            
-        except Exception as e:
-            logger.error(f"SOAP Error processing refund: {str(e)}")
-            return f"Error processing refund: {str(e)}"
+        return _message(_process_refund(order_id, reason, refund_amount, expected_version))
     
     @rpc(Integer, _returns=Unicode)
     def getOrderStatus(ctx, order_id):
         """Get the status of an order"""
         try:
-            if order_id not in orders:
-                return f"Error: Order {order_id} not found"
-            
-            order = orders[order_id]
-            status_info = {
-                'order_id': order_id,
-                'status': order['status'],
-                'payment_status': order['payment_status'],
-                'total_amount': order['total_amount'],
-                'customer_name': order['customer_name'],
-                'items': order['items']
-            }
-            
-            # Add payment method if available
-            if 'payment_method' in order:
-                status_info['payment_method'] = order['payment_method']
-            
-            # Add refund information if available
-            if 'refund_status' in order:
-                status_info['refund_status'] = order['refund_status']
-                status_info['refund_amount'] = order['refund_amount']
-                status_info['refund_reason'] = order['refund_reason']
-                status_info['refund_date'] = order['refund_date']
-            
-            return json.dumps(status_info)
+            return _order_status(order_id, order_store.get(order_id))
             
         except Exception as e:
             logger.error(f"SOAP Error getting order status: {str(e)}")
             return f"Error getting order status: {str(e)}"
     
-    @rpc(Integer, _returns=Unicode)
-    def cancelOrder(ctx, order_id):
+    @rpc(Integer, Integer, _returns=Unicode)
+    def cancelOrder(ctx, order_id, expected_version):
         """Cancel an order"""
+        return _message(_cancel_order(order_id, expected_version))
+    
+    @rpc(Array(OrderRequest), _returns=Array(Unicode))
+    def createOrders(ctx, orders):
+        """Create several orders; returns createOrder's answer for each, in order"""
+        results = []
+        for request in _batch(orders):
+            args = (request.customer_name, request.customer_email, request.cart_items)
+            results.append(_message(idempotency_cache.call('createOrder', request.idempotency_key, args,
+                                                           lambda: _create_order(*args))))
+        return results
+    
+    @rpc(Array(Integer), _returns=Array(Unicode))
+    def getOrderStatuses(ctx, order_ids):
+        """Get the status of several orders; returns getOrderStatus's answer for each, in order"""
+        order_ids = _batch(order_ids)
         try:
-            if order_id not in orders:
-                return f"Error: Order {order_id} not found"
-            
-            order = orders[order_id]
-            if order['payment_status'] == 'paid':
-                return f"Error: Cannot cancel order {order_id} - payment already processed"
-            
-            order['status'] = 'cancelled'
-            logger.debug(f"SOAP Order {order_id} cancelled")
-            return f"Order {order_id} cancelled successfully"
+            orders = order_store.get_many(order_ids)
+            return [_order_status(order_id, order) for order_id, order in zip(order_ids, orders)]
             
         except Exception as e:
-            logger.error(f"SOAP Error cancelling order: {str(e)}")
-            return f"Error cancelling order: {str(e)}"
+            logger.error(f"SOAP Error getting order statuses: {str(e)}")
+            return [f"Error getting order status: {str(e)}"] * len(order_ids)
+    
+    @rpc(Array(Integer), _returns=Array(Unicode))
+    def cancelOrders(ctx, order_ids):
+        """Cancel several orders; returns cancelOrder's answer for each, in order"""
+        return [_message(_cancel_order(order_id)) for order_id in _batch(order_ids)]
     
     @rpc(Unicode, Unicode, Unicode, Unicode, _returns=Unicode)
     def registerGuest(ctx, name, email, phone, notes):
         """Register a guest user"""
-        global user_counter, users
-        user_counter += 1
-        user_id = user_counter
-        
-        try:
-            guest_data = {
-                'id': user_id,
-                'name': name,
-                'email': email,
-                'phone': phone,
-                'notes': notes,
-                'type': 'guest',
-                'created_at': datetime.now().isoformat()
-            }
-            
-            users[user_id] = guest_data
-            logger.debug(f"SOAP Guest registered: {user_id}")
-            
-            return json.dumps(guest_data)
-            
-        except Exception as e:
-            logger.error(f"SOAP Error registering guest: {str(e)}")
-            return f"Error registering guest: {str(e)}"
+        return _user_json(_register_guest(name, email, phone, notes))
     
     @rpc(Unicode, Unicode, Unicode, Unicode, Unicode, _returns=Unicode)
     def registerMember(ctx, first_name, last_name, email, phone, password):
         """Register a new member"""
-        global user_counter, users
-        user_counter += 1
-        user_id = user_counter
-        
+        return _user_json(_register_member(first_name, last_name, email, phone, password))
+    
+    @rpc(Unicode, Unicode, _returns=Unicode)
+    def loginMember(ctx, email, password):
+        """Login a member"""
+        return _user_json(_login_member(email, password))
+    
+    @rpc(Unicode, _returns=Unicode)
+    def getOrdersByCustomer(ctx, customer_email):
+        """Get all orders placed with an email address, oldest first"""
         try:
-            # Check if email already exists
-            for user in users.values():
-                if user.get('email') == email:
-                    return f"Error: Email {email} already registered"
+            if not customer_email:
+                return "Error: Customer email is required"
             
-            member_data = {
-                'id': user_id,
-                'first_name': first_name,
-                'last_name': last_name,
-                'name': f"{first_name} {last_name}",
-                'email': email,
-                'phone': phone,
-                'password': password,  # In production, this should be hashed
-                'type': 'member',
-                'created_at': datetime.now().isoformat(),
-                'points': 0
-            }
+            orders = order_store.find(customer_email=customer_email)
+            return json.dumps({
+                'customer_email': customer_email,
+                'orders': orders,
+                'order_count': len(orders)
+            })
+        except Exception as e:
+            logger.error(f"SOAP Error getting orders by customer: {str(e)}")
+            return f"Error getting orders by customer: {str(e)}"
+    
+    @rpc(Unicode, Unicode, _returns=Unicode)
+    def listOrdersByStatus(ctx, status, payment_status):
+        """List orders with a given status and/or payment status, oldest first"""
+        try:
+            if not status and not payment_status:
+                return "Error: Status or payment status is required"
             
-            users[user_id] = member_data
-            logger.debug(f"SOAP Member registered: {user_id}")
+            orders = order_store.find(status=status or None, payment_status=payment_status or None)
+            return json.dumps({
+                'status': status,
+                'payment_status': payment_status,
+                'orders': orders,
+                'order_count': len(orders)
+            })
+        except Exception as e:
+            logger.error(f"SOAP Error listing orders by status: {str(e)}")
+            return f"Error listing orders by status: {str(e)}"
+    
+    @rpc(Integer, Integer, Unicode, Unicode, Unicode, _returns=Unicode)
+    def getAllOrders(ctx, limit, after_id, status, payment_status, customer_email):
+        """Get orders one page at a time, oldest first (all orders when called without arguments)"""
+        try:
+            filters = {
+                'status': status or None,
+                'payment_status': payment_status or None,
+                'customer_email': customer_email or None
+            }
+            if limit is None and after_id is None and not any(filters.values()):
+                # Legacy callers get the full dump
+                all_orders = order_store.all()
+                return json.dumps({
+                    'orders': all_orders,
+                    'order_count': len(all_orders),
+                    'order_ids': list(all_orders.keys())
+                })
+            
+            limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+            orders, next_cursor = order_store.page(after_id, limit, **filters)
+            return json.dumps({
+                'orders': {order['id']: order for order in orders},
+                'order_count': len(orders),
+                'order_ids': [order['id'] for order in orders],
+                'next_cursor': next_cursor
+            })
+        except Exception as e:
+            logger.error(f"SOAP Error getting all orders: {str(e)}")
+            return f"Error getting all orders: {str(e)}"
+
+
+class CoffeeShopServiceV2(ServiceBase):
+    """The same operations as CoffeeShopService, answering with typed results instead of strings"""
+    
+    @rpc(Unicode, Unicode, OrderItem.customize(max_occurs='unbounded'), Unicode, _returns=OrderResult)
+    def createOrder(ctx, customer_name, customer_email, items, idempotency_key):
+        """Create a new order; a retry with the same idempotency_key returns the first result"""
+        cart = _cart(items)
+        return _typed(idempotency_cache.call('createOrder', idempotency_key, (customer_name, customer_email, cart),
+                                             lambda: _create_order(customer_name, customer_email, cart)),
+                      OrderResult)
+    
+    @rpc(Integer, Double, Unicode, Unicode, Integer, _returns=PaymentResult)
+    def processPayment(ctx, order_id, amount, payment_method, idempotency_key, expected_version):
+        """Process payment for an order; a retry with the same idempotency_key is not charged again"""
+        return _typed(idempotency_cache.call('processPayment', idempotency_key,
+                                             (order_id, amount, payment_method, expected_version),
+                                             lambda: _process_payment(order_id, amount, payment_method,
+                                                                      expected_version)),
+                      PaymentResult)
+    
+    @rpc(Integer, Unicode, Double, Integer, _returns=PaymentResult)
+    def processRefund(ctx, order_id, reason, refund_amount, expected_version):
+        """Process refund for an order"""
+        return _process_refund(order_id, reason, refund_amount, expected_version)
+    
+    @rpc(Integer, _returns=OrderStatus)
+    def getOrderStatus(ctx, order_id):
+        """Get the status of an order"""
+        try:
+            return _typed_order_status(order_id, order_store.get(order_id))
             
-            return json.dumps(member_data)
+        except Exception as e:
+            logger.error(f"SOAP Error getting order status: {str(e)}")
+            return OrderStatus(error_code='SERVER_ERROR', message=f"Error getting order status: {str(e)}")
+    
+    @rpc(Integer, Integer, _returns=OrderResult)
+    def cancelOrder(ctx, order_id, expected_version):
+        """Cancel an order"""
+        return _cancel_order(order_id, expected_version)
+    
+    @rpc(Array(NewOrder), _returns=Array(OrderResult))
+    def createOrders(ctx, orders):
+        """Create several orders; returns createOrder's answer for each, in order"""
+        results = []
+        for request in _batch(orders):
+            args = (request.customer_name, request.customer_email, _cart(request.items))
+            results.append(_typed(idempotency_cache.call('createOrder', request.idempotency_key, args,
+                                                         lambda: _create_order(*args)), OrderResult))
+        return results
+    
+    @rpc(Array(Integer), _returns=Array(OrderStatus))
+    def getOrderStatuses(ctx, order_ids):
+        """Get the status of several orders; returns getOrderStatus's answer for each, in order"""
+        order_ids = _batch(order_ids)
+        try:
+            orders = order_store.get_many(order_ids)
+            return [_typed_order_status(order_id, order) for order_id, order in zip(order_ids, orders)]
             
         except Exception as e:
-            logger.error(f"SOAP Error registering member: {str(e)}")
-            return f"Error registering member: {str(e)}"
+            logger.error(f"SOAP Error getting order statuses: {str(e)}")
+            return [OrderStatus(error_code='SERVER_ERROR', message=f"Error getting order status: {str(e)}")
+                    for _ in order_ids]
     
-    @rpc(Unicode, Unicode, _returns=Unicode)
+    @rpc(Array(Integer), _returns=Array(OrderResult))
+    def cancelOrders(ctx, order_ids):
+        """Cancel several orders; returns cancelOrder's answer for each, in order"""
+        return [_cancel_order(order_id) for order_id in _batch(order_ids)]
+    
+    @rpc(Unicode, Unicode, Unicode, Unicode, _returns=User)
+    def registerGuest(ctx, name, email, phone, notes):
+        """Register a guest user"""
+        return _typed_user(_register_guest(name, email, phone, notes))
+    
+    @rpc(Unicode, Unicode, Unicode, Unicode, Unicode, _returns=User)
+    def registerMember(ctx, first_name, last_name, email, phone, password):
+        """Register a new member"""
+        return _typed_user(_register_member(first_name, last_name, email, phone, password))
+    
+    @rpc(Unicode, Unicode, _returns=User)
     def loginMember(ctx, email, password):
         """Login a member"""
+        return _typed_user(_login_member(email, password))
+    
+    @rpc(Unicode, _returns=OrderList)
+    def getOrdersByCustomer(ctx, customer_email):
+        """Get all orders placed with an email address, oldest first"""
         try:
-            for user in users.values():
-                if user.get('type') == 'member' and user.get('email') == email:
-                    if user.get('password') == password:  # In production, verify hash
-                        # Remove password from response
-                        login_data = {k: v for k, v in user.items() if k != 'password'}
-                        return json.dumps(login_data)
-                    else:
-                        return f"Error: Invalid password for email {email}"
+            if not customer_email:
+                return OrderList(error_code='INVALID_REQUEST', message="Error: Customer email is required")
             
-            return f"Error: Member with email {email} not found"
+            orders = order_store.find(customer_email=customer_email)
+            return OrderList(orders=[_typed_order_status(order['id'], order) for order in orders],
+                             order_count=len(orders))
+        except Exception as e:
+            logger.error(f"SOAP Error getting orders by customer: {str(e)}")
+            return OrderList(error_code='SERVER_ERROR', message=f"Error getting orders by customer: {str(e)}")
+    
+    @rpc(Unicode, Unicode, _returns=OrderList)
+    def listOrdersByStatus(ctx, status, payment_status):
+        """List orders with a given status and/or payment status, oldest first"""
+        try:
+            if not status and not payment_status:
+                return OrderList(error_code='INVALID_REQUEST', message="Error: Status or payment status is required")
             
+            orders = order_store.find(status=status or None, payment_status=payment_status or None)
+            return OrderList(orders=[_typed_order_status(order['id'], order) for order in orders],
+                             order_count=len(orders))
         except Exception as e:
-            logger.error(f"SOAP Error logging in member: {str(e)}")
-            return f"Error logging in member: {str(e)}"
+            logger.error(f"SOAP Error listing orders by status: {str(e)}")
+            return OrderList(error_code='SERVER_ERROR', message=f"Error listing orders by status: {str(e)}")
     
-    @rpc(_returns=Unicode)
-    def getAllOrders(ctx):
-        """Get all orders (for debugging)"""
+    @rpc(Integer, Integer, Unicode, Unicode, Unicode, _returns=OrderList)
+    def getAllOrders(ctx, limit, after_id, status, payment_status, customer_email):
+        """Get orders one page at a time, oldest first; unlike the original service there is no full dump"""
         try:
-            return json.dumps({
-                'orders': orders,
-                'order_count': len(orders),
-                'order_ids': list(orders.keys())
-            })
+            limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+            orders, next_cursor = order_store.page(after_id, limit, status=status or None,
+                                                   payment_status=payment_status or None,
+                                                   customer_email=customer_email or None)
+            return OrderList(orders=[_typed_order_status(order['id'], order) for order in orders],
+                             order_count=len(orders), next_cursor=next_cursor)
         except Exception as e:
             logger.error(f"SOAP Error getting all orders: {str(e)}")
-            return f"Error getting all orders: {str(e)}"
+            return OrderList(error_code='SERVER_ERROR', message=f"Error getting all orders: {str(e)}")
 
-# Create the SOAP application
+# Create the SOAP applications: the original string-answer service, and the typed v2 service
 soap_app = Application(
     [CoffeeShopService],
     tns='urn:coffeeshop.soap',
     in_protocol=Soap11(validator='lxml'),
     out_protocol=Soap11()
 )
+soap_app_v2 = Application(
+    [CoffeeShopServiceV2],
+    tns=V2_NAMESPACE,
+    in_protocol=Soap11(validator='lxml'),
+    out_protocol=Soap11()
+)
+
+# The same services as JSON calls for internal callers (see json_rpc.py)
+json_app = JsonRpcApplication(soap_app)
+json_app_v2 = JsonRpcApplication(soap_app_v2)
+
+_validating = {}
+
+
+def with_validation(app, validation):
+    """app (which validates fully) checking its requests as validation says
+
+    The variant is a copy of app with another in_protocol, made once per mode.
+    It shares app's services and interface, so nothing is rebuilt, and the
+    schema compiled when app was built serves every 'full' listener.
+    """
+    if validation not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode '{validation}', expected one of {', '.join(VALIDATION_MODES)}")
+    if validation == 'full':
+        return app
+    variant = _validating.get((app, validation))
+    if variant is None:
+        variant = copy.copy(app)
+        variant.in_protocol = Soap11(validator=VALIDATION_MODES[validation])
+        variant.in_protocol.set_app(variant)
+        variant.in_protocol.message = variant.in_protocol.REQUEST
+        _validating[(app, validation)] = variant
+    return variant
+
 
-# Create WSGI application
-soap_wsgi_app = WsgiApplication(soap_app)
+def wsgi_app(validation=VALIDATION):
+    """WSGI application serving both services, checking SOAP requests as validation says
+
+    The JSON mounts are only added without validation.
+    """
+    # The original service stays at / so existing clients keep working
+    mounts = {'': with_validation(soap_app, validation)}
+    v2_mounts = {'': with_validation(soap_app_v2, validation)}
+    if validation == JSON_VALIDATION:
+        mounts[JSON_PATH] = json_app
+        v2_mounts[JSON_PATH] = json_app_v2
+    mounts[V2_PATH] = WsgiMounter(v2_mounts)
+    return WsgiMounter(mounts)
+
+
+# For WSGI servers that import the application by name
+soap_wsgi_app = wsgi_app()
+
+
+def wsdl_document(url='http://localhost:8000/', app=soap_app):
+    """Return the WSDL served for app at url, as bundled with clients in service.wsdl and service_v2.wsdl"""
+    wsdl = Wsdl11(app.interface)
+    wsdl.build_interface_document(url)
+    return etree.tostring(etree.fromstring(wsdl.get_interface_document()), pretty_print=True,
+                          xml_declaration=True, encoding='UTF-8')
 
 if __name__ == '__main__':
-    from wsgiref.simple_server import make_server
+    import argparse
+    from wsgi_server import DEFAULT_THREADS, KEEPALIVE_TIMEOUT, serve
+    
+    parser = argparse.ArgumentParser(description='Eclipse Coffee Shop SOAP server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='request threads per worker process')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='pre-forked worker processes (more than one requires COFFEESHOP_STORE=sqlite or daemon)')
+    parser.add_argument('--keepalive-timeout', type=float, default=KEEPALIVE_TIMEOUT,
+                        help='seconds an idle keep-alive connection is kept open')
+    parser.add_argument('--validation', choices=list(VALIDATION_MODES), default=VALIDATION,
+                        help='how SOAP requests on --port are checked (default: COFFEESHOP_SOAP_VALIDATION or full)')
+    parser.add_argument('--listen', metavar='PORT:MODE', action='append', default=[],
+                        help='also serve on PORT with validation MODE, e.g. 8001:off for trusted internal clients')
+    parser.add_argument('--log-level', default='DEBUG', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='logging level (DEBUG logs every call)')
+    parser.add_argument('--dump-wsdl', metavar='PATH',
+                        help='write the WSDL to PATH (e.g. service.wsdl, which clients load at startup) and exit')
+    parser.add_argument('--dump-wsdl-v2', metavar='PATH',
+                        help='write the v2 WSDL to PATH (e.g. service_v2.wsdl) and exit')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    
+    if args.dump_wsdl or args.dump_wsdl_v2:
+        for path, app, url in ((args.dump_wsdl, soap_app, 'http://localhost:8000/'),
+                               (args.dump_wsdl_v2, soap_app_v2, f'http://localhost:8000/{V2_PATH}')):
+            if path:
+                with open(path, 'wb') as f:
+                    f.write(wsdl_document(url, app))
+                logger.info(f"WSDL written to {path}")
+        raise SystemExit(0)
+    
+    listeners = {}
+    for listener in args.listen:
+        port, _, mode = listener.partition(':')
+        if not port.isdigit() or mode not in VALIDATION_MODES:
+            parser.error(f"--listen {listener}: expected PORT:MODE with MODE one of {', '.join(VALIDATION_MODES)}")
+        listeners[int(port)] = mode
     
-    # Create server
-    server = make_server('0.0.0.0', 8000, soap_wsgi_app)
+    # Workers are separate processes, so state must live in SQLite or the state daemon
+    if args.workers > 1 and STORE_BACKEND not in ('sqlite', 'daemon'):
+        parser.error(f"--workers {args.workers} needs the sqlite or daemon store backend, not '{STORE_BACKEND}'")
     
-    logger.info("SOAP Server starting on http://0.0.0.0:8000")
-    logger.info("WSDL available at http://localhost:8000/?wsdl")
+    logger.info(f"SOAP Server starting on http://{args.host}:{args.port} ({args.validation} validation)" +
+                ''.join(f", :{port} ({mode} validation)" for port, mode in listeners.items()))
+    logger.info(f"WSDL available at http://localhost:{args.port}/?wsdl, typed v2 at "
+                f"http://localhost:{args.port}/{V2_PATH}?wsdl")
+    for port, mode in [(args.port, args.validation)] + list(listeners.items()):
+        if mode == JSON_VALIDATION:
+            logger.info(f"JSON calls at http://localhost:{port}/{JSON_PATH} and "
+                        f"http://localhost:{port}/{V2_PATH}/{JSON_PATH}")
     
     # Start server
-    server.serve_forever() 
\ No newline at end of file
+    serve(wsgi_app(args.validation), args.host, args.port, threads=args.threads, workers=args.workers,
+          keepalive_timeout=args.keepalive_timeout,
+          listeners={port: wsgi_app(mode) for port, mode in listeners.items()})
+    order_store.close()
+    user_store.close()
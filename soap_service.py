@@ -5,6 +5,7 @@ import socket
 import json
 from datetime import datetime
 import uuid
+from order_store import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, VersionConflict, create_order_store
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -25,51 +26,22 @@ app = Flask(__name__,
             static_folder=static_folder)
 app.secret_key = 'eclipse_coffee_secret_key_2024'
 
-# In-memory storage for orders (in production, use a database)
-orders = {}
-order_counter = 1000
-
 ORDERS_FILE = os.path.join(current_dir, 'orders.json')
+DATABASE_FILE = os.path.join(current_dir, 'coffeeshop.db')
 
-def save_orders():
-    try:
-        with open(ORDERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(orders, f, indent=2, default=str)
-        logger.info(f"Orders saved to {ORDERS_FILE}")
-    except Exception as e:
-        logger.error(f"Error saving orders: {e}")
-
-def load_orders():
-    global orders, order_counter
-    if os.path.exists(ORDERS_FILE):
-        try:
-            with open(ORDERS_FILE, 'r', encoding='utf-8') as f:
-                loaded = json.load(f)
-                # Convert keys back to int
-                orders.clear()
-                for k, v in loaded.items():
-                    orders[int(k)] = v
-                if orders:
-                    order_counter = max(orders.keys())
-            logger.info(f"Orders loaded from {ORDERS_FILE}")
-        except Exception as e:
-            logger.error(f"Error loading orders: {e}")
-    else:
-        logger.info(f"No existing orders file found at {ORDERS_FILE}")
-
-# Load orders at startup
-load_orders()
+# Order storage: orders.json snapshot + mutation log by default, or SQLite / in-memory;
+# COFFEESHOP_STORE=daemon shares orders with the SOAP service through state_daemon.py
+STORE_BACKEND = os.environ.get('COFFEESHOP_STORE', 'json')
+STORE_PATH = os.environ.get('COFFEESHOP_STORE_PATH') or {'sqlite': DATABASE_FILE, 'daemon': None}.get(STORE_BACKEND, ORDERS_FILE)
+order_store = create_order_store(STORE_BACKEND, STORE_PATH)
+order_ids = order_store.id_allocator(1000)
 
 # Web interface functions (no SOAP dependency)
 def create_order_web(customer_name, customer_email, cart_items):
-    """Create order for web interface"""
-    global order_counter, orders
-    order_counter += 1
-    order_id = order_counter
+    """Create order for web interface; returns (message, order_id), order_id being None on failure"""
+    order_id = order_ids.next()
     
     logger.debug(f"create_order_web called with - Name: {customer_name}, Email: {customer_email}")
-    logger.debug(f"Current order_counter: {order_counter}")
-    logger.debug(f"Current orders before creation: {list(orders.keys())}")
     
     try:
         cart_data = json.loads(cart_items)
@@ -86,35 +58,38 @@ def create_order_web(customer_name, customer_email, cart_items):
             'payment_status': 'unpaid'
         }
         
-        orders[order_id] = order
-        save_orders()
-        logger.debug(f"Order {order_id} added to orders dictionary")
-        logger.debug(f"Orders after creation: {list(orders.keys())}")
+        order_store.add(order)
+        logger.debug(f"Order {order_id} added to order store")
         logger.debug(f"Order details: {order}")
         
-        return f"Order created successfully. Order ID: {order_id}, Total: ${total_amount:.2f}"
+        return f"Order created successfully. Order ID: {order_id}, Total: ${total_amount:.2f}", order_id
         
     except Exception as e:
         logger.error(f"Error creating order: {str(e)}")
-        return f"Error creating order: {str(e)}"
+        return f"Error creating order: {str(e)}", None
 
 def process_payment_web(order_id, amount, payment_method):
     """Process payment for web interface"""
-    try:
-        if order_id not in orders:
-            return f"Error: Order {order_id} not found"
+    def apply(order):
+        if order is None:
+            return f"Error: Order {order_id} not found", False
+        
+        if order['payment_status'] == 'paid':
+            return f"Error: Order {order_id} is already paid", False
+        if order['status'] == 'cancelled':
+            return f"Error: Order {order_id} is cancelled", False
+        if order['status'] == 'payment_processing':
+            return f"Error: A payment for order {order_id} is already in progress", False
         
-        order = orders[order_id]
         if payment_method.lower() == 'cash':
             # For cash, mark as unpaid but set status to awaiting payment at counter
             order['payment_status'] = 'unpaid'
             order['payment_method'] = 'cash'
             order['status'] = 'awaiting_cash_payment'
             order['payment_date'] = datetime.now().isoformat()
-            save_orders()
-            return f"Order {order_id} marked for cash payment. Please pay at the counter."
+            return f"Order {order_id} marked for cash payment. Please pay at the counter.", True
         if abs(order['total_amount'] - amount) > 0.01:
-            return f"Error: Payment amount ${amount:.2f} does not match order total ${order['total_amount']:.2f}"
+            return f"Error: Payment amount ${amount:.2f} does not match order total ${order['total_amount']:.2f}", False
         
         # Simulate payment processing
         if payment_method.lower() in ['credit_card', 'debit_card', 'tng']:
@@ -122,22 +97,26 @@ def process_payment_web(order_id, amount, payment_method):
             order['payment_method'] = payment_method
             order['payment_date'] = datetime.now().isoformat()
             order['status'] = 'confirmed'
-            save_orders()
-            return f"Payment of ${amount:.2f} processed successfully for order {order_id}. Order confirmed."
+            return f"Payment of ${amount:.2f} processed successfully for order {order_id}. Order confirmed.", True
         else:
-            return f"Error: Unsupported payment method '{payment_method}'"
-            
+            return f"Error: Unsupported payment method '{payment_method}'", False
+    
+    try:
+        return order_store.transition(order_id, apply)
+        
+    except VersionConflict as e:
+        return f"Error: Conflict: {e}"
     except Exception as e:
         logger.error(f"Error processing payment: {str(e)}")
         return f"Error processing payment: {str(e)}"
 
 def get_order_status_web(order_id):
-    """Get order status for web interface"""
+    """Get order status for web interface, as a dict, or the error message"""
     try:
-        if order_id not in orders:
+        order = order_store.get(order_id)
+        if order is None:
             return f"Error: Order {order_id} not found"
         
-        order = orders[order_id]
         status_info = {
             'order_id': order_id,
             'status': order['status'],
@@ -147,7 +126,7 @@ def get_order_status_web(order_id):
             'items': order['items']
         }
         
-        return json.dumps(status_info)
+        return status_info
         
     except Exception as e:
         logger.error(f"Error getting order status: {str(e)}")
@@ -155,34 +134,40 @@ def get_order_status_web(order_id):
 
 def cancel_order_web(order_id):
     """Cancel order for web interface"""
-    try:
-        if order_id not in orders:
-            return f"Error: Order {order_id} not found"
+    def apply(order):
+        if order is None:
+            return f"Error: Order {order_id} not found", False
         
-        order = orders[order_id]
         if order['payment_status'] == 'paid':
-            return f"Error: Cannot cancel order {order_id} - payment already processed"
+            return f"Error: Cannot cancel order {order_id} - payment already processed", False
+        if order['status'] == 'payment_processing':
+            return f"Error: Cannot cancel order {order_id} - payment in progress", False
         
         order['status'] = 'cancelled'
-        save_orders()
         logger.debug(f"Order {order_id} cancelled")
-        return f"Order {order_id} cancelled successfully"
+        return f"Order {order_id} cancelled successfully", True
+    
+    try:
+        return order_store.transition(order_id, apply)
         
+    except VersionConflict as e:
+        return f"Error: Conflict: {e}"
     except Exception as e:
         logger.error(f"Error cancelling order: {str(e)}")
         return f"Error cancelling order: {str(e)}"
 
 def process_refund_web(order_id, reason, refund_amount=None):
     """Process refund for web interface"""
-    try:
-        if order_id not in orders:
-            return f"Error: Order {order_id} not found"
-        
-        order = orders[order_id]
+    def apply(order):
+        if order is None:
+            return f"Error: Order {order_id} not found", False
         
         # Check if order is paid
         if order['payment_status'] != 'paid':
-            return f"Error: Order {order_id} is not paid and cannot be refunded"
+            return f"Error: Order {order_id} is not paid and cannot be refunded", False
+        
+        if order.get('refund_status') == 'refunded':
+            return f"Error: Order {order_id} is already refunded", False
         
         # Validate refund reason
         valid_reasons = [
@@ -191,27 +176,30 @@ def process_refund_web(order_id, reason, refund_amount=None):
         ]
         
         if reason not in valid_reasons:
-            return f"Error: Invalid refund reason. Valid reasons: {', '.join(valid_reasons)}"
+            return f"Error: Invalid refund reason. Valid reasons: {', '.join(valid_reasons)}", False
         
         # Set refund amount (default to full amount if not specified)
-        if refund_amount is None:
-            refund_amount = order['total_amount']
+        amount = order['total_amount'] if refund_amount is None else refund_amount
         
         # Validate refund amount
-        if refund_amount > order['total_amount']:
-            return f"Error: Refund amount ${refund_amount:.2f} cannot exceed order total ${order['total_amount']:.2f}"
+        if amount > order['total_amount']:
+            return f"Error: Refund amount ${amount:.2f} cannot exceed order total ${order['total_amount']:.2f}", False
         
         # Process refund
         order['refund_status'] = 'refunded'
-        order['refund_amount'] = refund_amount
+        order['refund_amount'] = amount
         order['refund_reason'] = reason
         order['refund_date'] = datetime.now().isoformat()
         order['status'] = 'refunded'
-        save_orders()
         
-        logger.debug(f"Refund processed for order {order_id}: ${refund_amount:.2f} - Reason: {reason}")
-        return f"Refund of ${refund_amount:.2f} processed successfully for order {order_id}. Reason: {reason}"
+        logger.debug(f"Refund processed for order {order_id}: ${amount:.2f} - Reason: {reason}")
+        return f"Refund of ${amount:.2f} processed successfully for order {order_id}. Reason: {reason}", True
+    
+    try:
+        return order_store.transition(order_id, apply)
         
+    except VersionConflict as e:
+        return f"Error: Conflict: {e}"
     except Exception as e:
         logger.error(f"Error processing refund: {str(e)}")
         return f"Error processing refund: {str(e)}"
@@ -271,13 +259,12 @@ def checkout():
 def payment_page(order_id):
     try:
         logger.debug(f"Payment page accessed for order ID: {order_id}")
-        logger.debug(f"Available orders: {list(orders.keys())}")
         
-        if order_id not in orders:
-            logger.error(f"Order {order_id} not found in orders dictionary")
+        order = order_store.get(order_id)
+        if order is None:
+            logger.error(f"Order {order_id} not found in order store")
             return "Order not found", 404
         
-        order = orders[order_id]
         logger.debug(f"Order {order_id} found: {order}")
         logger.debug(f"Order type: {type(order)}")
         logger.debug(f"Order items type: {type(order.get('items', 'No items key'))}")
@@ -295,7 +282,7 @@ def payment_page(order_id):
                     logger.error(f"Could not parse items JSON: {e}")
                     return "Invalid order data", 500
         
-        return render_template('payment.html', order=order)
+        return render_template('payment.html', order=order.to_dict())
     except Exception as e:
         logger.error(f"Error rendering payment template: {str(e)}")
         import traceback
@@ -306,15 +293,14 @@ def payment_page(order_id):
 def order_status_page(order_id):
     try:
         logger.debug(f"Order status page accessed for order ID: {order_id}")
-        logger.debug(f"Available orders: {list(orders.keys())}")
         
-        if order_id not in orders:
-            logger.error(f"Order {order_id} not found in orders dictionary")
+        order = order_store.get(order_id)
+        if order is None:
+            logger.error(f"Order {order_id} not found in order store")
             return "Order not found", 404
         
-        order = orders[order_id]
         logger.debug(f"Order {order_id} found: {order}")
-        return render_template('status.html', order=order)
+        return render_template('status.html', order=order.to_dict())
     except Exception as e:
         logger.error(f"Error rendering status template: {str(e)}")
         return f"Error: {str(e)}", 500
@@ -333,31 +319,22 @@ def create_order():
             logger.error("Missing required fields")
             return jsonify({'success': False, 'error': 'Missing required fields'})
         
-        result = create_order_web(customer_name, customer_email, cart_items)
+        result, order_id = create_order_web(customer_name, customer_email, cart_items)
         logger.debug(f"Order creation result: {result}")
         
-        if "Order created successfully" in result:
-            # Extract order ID from result
-            try:
-                order_id = int(result.split("Order ID: ")[1].split(",")[0])
-                logger.debug(f"Extracted order ID: {order_id}")
-                logger.debug(f"Available orders: {list(orders.keys())}")
-                
-                # Verify order exists
-                if order_id in orders:
-                    logger.debug(f"Order {order_id} found in orders dictionary")
-                    return jsonify({
-                        'success': True, 
-                        'result': result,
-                        'order_id': order_id,
-                        'redirect_url': f'/payment/{order_id}'
-                    })
-                else:
-                    logger.error(f"Order {order_id} not found in orders dictionary after creation")
-                    return jsonify({'success': False, 'error': f'Order {order_id} was created but not found in storage'})
-            except (IndexError, ValueError) as e:
-                logger.error(f"Error extracting order ID from result: {e}")
-                return jsonify({'success': False, 'error': f'Error extracting order ID: {str(e)}'})
+        if order_id is not None:
+            # Verify order exists
+            if order_id in order_store:
+                logger.debug(f"Order {order_id} found in order store")
+                return jsonify({
+                    'success': True, 
+                    'result': result,
+                    'order_id': order_id,
+                    'redirect_url': f'/payment/{order_id}'
+                })
+            else:
+                logger.error(f"Order {order_id} not found in order store after creation")
+                return jsonify({'success': False, 'error': f'Order {order_id} was created but not found in storage'})
         else:
             logger.error(f"Order creation failed: {result}")
             return jsonify({'success': False, 'error': result})
@@ -400,9 +377,8 @@ def get_order_status():
         
         result = get_order_status_web(order_id)
         
-        if "Error:" not in result:
-            status_data = json.loads(result)
-            return jsonify({'success': True, 'result': status_data})
+        if isinstance(result, dict):
+            return jsonify({'success': True, 'result': result})
         else:
             return jsonify({'success': False, 'error': result})
             
@@ -457,11 +433,21 @@ def process_refund():
 # Debug route to check orders
 @app.route('/debug/orders')
 def debug_orders():
+    """One page of orders; follow next_cursor with ?after=<id>, filter with ?status=, ?payment_status=, ?email="""
     try:
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        orders, next_cursor = order_store.page(
+            request.args.get('after', type=int),
+            limit,
+            customer_email=request.args.get('email') or None,
+            status=request.args.get('status') or None,
+            payment_status=request.args.get('payment_status') or None
+        )
         return jsonify({
-            'orders': orders,
+            'orders': {order['id']: order for order in orders},
             'order_count': len(orders),
-            'order_ids': list(orders.keys())
+            'order_ids': [order['id'] for order in orders],
+            'next_cursor': next_cursor
         })
     except Exception as e:
         return jsonify({'error': str(e)})
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Shared state daemon for Eclipse Coffee Shop
+One local process owns the order and user stores and serves them over a Unix
+socket, so the SOAP service, the web service and all of their workers see the
+same orders and users. Run it with `python state_daemon.py` and start the
+services with COFFEESHOP_STORE=daemon.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import secrets
+import signal
+import threading
+from contextlib import contextmanager
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+from order_model import Order
+from order_store import (STATE_AUTHKEY, STATE_SOCKET, IdempotencyKeyStore, MemoryIdempotencyKeyStore, OrderStore,
+                         UserStore, create_idempotency_key_store, create_order_store, create_user_store)
+
+logger = logging.getLogger(__name__)
+
+# Store methods clients may call, per target
+ORDER_METHODS = ('get', 'get_many', 'add', 'save', 'compare_and_save', 'all', 'ids', 'max_id', 'len', 'contains',
+                 'find', 'page')
+USER_METHODS = ('get', 'add', 'find_by_email', 'max_id', 'len')
+KEY_METHODS = ('claim', 'finish', 'release')
+
+
+def _plain(value):
+    """Turn Order objects into plain dicts before they are pickled onto the wire"""
+    if isinstance(value, Order):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_plain(item) for item in value)
+    return value
+
+
+def _private_directory(path):
+    """Create path as a directory only this user can enter, or check that it already is one"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"State daemon directory {path} must belong to this user and be closed to others "
+                              f"(chmod 700)")
+
+
+def authkey_path(address):
+    """The file holding the key of the daemon listening at address, unless COFFEESHOP_STATE_AUTHKEY is set"""
+    return address + '.key'
+
+
+def _new_authkey(address):
+    path = authkey_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    authkey = secrets.token_hex(32).encode()
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+
+def _client_authkey(address):
+    try:
+        with open(authkey_path(address), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise ConnectionRefusedError(f"No state daemon key at {authkey_path(address)}; start state_daemon.py "
+                                     f"or set COFFEESHOP_STATE_AUTHKEY")
+
+
+def _sendable(error):
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class StateDaemon:
+    """Serves an order store, a user store and the idempotency keys to local clients
+
+    Each client connection gets its own daemon thread. A message is a batch of
+    (target, method, args) calls answered by one list of (ok, value) results.
+    Locks taken with 'acquire' belong to the connection and are released if it
+    drops. ID sequences live here, and clients lease blocks of IDs from them.
+    Without an authkey, a random one is written next to the socket for clients.
+    """
+
+    def __init__(self, address, order_store, user_store, key_store=None, authkey=STATE_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.stores = {'orders': order_store, 'users': user_store, 'keys': key_store or MemoryIdempotencyKeyStore()}
+        self._methods = {'orders': ORDER_METHODS, 'users': USER_METHODS, 'keys': KEY_METHODS}
+        self._sequences = {}
+        self._sequences_lock = threading.Lock()
+        self._listener = None
+        self._authkey = None
+        self._stopping = False
+
+    def serve_forever(self):
+        _private_directory(os.path.dirname(os.path.abspath(self.address)))
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Without a configured key, clients read a fresh one from a file only this user can read
+        self._authkey = self.authkey or _new_authkey(self.address)
+        old_umask = os.umask(0o177)
+        try:
+            # Clients authenticate in their own thread, so a bad or stalled one cannot hold up accepts
+            self._listener = Listener(self.address, family='AF_UNIX')
+        finally:
+            os.umask(old_umask)
+        logger.info(f"State daemon listening on {self.address}")
+        while not self._stopping:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                if self._stopping:
+                    break
+                logger.exception("Error accepting state client")
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self._stopping = True
+        if self._listener is not None:
+            self._listener.close()
+
+    def _authenticate(self, conn):
+        try:
+            deliver_challenge(conn, self._authkey)
+            answer_challenge(conn, self._authkey)
+        except (AuthenticationError, EOFError, OSError) as e:
+            logger.warning(f"Refused state client: {type(e).__name__}: {e}")
+            conn.close()
+            return False
+        return True
+
+    def _serve_connection(self, conn):
+        if not self._authenticate(conn):
+            return
+        held = []
+        try:
+            while True:
+                try:
+                    calls = conn.recv()
+                except (EOFError, OSError):
+                    break
+                results = []
+                for target, method, args in calls:
+                    try:
+                        results.append((True, _plain(self._dispatch(target, method, args, held))))
+                    except Exception as e:
+                        results.append((False, _sendable(e)))
+                conn.send(results)
+        finally:
+            # A client that goes away must not leave orders locked
+            for lock in reversed(held):
+                lock.release()
+            conn.close()
+
+    def _dispatch(self, target, method, args, held):
+        store = self.stores[target]
+        if method == 'acquire':
+            lock = store.locked(*args)
+            lock.acquire()
+            held.append(lock)
+            return None
+        if method == 'release':
+            lock = store.locked(*args)
+            held.remove(lock)
+            lock.release()
+            return None
+        if method == 'lease_ids':
+            floor, count = args
+            return self._sequence(target, floor).lease(count)
+        if method not in self._methods[target]:
+            raise ValueError(f"Unknown {target} store method '{method}'")
+        if method == 'len':
+            return len(store)
+        if method == 'contains':
+            return args[0] in store
+        if method in ('add', 'save'):
+            getattr(store, method)(*args)
+            return None
+        return getattr(store, method)(*args)
+
+    def _sequence(self, target, floor):
+        with self._sequences_lock:
+            sequence = self._sequences.get(target)
+            if sequence is None:
+                sequence = self._sequences[target] = self.stores[target].id_sequence(floor)
+            return sequence
+
+
+class StateClient:
+    """Client side of the state daemon, with one connection per thread of each process"""
+
+    def __init__(self, address, authkey=STATE_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def connection(self):
+        if self._pid != os.getpid():
+            # Forked worker: the parent's connections belong to the parent
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey or _client_authkey(self.address))
+            self._local.conn = conn
+        return conn
+
+    def call_many(self, calls):
+        """Send a batch of (target, method, args) calls in one round trip and return their results
+
+        Calls deferred by this thread go out first, in the same batch.
+        """
+        conn = self.connection()
+        deferred = getattr(self._local, 'deferred', None) or []
+        self._local.deferred = []
+        try:
+            conn.send(deferred + list(calls))
+            results = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        for ok, value in results:
+            if not ok:
+                raise value if isinstance(value, Exception) else RuntimeError(f"State daemon error: {value!r}")
+        return [value for ok, value in results[len(deferred):]]
+
+    def call(self, target, method, *args):
+        return self.call_many([(target, method, args)])[0]
+
+    def defer(self, target, method, *args):
+        """Queue a call whose result is not needed; it is sent with this thread's next batch"""
+        self.connection()
+        self._local.deferred = (getattr(self._local, 'deferred', None) or []) + [(target, method, args)]
+
+    @contextmanager
+    def locked(self, target, key):
+        """Hold a daemon lock for the calls made inside the block
+
+        The lock is taken in the same round trip as the first of those calls,
+        so it orders calls to the daemon, not work done in between.
+        """
+        self.defer(target, 'acquire', key)
+        try:
+            yield
+        finally:
+            self.call(target, 'release', key)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RemoteIdSequence:
+    """ID sequence living in the daemon"""
+
+    def __init__(self, client, target, floor):
+        self.client = client
+        self.target = target
+        self.floor = floor
+
+    def lease(self, count):
+        return self.client.call(self.target, 'lease_ids', self.floor, count)
+
+
+class RemoteOrderStore(OrderStore):
+    """Order store living in the state daemon"""
+
+    def __init__(self, address, client=None):
+        super().__init__()
+        self.client = client or StateClient(address)
+
+    def _call(self, method, *args):
+        return self.client.call('orders', method, *args)
+
+    def locked(self, order_id):
+        return self.client.locked('orders', order_id)
+
+    def id_sequence(self, floor):
+        return RemoteIdSequence(self.client, 'orders', floor)
+
+    def get(self, order_id):
+        order = self._call('get', order_id)
+        return Order.from_dict(order) if order is not None else None
+
+    def get_many(self, order_ids):
+        """Fetch several orders in one round trip (None for missing ones)"""
+        return [Order.from_dict(order) if order is not None else None
+                for order in self._call('get_many', list(order_ids))]
+
+    def add(self, order):
+        self._call('add', Order.from_dict(order).to_dict())
+
+    def save(self, order):
+        self._call('save', Order.from_dict(order).to_dict())
+
+    def compare_and_save(self, order):
+        if not self._call('compare_and_save', Order.from_dict(order).to_dict()):
+            return False
+        order['version'] = order.get('version', 0) + 1
+        return True
+
+    def _compare_and_save_or_reload(self, order):
+        # The fresh copy comes back in the same round trip, for when the save lost a race
+        saved, current = self.client.call_many([('orders', 'compare_and_save', (Order.from_dict(order).to_dict(),)),
+                                                ('orders', 'get', (order['id'],))])
+        if not saved:
+            return False, Order.from_dict(current) if current is not None else None
+        order['version'] = order.get('version', 0) + 1
+        return True, None
+
+    def all(self):
+        return self._call('all')
+
+    def find(self, customer_email=None, status=None, payment_status=None):
+        return self._call('find', customer_email, status, payment_status)
+
+    def page(self, after_id, limit, customer_email=None, status=None, payment_status=None):
+        return tuple(self._call('page', after_id, limit, customer_email, status, payment_status))
+
+    def ids(self):
+        return self._call('ids')
+
+    def max_id(self):
+        return self._call('max_id')
+
+    def __len__(self):
+        return self._call('len')
+
+    def __contains__(self, order_id):
+        return self._call('contains', order_id)
+
+    def close(self):
+        self.client.close()
+
+
+class RemoteUserStore(UserStore):
+    """User store living in the state daemon"""
+
+    def __init__(self, address, client=None):
+        super().__init__()
+        self.client = client or StateClient(address)
+
+    def _call(self, method, *args):
+        return self.client.call('users', method, *args)
+
+    def locked(self, email):
+        return self.client.locked('users', email)
+
+    def id_sequence(self, floor):
+        return RemoteIdSequence(self.client, 'users', floor)
+
+    def get(self, user_id):
+        return self._call('get', user_id)
+
+    def add(self, user):
+        self._call('add', user)
+
+    def find_by_email(self, email, user_type=None):
+        return self._call('find_by_email', email, user_type)
+
+    def max_id(self):
+        return self._call('max_id')
+
+    def __len__(self):
+        return self._call('len')
+
+    def close(self):
+        self.client.close()
+
+
+class RemoteIdempotencyKeyStore(IdempotencyKeyStore):
+    """Idempotency keys living in the state daemon"""
+
+    def __init__(self, address, client=None):
+        self.client = client or StateClient(address)
+
+    def claim(self, operation, key, request, hold):
+        stored = self.client.call('keys', 'claim', operation, key, request, hold)
+        return tuple(stored) if stored is not None else None
+
+    def finish(self, operation, key, result, ttl):
+        self.client.call('keys', 'finish', operation, key, result, ttl)
+
+    def release(self, operation, key):
+        self.client.call('keys', 'release', operation, key)
+
+    def close(self):
+        self.client.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Eclipse Coffee Shop shared state daemon')
+    parser.add_argument('--store', choices=('json', 'sqlite', 'memory'), default='json',
+                        help='backend holding the shared orders and users')
+    parser.add_argument('--path', help='snapshot or database file (defaults to orders.json / coffeeshop.db)')
+    parser.add_argument('--socket', default=STATE_SOCKET, help='Unix socket to listen on')
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(current_dir, 'coffeeshop.db' if args.store == 'sqlite' else 'orders.json')
+    order_store = create_order_store(args.store, path)
+    user_store = create_user_store(args.store, path)
+    key_store = create_idempotency_key_store(args.store, path)
+    daemon = StateDaemon(args.socket, order_store, user_store, key_store)
+
+    def stop(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        daemon.serve_forever()
+    finally:
+        order_store.close()
+        user_store.close()
+        daemon.stores['keys'].close()
+        for path in (args.socket, authkey_path(args.socket)):
+            if os.path.exists(path):
+                os.unlink(path)
+        logger.info("State daemon stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live at the top of the repository; the servers keep their state in memory under test
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('COFFEESHOP_STORE', 'memory')
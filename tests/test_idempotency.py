@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import soap_server_complete as server
+from idempotency import IdempotencyCache
+from order_store import SqliteIdempotencyKeyStore
+from soap_server_complete import OrderResult
+
+
+def test_a_repeated_key_replays_the_first_result():
+    cache, calls = IdempotencyCache(), []
+
+    def create():
+        calls.append(1)
+        return f"Order created successfully. Order ID: {1000 + len(calls)}"
+
+    first = cache.call('createOrder', 'key-1', ('Ann', 'cart'), create)
+    assert cache.call('createOrder', 'key-1', ('Ann', 'cart'), create) == first
+    assert cache.call('createOrder', None, ('Ann', 'cart'), create) != first
+    assert len(calls) == 2
+
+
+def test_a_key_reused_with_other_parameters_is_refused():
+    cache = IdempotencyCache()
+    cache.call('processPayment', 'key-1', (1001, 9.0, 'tng'), lambda: 'Payment processed')
+    assert cache.call('processPayment', 'key-1', (1002, 9.0, 'tng'), lambda: 'Payment processed').startswith('Error')
+
+
+def test_failed_calls_are_not_replayed():
+    cache = IdempotencyCache()
+    assert cache.call('processPayment', 'key-1', (1001,), lambda: 'Error: gateway down').startswith('Error')
+    assert cache.call('processPayment', 'key-1', (1001,), lambda: 'Payment processed') == 'Payment processed'
+
+
+def test_concurrent_duplicates_run_once():
+    cache, calls, results = IdempotencyCache(), [], []
+
+    def pay():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'Payment processed'
+
+    threads = [threading.Thread(target=lambda: results.append(cache.call('processPayment', 'key-1', (1001,), pay)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and results == ['Payment processed'] * 5
+
+
+def test_async_duplicates_run_once():
+    cache, calls = IdempotencyCache(), []
+
+    async def pay():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'Payment processed'
+
+    async def main():
+        return await asyncio.gather(*[cache.call_async('processPayment', 'key-1', (1001,), pay) for _ in range(5)])
+
+    assert asyncio.run(main()) == ['Payment processed'] * 5
+    assert len(calls) == 1
+
+
+def test_entries_expire_after_the_ttl():
+    cache, calls = IdempotencyCache(ttl=0.01), []
+    cache.call('createOrder', 'key-1', (), lambda: calls.append(1))
+    time.sleep(0.02)
+    cache.call('createOrder', 'key-1', (), lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_create_order_retried_with_its_key_creates_one_order():
+    call = json.dumps({'createOrder': ['Ann', 'ann@example.com', '[{"id": 1, "name": "Latte", "price": 4.5, "qty": 1}]',
+                                       'retry-key-1']}).encode()
+    before = len(server.order_store)
+    answers = [server.json_app.handle(call)[2] for _ in range(2)]
+    assert answers[0] == answers[1] and b'Order ID' in answers[0]
+    assert len(server.order_store) == before + 1
+
+
+@pytest.fixture
+def shared(tmp_path):
+    store = SqliteIdempotencyKeyStore(str(tmp_path / 'coffeeshop.db'))
+    yield store
+    store.close()
+
+
+def _worker(shared):
+    # Each server process has its own cache in front of the shared key store
+    return IdempotencyCache(shared=shared, result_types={'createOrder': OrderResult})
+
+
+def _creator(calls, delay=0):
+    def create():
+        calls.append(1)
+        time.sleep(delay)
+        return OrderResult(message='Order created', order_id=1000 + len(calls), status='pending')
+    return create
+
+
+def test_a_retry_reaching_another_worker_replays_the_first_result(shared):
+    calls = []
+    first = _worker(shared).call('createOrder', 'key-1', ('Ann', [{'id': 1}]), _creator(calls))
+    replayed = _worker(shared).call('createOrder', 'key-1', ('Ann', [{'id': 1}]), _creator(calls))
+    assert (replayed.order_id, replayed.message, replayed.status) == (first.order_id, 'Order created', 'pending')
+    assert len(calls) == 1
+    assert _worker(shared).call('createOrder', 'key-1', ('Bo', [{'id': 1}]), _creator(calls)).startswith('Error')
+
+
+def test_a_retry_waits_for_the_call_running_in_another_worker(shared):
+    calls, results = [], []
+    threads = [threading.Thread(target=lambda: results.append(
+        _worker(shared).call('createOrder', 'key-1', (), _creator(calls, delay=0.2)))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and [result.order_id for result in results] == [1001] * 3
+
+
+def test_a_failed_call_can_be_retried_on_another_worker(shared):
+    _worker(shared).call('createOrder', 'key-1', (), lambda: OrderResult(error_code='INVALID_CART', message='Error'))
+    assert _worker(shared).call('createOrder', 'key-1', (), _creator([])).order_id == 1001
+
+
+def test_async_retries_are_replayed_from_the_shared_store(shared):
+    calls = []
+
+    async def create():
+        return _creator(calls)()
+
+    async def main():
+        first = await _worker(shared).call_async('createOrder', 'key-1', (), create)
+        return first, await _worker(shared).call_async('createOrder', 'key-1', (), create)
+
+    first, replayed = asyncio.run(main())
+    assert first.order_id == replayed.order_id and len(calls) == 1
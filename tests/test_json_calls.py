@@ -0,0 +1,30 @@
+import io
+import json
+from wsgiref.util import setup_testing_defaults
+
+import soap_server_complete as server
+
+
+def _post(app, path, document):
+    body = json.dumps(document).encode()
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'CONTENT_TYPE': 'application/json',
+               'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+
+    content = b''.join(app(environ, start_response))
+    return response['status'], content
+
+
+def test_json_calls_are_only_served_without_validation():
+    order_id = server._create_order('Ann', 'ann@example.com', [{'id': 1, 'name': 'Latte', 'price': 4.5,
+                                                                 'qty': 1}]).order_id
+    for path in ('/json', '/v2/json'):
+        status, content = _post(server.wsgi_app('off'), path, {'getOrderStatus': [order_id]})
+        assert status.startswith('200') and json.loads(content)
+        for validation in ('full', 'soft'):
+            status, content = _post(server.wsgi_app(validation), path, {'getOrderStatus': [order_id]})
+            assert not status.startswith('200') and b'Fault' in content
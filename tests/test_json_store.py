@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+import order_store
+from order_store import JsonOrderStore
+
+
+def _order(order_id, status='pending', created_at='2024-01-01T09:00:00'):
+    return {'id': order_id, 'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+            'items': [{'id': 1, 'name': 'Latte', 'price': 4.5, 'qty': 1}], 'total_amount': 4.5,
+            'status': status, 'created_at': created_at, 'payment_status': 'unpaid'}
+
+
+@pytest.fixture
+def fast_compactor(monkeypatch):
+    monkeypatch.setattr(order_store, 'SNAPSHOT_CHECK_INTERVAL', 0.01)
+
+
+def _count_snapshots(store, monkeypatch):
+    calls = []
+    snapshot = store.snapshot
+    monkeypatch.setattr(store, 'snapshot', lambda: (calls.append(1), snapshot()))
+    return calls
+
+
+def test_archiving_is_off_by_default():
+    assert order_store.ARCHIVE_AFTER is None
+
+
+def test_compactor_skips_when_nothing_is_logged(tmp_path, fast_compactor, monkeypatch):
+    store = JsonOrderStore(str(tmp_path / 'orders.json'), snapshot_interval=0.02)
+    snapshots = _count_snapshots(store, monkeypatch)
+    store.start_compactor()
+    time.sleep(0.2)
+    assert snapshots == []
+
+    store.add(_order(1001))
+    time.sleep(0.2)
+    store.close()
+    assert len(snapshots) == 1
+
+
+def test_compactor_runs_for_orders_due_for_the_archive(tmp_path, fast_compactor, monkeypatch):
+    path = str(tmp_path / 'orders.json')
+    store = JsonOrderStore(path)
+    store.add(_order(1001, status='confirmed'))
+    store.snapshot()
+    store.close()
+
+    store = JsonOrderStore(path, snapshot_interval=0.02, archive_after=86400)
+    snapshots = _count_snapshots(store, monkeypatch)
+    store.start_compactor()
+    time.sleep(0.2)
+    store.close()
+    assert len(snapshots) == 1
+    assert 1001 not in store.orders and store.get(1001)['status'] == 'confirmed'
+
+
+@pytest.mark.parametrize('load_mode', ['eager', 'lazy'])
+def test_a_truncated_snapshot_stops_startup_and_is_kept(tmp_path, load_mode):
+    path = str(tmp_path / 'orders.json')
+    store = JsonOrderStore(path)
+    for order_id in (1001, 1002):
+        store.add(_order(order_id))
+    store.snapshot()
+    store.close()
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(content[:len(content) // 2])
+
+    with pytest.raises(ValueError):
+        JsonOrderStore(path, load_mode=load_mode)
+    with open(path, 'rb') as f:
+        assert f.read() == content[:len(content) // 2]
+
+
+def test_a_lone_writer_does_not_wait_out_the_group_commit_window(tmp_path):
+    log = order_store.GroupCommitLog(str(tmp_path / 'orders.log'), window=0.5)
+    start = time.monotonic()
+    for n in range(3):
+        log.append(f'{n}\n')
+    assert time.monotonic() - start < 0.5
+    log.close()
+
+
+def test_concurrent_appends_share_fsyncs(tmp_path, monkeypatch):
+    fsyncs = []
+    fsync = order_store.os.fsync
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.01)
+        fsync(fd)
+
+    monkeypatch.setattr(order_store.os, 'fsync', slow_fsync)
+    path = str(tmp_path / 'orders.log')
+    log = order_store.GroupCommitLog(path, window=0.005)
+    threads = [threading.Thread(target=log.append, args=(f'{n}\n',)) for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.close()
+    with open(path) as f:
+        assert sorted(int(line) for line in f) == list(range(40))
+    assert len(fsyncs) < 40
+
+
+def test_changes_survive_a_restart_through_the_log(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    store = JsonOrderStore(path)
+    store.add(_order(1001))
+    store.add(_order(1002))
+    order = store.get(1001)
+    order['status'] = 'cancelled'
+    store.save(order)
+    store.close()
+    with open(store.log_path, 'a') as f:
+        # A crash mid-append leaves a torn record
+        f.write('{"id": 1003, "customer_')
+
+    restarted = JsonOrderStore(path)
+    assert restarted.get(1001)['status'] == 'cancelled'
+    assert restarted.get(1002)['status'] == 'pending'
+    assert 1003 not in restarted
+    restarted.close()
+
+
+def test_appends_after_a_torn_record_survive_the_next_restart(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    store = JsonOrderStore(path)
+    store.add(_order(1001))
+    store.close()
+    with open(store.log_path, 'a') as f:
+        f.write('{"id": 1002, "customer_')
+
+    restarted = JsonOrderStore(path)
+    restarted.add(_order(1003))
+    restarted.close()
+    again = JsonOrderStore(path)
+    assert sorted(again.ids()) == [1001, 1003]
+    again.close()
+
+
+def test_an_unreadable_record_before_the_last_fails_the_load(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    store = JsonOrderStore(path)
+    store.add(_order(1001))
+    store.add(_order(1002))
+    store.close()
+    with open(store.log_path) as f:
+        lines = f.readlines()
+    with open(store.log_path, 'w') as f:
+        f.write(lines[0][:20] + '\n' + lines[1])
+
+    with pytest.raises(ValueError):
+        JsonOrderStore(path)
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from benchmark import SAMPLE_ORDER, _measure, _sample_orders
+from order_model import Order, json_default
+
+
+def test_round_trip_keeps_fields_and_their_order():
+    order = dict(SAMPLE_ORDER, payment_method='tng', version=2, loyalty_note='extra field')
+    restored = Order.from_dict(json.loads(json.dumps(order)))
+    assert restored.to_dict() == order
+    assert list(restored.to_dict()) == list(order)
+    assert json.dumps(restored, default=json_default) == json.dumps(order)
+
+
+def test_behaves_like_an_order_dict():
+    order = Order.from_dict(SAMPLE_ORDER)
+    assert order['items'][1]['qty'] == 2 and order.get('items')[0]['name'] == 'Cappuccino'
+    assert 'refund_status' not in order and order.get('refund_status') is None
+    with pytest.raises(KeyError):
+        order['refund_status']
+
+    changed = order.copy()
+    changed['status'] = 'confirmed'
+    assert order['status'] == SAMPLE_ORDER['status'] and changed['status'] == 'confirmed'
+
+
+def test_orders_take_at_least_half_less_memory_than_dicts():
+    dict_bytes = _measure(lambda n: {o['id']: o for o in _sample_orders(n)}, 2000)
+    order_bytes = _measure(lambda n: {o['id']: Order.from_dict(o) for o in _sample_orders(n)}, 2000)
+    assert order_bytes <= 0.5 * dict_bytes
@@ -0,0 +1,79 @@
+import pytest
+
+from order_store import JsonOrderStore, MemoryOrderStore, SqliteOrderStore, VersionConflict
+
+
+@pytest.fixture(params=['memory', 'json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryOrderStore()
+    elif request.param == 'json':
+        store = JsonOrderStore(str(tmp_path / 'orders.json'))
+    else:
+        store = SqliteOrderStore(str(tmp_path / 'coffeeshop.db'))
+    store.add({'id': 1001, 'customer_name': 'Ann', 'customer_email': 'ann@example.com', 'items': [],
+               'total_amount': 4.5, 'status': 'pending', 'created_at': '2024-01-01T09:00:00',
+               'payment_status': 'unpaid'})
+    yield store
+    store.close()
+
+
+def test_compare_and_save_rejects_a_stale_copy(store):
+    first, second = store.get(1001), store.get(1001)
+    first['status'] = 'cancelled'
+    assert store.compare_and_save(first)
+    second['status'] = 'confirmed'
+    assert not store.compare_and_save(second)
+    assert store.get(1001)['status'] == 'cancelled' and store.get(1001)['version'] == 1
+
+
+def test_transition_reapplies_a_change_that_lost_a_race(store):
+    attempts = []
+
+    def apply(order):
+        attempts.append(order['status'])
+        if len(attempts) == 1:
+            # Another writer saves the order between this read and the save
+            winner = store.get(1001)
+            winner['status'] = 'awaiting_cash_payment'
+            store.compare_and_save(winner)
+        order['payment_status'] = 'paid'
+        return order['status'], True
+
+    assert store.transition(1001, apply) == 'awaiting_cash_payment'
+    assert attempts == ['pending', 'awaiting_cash_payment']
+    order = store.get(1001)
+    assert (order['status'], order['payment_status'], order['version']) == ('awaiting_cash_payment', 'paid', 2)
+
+
+def test_transition_refuses_an_unexpected_version(store):
+    with pytest.raises(VersionConflict):
+        store.transition(1001, lambda order: (None, True), expected_version=3)
+    assert store.get(1001).get('version', 0) == 0
+
+
+def _pages(store, limit, **filters):
+    order_ids, cursor = [], None
+    while True:
+        orders, cursor = store.page(cursor, limit, **filters)
+        order_ids.extend(order['id'] for order in orders)
+        if cursor is None:
+            return order_ids
+
+
+def test_pages_follow_the_cursor_through_changing_orders(store):
+    # Added out of order, and some change status, so the sorted IDs and postings have to move
+    for order_id in [1040, 1003, 1021, 1017, 1009, 1035, 1002, 1028]:
+        store.add({'id': order_id, 'customer_name': 'Bo', 'customer_email': f'Bo{order_id % 2}@example.com',
+                   'items': [], 'total_amount': 4.5, 'status': 'pending', 'created_at': '2024-01-01T09:00:00',
+                   'payment_status': 'unpaid'})
+    for order_id in (1003, 1017, 1040):
+        order = store.get(order_id)
+        order['status'], order['payment_status'] = 'confirmed', 'paid'
+        store.save(order)
+
+    assert _pages(store, 3) == [1001, 1002, 1003, 1009, 1017, 1021, 1028, 1035, 1040]
+    assert _pages(store, 2, status='pending') == [1001, 1002, 1009, 1021, 1028, 1035]
+    assert _pages(store, 2, customer_email='bo1@example.com', status='pending') == [1009, 1021, 1035]
+    assert _pages(store, 1, customer_email='BO0@example.com', payment_status='paid') == [1040]
+    assert _pages(store, 5, status='refunded') == []
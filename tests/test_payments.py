@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import soap_server_complete as server
+from payment_gateway import PaymentDeclined
+
+
+class RecordingGateway:
+    """Records charges, which take a moment so concurrent requests overlap"""
+
+    def __init__(self, decline=False):
+        self.decline = decline
+        self.charges = []
+        self._lock = threading.Lock()
+
+    def charge(self, order_id, amount, payment_method):
+        time.sleep(0.005)
+        if self.decline:
+            raise PaymentDeclined('insufficient funds')
+        with self._lock:
+            self.charges.append(order_id)
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = RecordingGateway()
+    monkeypatch.setattr(server, 'payment_gateway', gateway)
+    return gateway
+
+
+def _new_order():
+    return server._create_order('Ann', 'ann@example.com', [{'id': 1, 'name': 'Latte', 'price': 4.5, 'qty': 2}])
+
+
+def test_concurrent_payments_and_cancel_charge_at_most_once(gateway):
+    for _ in range(30):
+        order_id = _new_order().order_id
+        calls = [lambda: server._process_payment(order_id, 9.0, 'credit_card') for _ in range(3)]
+        calls.append(lambda: server._cancel_order(order_id))
+        threads = [threading.Thread(target=call) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order = server.order_store.get(order_id)
+        charges = gateway.charges.count(order_id)
+        if order['status'] == 'cancelled':
+            assert charges == 0
+        else:
+            assert (order['status'], order['payment_status'], charges) == ('confirmed', 'paid', 1)
+
+
+def test_declined_payment_restores_the_order(gateway):
+    order_id = _new_order().order_id
+    gateway.decline = True
+    result = server._process_payment(order_id, 9.0, 'credit_card')
+    assert result.error_code == 'PAYMENT_DECLINED'
+    assert server.order_store.get(order_id)['status'] == 'pending'
+
+    gateway.decline = False
+    assert server._process_payment(order_id, 9.0, 'credit_card').error_code is None
+    assert gateway.charges == [order_id]
+
+
+def test_async_server_charges_at_most_once(monkeypatch):
+    import async_soap_server
+
+    class AsyncGateway(RecordingGateway):
+        async def charge_async(self, order_id, amount, payment_method):
+            await asyncio.sleep(0.005)
+            self.charges.append(order_id)
+
+    gateway = AsyncGateway()
+    monkeypatch.setattr(async_soap_server, 'payment_gateway', gateway)
+    app = async_soap_server.AsyncSoapApplication(server.soap_app)
+
+    async def race(order_id):
+        return await asyncio.gather(*[app._process_payment(order_id, 9.0, 'tng', None) for _ in range(3)],
+                                    app.run(server._cancel_order, order_id))
+
+    for _ in range(30):
+        order_id = _new_order().order_id
+        asyncio.run(race(order_id))
+        order = server.order_store.get(order_id)
+        assert gateway.charges.count(order_id) == (0 if order['status'] == 'cancelled' else 1)
@@ -0,0 +1,33 @@
+from unittest import mock
+
+import pytest
+from requests.exceptions import ReadTimeout
+
+from soap_client import PooledTransport
+
+
+def _sent_timeouts(transport, operation):
+    with mock.patch.object(transport.session, 'post') as post:
+        transport.post('http://localhost/soap', b'<x/>', {'SOAPAction': f'"{operation}"'})
+    return post.call_args.kwargs['timeout']
+
+
+def test_calls_wait_for_their_operation_timeout():
+    transport = PooledTransport(connect_timeout=2, read_timeout=5, operation_timeouts={'getMenu': 1})
+    assert _sent_timeouts(transport, 'getMenu') == (2, 1)
+    assert _sent_timeouts(transport, 'unknownOperation') == (2, 5)
+
+
+def test_zeep_timeout_setting_is_passed_to_the_session():
+    transport = PooledTransport(connect_timeout=2, read_timeout=5)
+    with transport.settings(timeout=0.25):
+        assert _sent_timeouts(transport, 'getMenu') == 0.25
+    assert _sent_timeouts(transport, 'getMenu') == (2, 5)
+
+
+def test_timeouts_are_counted_by_operation():
+    transport = PooledTransport()
+    with mock.patch.object(transport.session, 'post', side_effect=ReadTimeout()):
+        with pytest.raises(ReadTimeout):
+            transport.post_operation('createOrder', 'http://localhost/soap', b'<x/>', {})
+    assert transport.timeouts == {'createOrder': 1}
@@ -0,0 +1,131 @@
+import os
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from order_store import MemoryOrderStore, MemoryUserStore
+from state_daemon import (RemoteIdempotencyKeyStore, RemoteOrderStore, RemoteUserStore, StateClient, StateDaemon,
+                          authkey_path)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    os.chmod(tmp_path, 0o700)
+    daemon = StateDaemon(str(tmp_path / 'state.sock'), MemoryOrderStore(), MemoryUserStore())
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(daemon.address):
+            break
+        time.sleep(0.01)
+    yield daemon
+    daemon.stop()
+
+
+def test_clients_authenticate_with_the_key_file(daemon):
+    assert os.stat(authkey_path(daemon.address)).st_mode & 0o777 == 0o600
+    store = RemoteOrderStore(daemon.address)
+    store.add({'id': 1001, 'customer_name': 'Ann', 'customer_email': 'ann@example.com', 'items': [],
+               'total_amount': 0.0, 'status': 'pending', 'created_at': '2024-01-01T00:00:00',
+               'payment_status': 'unpaid'})
+    assert store.get(1001)['customer_name'] == 'Ann'
+    store.close()
+
+
+def test_idempotency_keys_are_shared_through_the_daemon(daemon):
+    first, second = RemoteIdempotencyKeyStore(daemon.address), RemoteIdempotencyKeyStore(daemon.address)
+    assert first.claim('createOrder', 'key-1', '["Ann"]', 60) is None
+    assert second.claim('createOrder', 'key-1', '["Ann"]', 60) == ('["Ann"]', None)
+    first.finish('createOrder', 'key-1', '{"order_id": 1001}', 60)
+    assert second.claim('createOrder', 'key-1', '["Ann"]', 60) == ('["Ann"]', '{"order_id": 1001}')
+    first.close()
+    second.close()
+
+
+def _count_round_trips(store, monkeypatch):
+    round_trips = []
+    call_many = store.client.call_many
+    monkeypatch.setattr(store.client, 'call_many', lambda calls: (round_trips.append(len(calls)), call_many(calls))[1])
+    return round_trips
+
+
+def test_a_transition_that_loses_a_race_rereads_in_the_same_round_trip(daemon, monkeypatch):
+    store, rival = RemoteOrderStore(daemon.address), RemoteOrderStore(daemon.address)
+    store.add({'id': 1001, 'customer_name': 'Ann', 'customer_email': 'ann@example.com', 'items': [],
+               'total_amount': 0.0, 'status': 'pending', 'created_at': '2024-01-01T00:00:00',
+               'payment_status': 'unpaid'})
+    round_trips = _count_round_trips(store, monkeypatch)
+
+    def apply(order):
+        if order['status'] == 'pending':
+            winner = rival.get(1001)
+            winner['status'] = 'awaiting_cash_payment'
+            rival.compare_and_save(winner)
+        order['payment_status'] = 'paid'
+        return order['status'], True
+
+    assert store.transition(1001, apply) == 'awaiting_cash_payment'
+    # The read, the losing save with its re-read, and the winning save
+    assert len(round_trips) == 3 and store.get(1001)['version'] == 2
+    store.close()
+    rival.close()
+
+
+def test_locks_are_taken_with_the_first_call_they_cover(daemon, monkeypatch):
+    store = RemoteUserStore(daemon.address)
+    round_trips = _count_round_trips(store, monkeypatch)
+    with store.locked('ann@example.com'):
+        assert store.find_by_email('ann@example.com') is None
+        store.add({'id': 101, 'email': 'ann@example.com', 'type': 'member'})
+    # The lock with the lookup, the insert, and the release
+    assert len(round_trips) == 3
+
+    # Another client's locked call waits until the lock is released
+    events = []
+    with store.locked('bo@example.com'):
+        store.find_by_email('bo@example.com')
+        waiter = threading.Thread(target=lambda: _locked_lookup(daemon.address, 'bo@example.com', events))
+        waiter.start()
+        time.sleep(0.1)
+        events.append('released')
+    waiter.join()
+    assert events == ['released', 'looked up']
+    store.close()
+
+
+def _locked_lookup(address, email, events):
+    store = RemoteUserStore(address)
+    with store.locked(email):
+        store.find_by_email(email)
+        events.append('looked up')
+    store.close()
+
+
+def test_clients_without_the_key_are_refused(daemon):
+    with pytest.raises(AuthenticationError):
+        StateClient(daemon.address, authkey=b'eclipse-coffee-state').call('orders', 'len')
+    # Neither a wrong key nor a client that hangs up mid-handshake stops the daemon accepting others
+    socket.socket(socket.AF_UNIX).connect(daemon.address)
+    client = StateClient(daemon.address)
+    assert client.call('orders', 'len') == 0
+    client.close()
+
+
+def test_a_stalled_handshake_does_not_block_other_clients(daemon):
+    stalled = socket.socket(socket.AF_UNIX)
+    stalled.connect(daemon.address)
+    client = StateClient(daemon.address)
+    assert client.call('orders', 'len') == 0
+    client.close()
+    stalled.close()
+
+
+def test_daemon_refuses_a_directory_others_can_enter(tmp_path):
+    os.chmod(tmp_path, 0o755)
+    daemon = StateDaemon(str(tmp_path / 'state.sock'), MemoryOrderStore(), MemoryUserStore())
+    with pytest.raises(PermissionError):
+        daemon.serve_forever()
+    assert not os.path.exists(daemon.address)
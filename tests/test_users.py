@@ -0,0 +1,35 @@
+import pytest
+
+import soap_server_complete as server
+from order_store import DuplicateEmail, SqliteUserStore
+
+
+def _member(user_id, email):
+    return {'id': user_id, 'name': 'Ann Lee', 'email': email, 'type': 'member', 'password': 'secret'}
+
+
+def test_sqlite_rejects_a_second_member_with_the_same_email(tmp_path):
+    path = str(tmp_path / 'users.db')
+    first, second = SqliteUserStore(path), SqliteUserStore(path)
+    first.add(_member(1, 'ann@example.com'))
+    with pytest.raises(DuplicateEmail):
+        second.add(_member(2, ' Ann@Example.com'))
+    second.add({'id': 3, 'name': 'Ann', 'email': 'ann@example.com', 'type': 'guest'})
+
+
+def test_registration_racing_another_process_answers_email_taken(tmp_path, monkeypatch):
+    path = str(tmp_path / 'users.db')
+    store, other_process = SqliteUserStore(path), SqliteUserStore(path)
+    find_by_email = store.find_by_email
+
+    def find_then_lose_the_race(email, user_type=None):
+        # The other worker inserts between this one's check and its insert
+        user = find_by_email(email, user_type)
+        other_process.add(_member(999, email))
+        return user
+
+    monkeypatch.setattr(store, 'find_by_email', find_then_lose_the_race)
+    monkeypatch.setattr(server, 'user_store', store)
+    result = server._register_member('Ann', 'Lee', 'ann@example.com', '555-0100', 'secret')
+    assert result.error_code == 'EMAIL_TAKEN'
+    assert len(store) == 1
@@ -0,0 +1,8 @@
+import soap_server_complete as server
+
+
+def test_v2_orders_store_item_ids_like_v1():
+    items = [server.OrderItem(id='3', name='Latte', price=4.5, qty=1),
+             server.OrderItem(id='latte', name='Latte', price=4.5, qty=1)]
+    order_id = server._create_order('Ann', 'ann@example.com', server._cart(items)).order_id
+    assert [item['id'] for item in server.order_store.get(order_id)['items']] == [3, 'latte']
@@ -1,5 +1,5 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory
-from zeep import Client
+from soap_client import WSDL_PATH, CoffeeShopSOAPClient
 import os
 import logging
 
@@ -21,10 +21,9 @@ app = Flask(__name__,
             template_folder=template_folder,
             static_folder=static_folder)
 
-# SOAP client setup
-WSDL_URL = "http://localhost:8000/?wsdl"
-logger.debug(f"WSDL URL: {WSDL_URL}")
-client = Client(WSDL_URL)
+# SOAP client setup, from the bundled WSDL; it is loaded on the first call, so the app boots without the server
+logger.debug(f"WSDL: {WSDL_PATH}")
+client = CoffeeShopSOAPClient(lazy=True)
 
 @app.route('/')
 def index():
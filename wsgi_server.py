@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Production WSGI serving for Eclipse Coffee Shop
+Each process answers requests from a fixed thread pool over HTTP/1.1 keep-alive;
+optional pre-forked worker processes share the listening sockets, and SIGTERM or
+Ctrl+C stops accepting connections and lets in-flight requests finish
+"""
+
+import logging
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+from werkzeug.wsgi import LimitedStream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 16
+# Idle keep-alive connections are closed after this many seconds so they cannot pin pool threads
+KEEPALIVE_TIMEOUT = 5.0
+LISTEN_BACKLOG = 128
+
+
+class KeepAliveServerHandler(ServerHandler):
+    """wsgiref response handler answering in HTTP/1.1"""
+
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        # Without a length the body ends when the connection does
+        if 'Content-Length' not in self.headers:
+            self.headers['Connection'] = 'close'
+            self.request_handler.close_connection = True
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """wsgiref request handler serving several requests per HTTP/1.1 connection"""
+
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except TimeoutError:
+            # Idle keep-alive connection
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+
+        # Chunked request bodies cannot be delimited here, so such connections are not reused
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            self.close_connection = True
+        body = LimitedStream(self.rfile, int(self.headers.get('Content-Length') or 0))
+        handler = KeepAliveServerHandler(
+            body, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=True, multiprocess=self.server.multiprocess
+        )
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+        # Skip whatever the application left unread so the next request line lines up
+        body.exhaust()
+        # While draining, finish the current request but do not wait for another one
+        if self.server.draining:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """wsgiref WSGI server dispatching accepted connections to a fixed pool of threads"""
+
+    request_queue_size = LISTEN_BACKLOG
+    allow_reuse_address = True
+    multiprocess = False
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, handler=KeepAliveRequestHandler):
+        super().__init__((host, port), handler)
+        self.set_app(app)
+        self.threads = threads
+        self.draining = False
+        # Worker threads are only started on first use, so the pool survives a fork
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Stop accepting connections; serve_forever() returns once in-flight requests are done"""
+        if not self.draining:
+            self.draining = True
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+def _stop_on_signals(servers):
+    def stop(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, finishing in-flight requests (pid {os.getpid()})")
+        for server in servers:
+            server.drain()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+
+def _serve_all(servers):
+    """Serve every listener, the first one in this thread, until all of them are drained"""
+    others = [threading.Thread(target=server.serve_forever, name=f'listener-{server.server_port}')
+              for server in servers[1:]]
+    for thread in others:
+        thread.start()
+    try:
+        servers[0].serve_forever()
+    finally:
+        for server in servers[1:]:
+            server.drain()
+        for thread in others:
+            thread.join()
+
+
+def _spawn_worker(servers):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            _stop_on_signals(servers)
+            _serve_all(servers)
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} crashed")
+            status = 1
+        finally:
+            os._exit(status)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+
+def serve(app, host, port, threads=DEFAULT_THREADS, workers=1, keepalive_timeout=KEEPALIVE_TIMEOUT,
+          listeners=None):
+    """Serve a WSGI app until SIGTERM/SIGINT, with `workers` processes of `threads` threads each
+
+    With more than one worker, the parent only binds the sockets, forks the
+    workers, restarts any that die and forwards shutdown signals to them.
+    Every worker has its own copy of module-level state, so the application
+    must keep shared state in a store that works across processes.
+    listeners maps further ports on host to the WSGI apps they serve; each
+    one gets its own `threads` threads in every worker.
+    """
+    handler = type('KeepAliveRequestHandler', (KeepAliveRequestHandler,), {'timeout': keepalive_timeout})
+    servers = [ThreadPoolWSGIServer(host, listener_port, listener_app, threads=threads, handler=handler)
+               for listener_port, listener_app in [(port, app)] + list((listeners or {}).items())]
+    for server in servers:
+        server.multiprocess = workers > 1
+        logger.info(f"Serving on http://{host}:{server.server_port} with {workers} worker(s) x {threads} threads")
+
+    if workers <= 1:
+        _stop_on_signals(servers)
+        _serve_all(servers)
+        logger.info("Server stopped")
+        return
+
+    children = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        logger.info(f"Received {signal.Signals(signum).name}, stopping {len(children)} workers")
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        children.add(_spawn_worker(servers))
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            children.add(_spawn_worker(servers))
+
+    for server in servers:
+        server.socket.close()
+    logger.info("All workers stopped")